@@ -0,0 +1,38 @@
+"""
+Measure the cost of a debug log call when the DEBUG level is disabled.
+
+Run with `python -m benchmarks.bench_logging` from the repository root.
+"""
+import logging
+import timeit
+from types import SimpleNamespace
+
+from utils.logger import FakeLogger, LoggerConstant
+
+
+def main(number: int = 100000, repeat: int = 5):
+    base_logger = logging.getLogger("benchmark")
+    base_logger.setLevel(logging.INFO)
+    base_logger.propagate = False
+
+    logger = FakeLogger(logger=base_logger)
+    guild = SimpleNamespace(id=336642139381301249, name="Coroned")
+    channel = SimpleNamespace(id=694531384873713704, name="general")
+    member = SimpleNamespace(id=138751484517941259, name="Eyesofcreeper", discriminator="0001")
+    constant = LoggerConstant(logger, guild, channel, member)
+    infection_chance, infect = 12, False
+
+    cases = {
+        "f-string (eager)": lambda: logger.debug(f"Infection chance is {infection_chance}%, infect={infect}", guild=guild, channel=channel, member=member),
+        "format args (lazy)": lambda: logger.debug("Infection chance is %d%%, infect=%s", infection_chance, infect, guild=guild, channel=channel, member=member),
+        "LoggerConstant (lazy)": lambda: constant.debug("%s buy in progress", "🧼"),
+        "stdlib logger.debug": lambda: base_logger.debug("Infection chance is %d%%, infect=%s", infection_chance, infect),
+    }
+
+    for name, case in cases.items():
+        elapsed = min(timeit.repeat(case, number=number, repeat=repeat))
+        print(f"{name:<24} {elapsed / number * 1e9:8.1f} ns/call")
+
+
+if __name__ == '__main__':
+    main()
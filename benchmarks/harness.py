@@ -0,0 +1,302 @@
+"""
+End-to-end throughput harness. It drives the real MyBot and cogs without connecting to Discord: a fake gateway feeds
+guild and message payloads to the discord.py connection state, and a fake HTTP client answers the REST calls (sends,
+channel history, member fetches and edits) after a configurable latency.
+
+Run with `python -m benchmarks.harness` from the repository root. The database is an in-memory SQLite one, unless a
+URL is given with --database-url (e.g. a local, disposable, postgres database).
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import itertools
+import random
+import sys
+import time
+import typing
+
+import discord
+from discord.http import HTTPClient, Route
+from tortoise import Tortoise
+
+from utils.bot_class import MyBot
+from utils.formats import TabularData
+from utils.metrics import LogHistogram
+
+BOT_ID = 694530935487492107
+GUILD_ID = 336642139381301249
+
+DEFAULT_COMMANDS = ["profile", "work", "school", "research", "shop 🧼", "use 🧻", "statistics"]
+DEFAULT_COGS = ["cogs.error_handling", "cogs.coronavirus"]
+
+
+def user_payload(user_id: int, name: str = None, bot: bool = False) -> dict:
+    return {"id": str(user_id), "username": name or f"User {user_id}", "discriminator": f"{user_id % 10000:04d}",
+            "avatar": None, "bot": bot}
+
+
+def member_payload(user_id: int) -> dict:
+    return {"user": user_payload(user_id), "roles": [], "joined_at": "2020-04-01T00:00:00+00:00", "deaf": False, "mute": False}
+
+
+class FakeHTTP(HTTPClient):
+    """
+    Answers the REST calls the bot makes, after `latency` seconds, and keeps the messages of every channel for the
+    history calls.
+    """
+    def __init__(self, latency: float, loop=None):
+        super().__init__(loop=loop)
+        self.latency = latency
+        # Time of the messages, the replay uses the recorded time instead.
+        self.clock: typing.Callable[[], datetime.datetime] = datetime.datetime.utcnow
+        self.snowflakes = itertools.count()
+        self.channel_guilds: typing.Dict[int, int] = {}
+        # channel_id -> message payloads, oldest first.
+        self.channel_messages: typing.Dict[int, typing.Deque[dict]] = collections.defaultdict(lambda: collections.deque(maxlen=200))
+        self.requests = collections.Counter()
+
+    def next_snowflake(self) -> int:
+        return discord.utils.time_snowflake(self.clock()) + next(self.snowflakes) % (1 << 22)
+
+    def message_payload(self, channel_id: int, author_id: int, content: str, bot: bool = False) -> dict:
+        message_id = self.next_snowflake()
+        data = {"id": str(message_id), "channel_id": str(channel_id), "guild_id": str(self.channel_guilds.get(channel_id, GUILD_ID)),
+                "author": user_payload(author_id, bot=bot), "content": content,
+                "timestamp": discord.utils.snowflake_time(message_id).isoformat(), "edited_timestamp": None,
+                "tts": False, "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [],
+                "embeds": [], "pinned": False, "type": 0}
+        if not bot:
+            data["member"] = {key: value for key, value in member_payload(author_id).items() if key != "user"}
+
+        self.channel_messages[channel_id].append(data)
+        return data
+
+    async def request(self, route: Route, *, files=None, form=None, **kwargs):
+        self.requests[(route.method, route.path)] += 1
+        await asyncio.sleep(self.latency)
+
+        if route.path == "/channels/{channel_id}/messages":
+            if route.method == "POST":
+                payload = kwargs.get("json") or {}
+                return self.message_payload(route.channel_id, BOT_ID, payload.get("content") or "", bot=True)
+            return self.logs_from_cache(route.channel_id, kwargs.get("params", {}))
+        elif route.path == "/guilds/{guild_id}/members/{member_id}" and route.method == "GET":
+            return member_payload(int(route.url.rsplit("/", 1)[1]))
+
+        # Edits, deletions and reactions, nothing to return.
+        return None
+
+    def logs_from_cache(self, channel_id: int, params: dict) -> typing.List[dict]:
+        limit = params.get("limit", 50)
+        messages = list(self.channel_messages[channel_id])
+        if "before" in params:
+            messages = [m for m in messages if int(m["id"]) < int(params["before"])][-limit:]
+        elif "after" in params:
+            messages = [m for m in messages if int(m["id"]) > int(params["after"])][:limit]
+        else:
+            messages = messages[-limit:]
+        return messages[::-1]
+
+    async def close(self):
+        pass
+
+
+class HarnessBot(MyBot):
+    def __init__(self, *args, database_url: str, **kwargs):
+        self.database_url = database_url
+        super().__init__(*args, **kwargs)
+        # Pending event handlers for every message, and when it was dispatched.
+        self.pending_handlers: typing.Counter[int] = collections.Counter()
+        self.dispatched_at: typing.Dict[int, float] = {}
+        self.message_latency = LogHistogram()
+
+    def reload_config(self):
+        super().reload_config()
+        self.config["database"]["url"] = self.database_url
+        self.config["logging"]["level"] = "WARNING"
+        self.config["metrics"] = {"enabled": False}
+        self.config["recording"] = {"enabled": False}
+
+    @staticmethod
+    def event_message_id(event_name: str, args: tuple) -> typing.Optional[int]:
+        """The message an event handler works on, for the message and command events."""
+        if event_name == "on_message":
+            return args[0].id
+        elif event_name in ("on_command", "on_command_completion", "on_command_error"):
+            return args[0].message.id
+        return None
+
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        message_id = self.event_message_id(event_name, args)
+        if message_id in self.dispatched_at:
+            self.pending_handlers[message_id] += 1
+        return super()._schedule_event(coro, event_name, *args, **kwargs)
+
+    async def _run_event(self, coro, event_name, *args, **kwargs):
+        try:
+            await super()._run_event(coro, event_name, *args, **kwargs)
+        finally:
+            message_id = self.event_message_id(event_name, args)
+            if message_id in self.pending_handlers:
+                self.pending_handlers[message_id] -= 1
+                if self.pending_handlers[message_id] <= 0:
+                    del self.pending_handlers[message_id]
+                    self.message_latency.record(time.perf_counter() - self.dispatched_at.pop(message_id))
+
+
+class QueryCounter:
+    """Counts the queries sent to the database, by wrapping the tortoise connection methods."""
+    METHODS = ("execute_query", "execute_query_dict", "execute_insert", "execute_many", "execute_script")
+
+    def __init__(self):
+        self.count = 0
+
+    def install(self, connection):
+        for name in self.METHODS:
+            original = getattr(connection, name, None)
+            if original is not None:
+                setattr(connection, name, self.wrap(original))
+
+    def wrap(self, original):
+        async def counted(*args, **kwargs):
+            self.count += 1
+            return await original(*args, **kwargs)
+        return counted
+
+
+async def start_bot(database_url: str, rest_latency: float, cogs: typing.List[str]) -> HarnessBot:
+    bot = HarnessBot(description="Harness", database_url=database_url)
+    bot.http = bot._connection.http = FakeHTTP(rest_latency, loop=bot.loop)
+
+    for cog_name in cogs:
+        bot.load_extension(cog_name)
+
+    while not Tortoise._inited:
+        await asyncio.sleep(0.01)
+
+    state = bot._connection
+    state.user = discord.ClientUser(state=state, data=user_payload(BOT_ID, "Coroned", bot=True))
+    # Checked instead of fetching the application info.
+    bot.owner_id = BOT_ID
+    bot._ready.set()
+    return bot
+
+
+def add_guild(bot: HarnessBot, guild_id: int, channel_ids: typing.List[int], member_count: int, game_roles: bool = True):
+    """Feed a GUILD_CREATE to the bot. The game roles and log channel are created in the game guild only."""
+    role_ids = []
+    if game_roles:
+        coronavirus_config = bot.config["cogs"].get("Coronavirus", {})
+        role_ids = [coronavirus_config.get(key) for key in ("infected_role_id", "cured_role_id", "dead_role_id")]
+        if coronavirus_config.get("log_channel_id"):
+            # Not in the channels the messages are sent from, the game only posts there.
+            channel_ids = channel_ids + [coronavirus_config["log_channel_id"]]
+
+    for channel_id in channel_ids:
+        bot.http.channel_guilds[channel_id] = guild_id
+
+    bot._connection._add_guild_from_data({
+        "id": str(guild_id), "name": f"Guild {guild_id}", "owner_id": str(BOT_ID), "member_count": member_count,
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False}] +
+                 [{"id": str(role_id), "name": f"Role {role_id}", "permissions": "0", "position": 1, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False} for role_id in role_ids if role_id],
+        "channels": [{"id": str(channel_id), "type": 0, "name": f"channel-{i}", "position": i,
+                      "permission_overwrites": []} for i, channel_id in enumerate(channel_ids)],
+        "members": [member_payload(BOT_ID)],
+    })
+
+
+async def drain(bot: HarnessBot, timeout: float):
+    """Wait for the handlers of the dispatched messages to finish."""
+    deadline = time.perf_counter() + timeout
+    while bot.pending_handlers and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+
+
+async def run(args):
+    bot = await start_bot(args.database_url, args.rest_latency, args.cogs)
+    bot.rng.seed(args.seed)
+    channels = [GUILD_ID + 1 + i for i in range(args.channels)]
+    add_guild(bot, GUILD_ID, channels, args.users + 1)
+    state = bot._connection
+    queries = QueryCounter()
+    queries.install(Tortoise.get_connection("default"))
+
+    rng = random.Random(args.seed)
+    users = [10 ** 17 + i for i in range(args.users)]
+    prefix = bot.config["bot"]["prefixes"][0]
+
+    sent = commands_sent = 0
+    start = time.perf_counter()
+    interval = 1 / args.rate
+    while time.perf_counter() - start < args.duration:
+        if rng.random() < args.command_ratio:
+            content = prefix + rng.choice(args.commands)
+            commands_sent += 1
+        else:
+            content = "Hello there"
+
+        data = bot.http.message_payload(rng.choice(channels), rng.choice(users), content)
+        bot.dispatched_at[int(data["id"])] = time.perf_counter()
+        state.parse_message_create(data)
+        sent += 1
+
+        # Open loop: keep the rate even if the bot falls behind, to see where it saturates.
+        next_at = start + sent * interval
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+    sending_time = time.perf_counter() - start
+    await drain(bot, args.drain_timeout)
+    elapsed = time.perf_counter() - start
+
+    report(bot, args, sent, commands_sent, sending_time, elapsed, queries.count)
+
+    await bot.close()
+    await Tortoise.close_connections()
+
+
+def report(bot: HarnessBot, args, sent: int, commands_sent: int, sending_time: float, elapsed: float, query_count: int):
+    done = bot.message_latency.count
+    print(f"{sent} messages sent ({commands_sent} commands) in {sending_time:.1f}s, target {args.rate}/s, "
+          f"REST latency {args.rest_latency * 1000:.0f}ms")
+    print(f"{done} processed in {elapsed:.1f}s: {done / elapsed:.1f} messages/s, {len(bot.pending_handlers)} still pending")
+    print(f"{query_count} database queries, {query_count / max(done, 1):.2f} per message. "
+          f"{sum(bot.http.requests.values())} REST calls, {sum(bot.http.requests.values()) / max(done, 1):.2f} per message")
+    print_latencies(bot)
+
+
+def print_latencies(bot: HarnessBot):
+    table = TabularData()
+    table.set_columns(["Kind", "Name", "Count", "p50 (ms)", "p95 (ms)", "p99 (ms)", "Max (ms)"])
+    histograms = [(("message", "end to end"), bot.message_latency)] + sorted(bot.metrics.histograms.items())
+    for (kind, name), histogram in histograms:
+        if kind == "loop":
+            continue
+        table.add_row([kind, name, histogram.count] +
+                      [f"{value * 1000:.1f}" for value in (histogram.percentile(50), histogram.percentile(95), histogram.percentile(99), histogram.max)])
+    print(table.render())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive the bot with fake Discord traffic and measure its throughput.")
+    parser.add_argument("--rate", type=float, default=50, help="messages per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds spent sending messages")
+    parser.add_argument("--command-ratio", type=float, default=0.2, help="fraction of the messages that are commands")
+    parser.add_argument("--commands", nargs="+", default=DEFAULT_COMMANDS, help="commands to send, without the prefix")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--rest-latency", type=float, default=0.05, help="seconds taken by every fake REST call")
+    parser.add_argument("--database-url", default="sqlite://:memory:")
+    parser.add_argument("--cogs", nargs="+", default=DEFAULT_COGS)
+    parser.add_argument("--drain-timeout", type=float, default=30, help="seconds to wait for the last messages")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    asyncio.get_event_loop().run_until_complete(run(args))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Replay a traffic trace recorded by utils.traffic through the real bot, with the fake gateway and REST API of the
+harness.
+
+Run with `python -m benchmarks.replay recordings/traffic.bin` from the repository root.
+    --speed 1          replay at the recorded pace, 10 for ten times faster, or max to send as fast as possible
+    --sequential       wait for every message to be fully processed before the next one
+    --seed 0           seed of the game randomness
+
+Messages get the recorded timestamps, so the channel histories are the same at any speed. A sequential replay with the
+same seed gives the same game outcome, printed as a digest at the end.
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import hashlib
+import sys
+import time
+
+from tortoise import Tortoise
+
+from benchmarks.harness import DEFAULT_COGS, QueryCounter, add_guild, drain, print_latencies, start_bot
+from utils.models import Player
+from utils.traffic import read_trace
+
+
+async def game_digest() -> str:
+    players = await Player.all().order_by("discord_id").values_list("discord_id", "percent_infected", "cured", "total_infected_points", "total_cured_points")
+    return hashlib.blake2b(repr(players).encode(), digest_size=8).hexdigest()
+
+
+async def run(args):
+    records = list(read_trace(args.trace))[:args.limit]
+    if not records:
+        print("The trace is empty.")
+        return
+
+    guild_channels = collections.defaultdict(set)
+    for record in records:
+        guild_channels[record.guild_id].add(record.channel_id)
+    guild_channels.pop(0, None)  # Direct messages, not replayed.
+
+    bot = await start_bot(args.database_url, args.rest_latency, args.cogs)
+    bot.rng.seed(args.seed)
+    for i, (guild_id, channel_ids) in enumerate(guild_channels.items()):
+        add_guild(bot, guild_id, sorted(channel_ids), member_count=100, game_roles=i == 0)
+
+    queries = QueryCounter()
+    queries.install(Tortoise.get_connection("default"))
+    state = bot._connection
+    prefix = bot.config["bot"]["prefixes"][0]
+
+    replay_time = datetime.datetime.utcfromtimestamp(records[0].timestamp)
+    bot.http.clock = lambda: replay_time
+
+    sent = 0
+    first_timestamp = records[0].timestamp
+    start = time.perf_counter()
+    for record in records:
+        if not record.guild_id:
+            continue
+
+        if args.speed != "max":
+            send_at = start + (record.timestamp - first_timestamp) / float(args.speed)
+            await asyncio.sleep(max(0.0, send_at - time.perf_counter()))
+
+        replay_time = datetime.datetime.utcfromtimestamp(record.timestamp)
+        content = prefix + record.text if record.is_command else "..."
+        data = bot.http.message_payload(record.channel_id, record.author_id, content)
+        bot.dispatched_at[int(data["id"])] = time.perf_counter()
+        state.parse_message_create(data)
+        sent += 1
+
+        if args.sequential:
+            await drain(bot, args.drain_timeout)
+        elif args.speed == "max":
+            await asyncio.sleep(0)
+
+    await drain(bot, args.drain_timeout)
+    elapsed = time.perf_counter() - start
+    done = bot.message_latency.count
+
+    print(f"{sent} messages replayed from {len(records)} records, spanning {records[-1].timestamp - first_timestamp:.0f}s, "
+          f"in {elapsed:.1f}s at speed {args.speed}{' (sequential)' if args.sequential else ''}")
+    print(f"{done / elapsed:.1f} messages/s, {queries.count / max(done, 1):.2f} database queries per message")
+    print_latencies(bot)
+    print(f"Game state digest (seed {args.seed}): {await game_digest()}")
+
+    await bot.close()
+    await Tortoise.close_connections()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded traffic trace through the bot.")
+    parser.add_argument("trace")
+    parser.add_argument("--speed", default="1", help="speed factor, or max")
+    parser.add_argument("--sequential", action="store_true", help="process the messages one at a time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--limit", type=int, default=None, help="only replay the first records")
+    parser.add_argument("--rest-latency", type=float, default=0.0, help="seconds taken by every fake REST call")
+    parser.add_argument("--database-url", default="sqlite://:memory:")
+    parser.add_argument("--cogs", nargs="+", default=DEFAULT_COGS)
+    parser.add_argument("--drain-timeout", type=float, default=30)
+    args = parser.parse_args(argv)
+
+    if args.speed != "max":
+        float(args.speed)  # Fail early on a bad speed.
+
+    asyncio.get_event_loop().run_until_complete(run(args))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
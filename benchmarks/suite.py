@@ -0,0 +1,238 @@
+"""
+Microbenchmarks of the game hot functions. They run offline: no discord connection and no database are needed.
+
+Run with `python -m benchmarks.suite` from the repository root.
+    --output results.json      save the results
+    --compare baseline.json    compare with saved results, and exit with an error when a benchmark regressed
+    --threshold 0.1            slowdown (10% by default) flagged as a regression
+    --filter infect            only run the benchmarks whose name contains this
+"""
+import argparse
+import datetime
+import platform
+import random
+import statistics
+import sys
+import timeit
+import typing
+from types import SimpleNamespace
+
+import rapidjson
+
+from utils import game_rules, human_time, models
+from utils.contacts import ContactGraph
+from utils.rng import GameRNG
+from utils.bot_class import get_prefix
+from utils.formats import TabularData
+
+BENCHMARKS: typing.Dict[str, typing.Callable[[], typing.Callable[[], typing.Any]]] = {}
+
+
+def benchmark(name: str):
+    """Register a setup function, returning the callable to time."""
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+def make_player(discord_id: int = 138751484517941259, **fields) -> models.Player:
+    fields.setdefault("touched_last", datetime.datetime.utcnow())
+    player = models.Player(discord_id=discord_id, discord_name="Eyesofcreeper#0001", good=models.AlignementGood.neutral,
+                           law=models.AlignementLaw.neutral, charisma=5, **fields)
+    player.achievements = models.Achievements(player_id=discord_id)
+    player.inventory = models.Inventory(player_id=discord_id)
+    return player
+
+
+def run_coroutine(coroutine):
+    """Run a coroutine that never suspends, without the event loop overhead."""
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError("The coroutine suspended")
+
+
+@benchmark("Player.infect")
+def bench_infect():
+    player = make_player()
+
+    def infect():
+        player.percent_infected = 10
+        player.infect(4)
+    return infect
+
+
+@benchmark("Player.can_be_touched")
+def bench_can_be_touched():
+    return make_player().can_be_touched
+
+
+@benchmark("ContactGraph.pressure")
+def bench_contact_graph_pressure():
+    contacts = ContactGraph()
+    for user_id in range(10):
+        contacts.record(0, user_id, user_id)
+        contacts.set_infectious(user_id, user_id % 3 == 0)
+    contacts.now += 60
+    return lambda: contacts.pressure(9)
+
+
+@benchmark("random.randint")
+def bench_random_randint():
+    return lambda: random.randint(0, 100)
+
+
+@benchmark("GameRNG.randint")
+def bench_game_rng_randint():
+    rng = GameRNG(0)
+    return lambda: rng.randint(0, 100)
+
+
+@benchmark("InfectionTable.pressure_index")
+def bench_infection_table():
+    player = make_player(percent_infected=12, immunodeficient=True)
+    table = game_rules.InfectionTable()
+    return lambda: table.chances[table.pressure_index(player, 2.4)]
+
+
+@benchmark("ContactGraph.record")
+def bench_contact_graph_record():
+    contacts = ContactGraph()
+    rng = random.Random(0)
+    for user_id in range(0, 1000, 3):
+        contacts.set_infectious(user_id, True)
+    state = {"now": 0.0}
+
+    def record():
+        state["now"] += 0.5
+        contacts.record(rng.randrange(20), rng.randrange(1000), state["now"])
+    return record
+
+
+@benchmark("InfectionTable pressure roll")
+def bench_exposure():
+    player = make_player(percent_infected=12, immunodeficient=True)
+    table = game_rules.InfectionTable()
+    rng = GameRNG(0)
+
+    def roll():
+        player.percent_infected = 12
+        game_rules.roll_exposure(player, 2.4, rng, table)
+    return roll
+
+
+@benchmark("get_prefix")
+def bench_get_prefix():
+    bot = SimpleNamespace(config={"bot": {"prefixes": ["c!", "c?", "C!"]}}, user=SimpleNamespace(id=694530935487492107, mention="<@694530935487492107>"))
+    message = SimpleNamespace(guild=SimpleNamespace(id=336642139381301249), content="c!profile")
+    return lambda: run_coroutine(get_prefix(bot, message))
+
+
+@benchmark("game_rules.find_item")
+def bench_find_item():
+    # The last item, so the whole list is scanned.
+    return lambda: game_rules.find_item(models.ItemsEmojis.virus_test.value)
+
+
+@benchmark("TabularData.render")
+def bench_tabular_data():
+    table = TabularData()
+    table.set_columns(["Kind", "Name", "Count", "p50 (ms)", "p95 (ms)", "p99 (ms)", "Max (ms)"])
+    table.add_rows([["stage", f"stage_{i}", i * 17, "1.2", "4.5", "10.1", "33.0"] for i in range(20)])
+    return table.render
+
+
+@benchmark("human_time.human_timedelta")
+def bench_human_timedelta():
+    dt = datetime.datetime.utcnow() - datetime.timedelta(days=3, hours=4, minutes=12)
+    return lambda: human_time.human_timedelta(dt)
+
+
+@benchmark("human_time.ShortTime")
+def bench_short_time():
+    now = datetime.datetime.utcnow()
+    return lambda: human_time.ShortTime("2w3d12h30m", now=now)
+
+
+@benchmark("human_time.HumanTime")
+def bench_human_time():
+    now = datetime.datetime.utcnow()
+    return lambda: human_time.HumanTime("tomorrow at 5pm", now=now)
+
+
+def measure(function: typing.Callable[[], typing.Any], repeat: int, min_time: float) -> dict:
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    timings = [elapsed / number * 1e9 for elapsed in timer.repeat(repeat=repeat, number=number)]
+    return {"min_ns": min(timings), "median_ns": statistics.median(timings), "number": number, "repeat": repeat}
+
+
+def run(name_filter: str = None, repeat: int = 5, min_time: float = 0.2) -> dict:
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if name_filter and name_filter not in name:
+            continue
+        results[name] = measure(setup(), repeat, min_time)
+        print(f"{name:<32} {results[name]['min_ns']:12.1f} ns/call")
+
+    return {
+        "date": datetime.datetime.utcnow().isoformat(),
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> typing.List[str]:
+    """Print the change for every benchmark in both runs, and return the names of those that regressed."""
+    regressions = []
+    table = TabularData()
+    table.set_columns(["Benchmark", "Baseline (ns)", "Current (ns)", "Change", ""])
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+
+        change = result["min_ns"] / before["min_ns"] - 1
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        table.add_row([name, f"{before['min_ns']:.1f}", f"{result['min_ns']:.1f}", f"{change:+.1%}", "REGRESSION" if regressed else ""])
+
+    print(table.render())
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the game hot functions.")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown flagged as a regression")
+    parser.add_argument("--filter", help="only run the benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds spent in each repeat")
+    args = parser.parse_args(argv)
+
+    current = run(args.filter, args.repeat, args.min_time)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(rapidjson.dumps(current, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = rapidjson.loads(f.read())
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmarks regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
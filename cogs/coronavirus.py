@@ -1,129 +1,260 @@
-import random
-from datetime import timedelta, datetime
+import asyncio
+import collections
+import itertools
+from datetime import datetime, timedelta, timezone
 
 import discord
 import typing
 
 from discord.ext import commands
 
-from utils import models
+from utils import checks, game_rules, human_time, models, tracing
 from utils.cog_class import Cog
+from utils.cooldowns import shared_cooldown
+from utils.coordinator import LockTimeout
 from utils.ctx_class import MyContext
+from utils.enablement import EnablementIndex
+from utils.jobs import job
+from utils.scheduler import EffectScheduler
 
 from tortoise.contrib.pydantic import pydantic_model_creator
 
 
 class Coronavirus(Cog):
-    async def maybe_find(self, player, message):
+    def __init__(self, bot, *args, **kwargs):
+        super().__init__(bot, *args, **kwargs)
+        self.reconcile_lock = asyncio.Lock()
+        # discord_id -> ((player version, user name, avatar), rendered profile embed)
+        self.profile_cache: typing.Dict[int, typing.Tuple[tuple, discord.Embed]] = collections.OrderedDict()
+        self.enablement_config = self.config()
+        self.enablement = EnablementIndex.from_config(self.enablement_config)
+        self.infection_config = self.config().get("infection")
+        self.infection_table = game_rules.InfectionTable.from_config(self.infection_config or {})
+        self.scheduler = EffectScheduler(bot, game_rules.EFFECTS, batch_size=self.config().get("effects_batch_size", 1000))
+
+    def is_enabled_for(self, message: discord.Message, count: bool = True) -> bool:
+        config = self.config()
+        if config is not self.enablement_config:
+            # The configuration was reloaded, rebuild the index but keep the counters.
+            enablement = EnablementIndex.from_config(config)
+            enablement.processed, enablement.rejected = self.enablement.processed, self.enablement.rejected
+            self.enablement_config, self.enablement = config, enablement
+
+        return self.enablement.allows(message, count)
+
+    def get_infection_table(self) -> game_rules.InfectionTable:
+        config = self.config().get("infection")
+        if config is not self.infection_config:
+            # The configuration was reloaded, the balancing may have changed.
+            self.infection_config, self.infection_table = config, game_rules.InfectionTable.from_config(config or {})
+        return self.infection_table
+
+    def get_game_guild(self) -> typing.Optional[discord.Guild]:
+        infected_role_id = self.config()['infected_role_id']
+        return discord.utils.find(lambda g: g.get_role(infected_role_id) is not None, self.bot.guilds)
+
+    def game_roles(self) -> typing.Tuple[int, int, int]:
+        config = self.config()
+        return config['dead_role_id'], config['cured_role_id'], config['infected_role_id']
+
+    def game_role(self, player: models.Player) -> typing.Optional[int]:
+        """The one game role of the player, by order of precedence: dead, cured, then infected."""
+        dead_role_id, cured_role_id, infected_role_id = self.game_roles()
         if player.is_dead():
-            return
+            return dead_role_id
+        elif player.achievements.vaccined:
+            return cured_role_id
+        elif player.achievements.tested_positive:
+            return infected_role_id
+        return None
+
+    def update_game_role(self, member: typing.Union[discord.Member, discord.User], player: models.Player, reason: str):
+        self.bot.role_updater.set_exclusive(member, self.game_roles(), self.game_role(player), reason=reason)
 
-        find_chance = int(player.isolation/2)
-        if random.randint(0, 1000) <= find_chance:
-            # herb = fields.IntField(default=0)  # Can be found
-            # music_cd = fields.IntField(default=0)  # Can be found
-            items = models.ItemsEmojis
+    async def reconcile_roles(self) -> collections.Counter:
+        """
+        Compare the game roles of every player with their state in the database, and queue the missing changes.
+        Players are streamed from the database in pages, and compared with the roles of the guild members.
+        """
+        counts = collections.Counter()
+        guild = self.get_game_guild()
+        if guild is None:
+            self.bot.logger.warning("Can't reconcile roles, the game guild was not found.")
+            return counts
+
+        config = self.config()
+        page_size = config.get('reconcile_page_size', 500)
+        last_id = 0
+
+        async with self.reconcile_lock:
+            self.bot.logger.info("Reconciling roles with the database...", guild=guild)
+
+            while True:
+                players = await models.Player.filter(discord_id__gt=last_id).order_by('discord_id').limit(page_size).prefetch_related('achievements')
+                if not players:
+                    break
+                last_id = players[-1].discord_id
+
+                # Members are not all cached when guild chunking is disabled, query the missing ones from the gateway.
+                members = {player.discord_id: guild.get_member(player.discord_id) for player in players}
+                missing_ids = [discord_id for discord_id, member in members.items() if member is None and self.bot.intents.members]
+                for i in range(0, len(missing_ids), 100):
+                    for member in await guild.query_members(user_ids=missing_ids[i:i + 100], limit=100, cache=False):
+                        members[member.id] = member
+
+                for player in players:
+                    counts['players'] += 1
+                    member = members[player.discord_id]
+                    if member is None:
+                        counts['not in guild'] += 1
+                        continue
+
+                    member_roles = {role.id for role in member.roles}
+                    game_role = self.game_role(player)
+
+                    for role_id in self.game_roles():
+                        wanted = role_id == game_role
+                        if wanted != (role_id in member_roles):
+                            self.bot.role_updater.enqueue(member, role_id, wanted, reason="Roles reconciliation")
+                            counts['roles added' if wanted else 'roles removed'] += 1
+
+                self.bot.logger.debug("Roles reconciliation: %d players checked", counts['players'], guild=guild)
+
+            self.bot.logger.info(f"Roles reconciliation done: {dict(counts)}", guild=guild)
+
+        return counts
+
+    async def send_message(self, channel: discord.TextChannel, content: str) -> discord.Message:
+        with self.bot.metrics.timer("rest", "send"):
+            return await channel.send(content)
+
+    async def send_log(self, guild: discord.Guild, content: str):
+        channel = guild.get_channel(self.config()['log_channel_id'])
+        if not self.bot.load_shedder.defer_log(self.send_message, channel, content):
+            await self.send_message(channel, content)
+
+    async def cog_before_invoke(self, ctx: MyContext):
+        # The players of the command, its author and the members it targets, are held until it's done. That way, a
+        # message or a command handled by another cluster can't overwrite what it changes.
+        discord_ids = {ctx.author.id}
+        discord_ids.update(argument.id for argument in itertools.chain(ctx.args, ctx.kwargs.values()) if isinstance(argument, (discord.User, discord.Member)))
+        try:
+            with self.bot.metrics.timer("lock", "acquire"):
+                lease = await self.bot.coordinator.acquire(self.bot.db.player_keys(discord_ids))
+        except LockTimeout:
+            raise checks.PlayersBusy()
+
+        # The cooldown tokens are only taken once the players are ours, a busy command doesn't cost any. The after
+        # invoke hook doesn't run when this one fails, the lease is released here then.
+        try:
+            await super().cog_before_invoke(ctx)
+        except BaseException:
+            self.bot.coordinator.release(lease)
+            raise
+        ctx.players_lease = lease
+
+    async def cog_after_invoke(self, ctx: MyContext):
+        lease = getattr(ctx, "players_lease", None)
+        if lease is not None:
+            self.bot.coordinator.release(lease)
+
+    @job(seconds=1, max_runtime=60, leader_only=True)
+    async def scheduler_tick(self):
+        if not self.scheduler.loaded:
+            pending = await self.scheduler.load()
+            self.bot.logger.info(f"{pending} scheduled effects loaded")
+        elif self.bot.cluster.clustered:
+            await self.scheduler.poll()
+
+        applied = await self.scheduler.tick()
+        if not applied:
+            return
 
-            choices = [items.herb, items.music_cd, items.toilet_paper,
-                       items.virus_test, items.music_cd, items.toilet_paper,
-                       items.virus_test, items.music_cd,
-                       items.virus_test, items.mask]  # 1/10 of each
+        guild = self.get_game_guild()
+        for player, effect, outcome in applied:
+            member = guild.get_member(player.discord_id) if guild else None
+            if member and effect == "vaccine":
+                self.update_game_role(member, player, reason="Vaccine! (won)")
 
-            choice = random.choice(choices)
+    @job(minutes=5, max_runtime=120)
+    async def refresh_counters(self):
+        await self.bot.db.refresh_counters()
 
-            item_attr_name = items(choice).name
-            player.inventory.__setattr__(item_attr_name, player.inventory.__getattribute__(item_attr_name) + 1)
+    def quarantine(self, player: models.Player) -> typing.Tuple[str, timedelta, int]:
+        """
+        Lock the player in their bunker. Returns the effect getting them out, with the isolation they had before, to
+        schedule once the player is saved.
+        """
+        previous = player.isolation
+        if previous == models.Isolation.lives_in_bunker:
+            # Locked again during a quarantine: the first one releases them where they were before it.
+            previous = models.Isolation.stays_at_home_city
+        player.isolation = models.Isolation.lives_in_bunker
+        return "quarantine_end", timedelta(seconds=self.config().get("quarantine_duration", 21600)), previous.value
+
+    async def save_from_message(self, player: models.Player):
+        """save_player for the message pipeline, timed as its save stage."""
+        with self.bot.metrics.timer("stage", "save"):
             await self.bot.db.save_player(player)
-            await message.channel.send(f"Hey {message.author.mention}, is that {choice.value} yours? I found it in this channel, guess you can keep it, I have no use for it anyway.")
 
-    async def maybe_infect(self, player, message):
+    async def maybe_find(self, player, message, weight: float = 1):
+        rng = self.bot.rng.for_guild(message.guild)
+        choice = game_rules.roll_find(player, rng, weight)
+        if choice is not None:
+            await self.save_from_message(player)
+            await self.send_message(message.channel, f"Hey {message.author.mention}, is that {choice.value} yours? I found it in this channel, guess you can keep it, I have no use for it anyway.")
+
+    async def maybe_infect(self, player, message, weight: float = 1):
+        rng = self.bot.rng.for_guild(message.guild)
         if player.is_dead():
             return
 
         if player.achievements.vaccined:
             return
 
-        infection_chance = 10
-        channel_history = message.channel.history(limit=10, before=message.created_at, after=message.created_at - timedelta(minutes=15))
-        talking_with_members = {m.author async for m in channel_history}
-
-        for member in talking_with_members:
-            member_player = await self.bot.db.get_player(member)
-            if member_player.is_infected():
-                infection_chance += 8
-            elif member_player.is_dead():
-                infection_chance += 20
-
-        if player.immunodeficient:
-            infection_chance *= 2
+        pressure = self.bot.contacts.pressure(player.discord_id)
+        infection_chance, infect = game_rules.roll_exposure(player, pressure, rng, self.get_infection_table(), weight)
 
-        infection_chance *= player.isolation/10
-
-        if player.is_infected():
-            # Less chance to up the infection is we are already infected
-            infection_chance -= 10
-            infection_chance /= 2
-
-        infection_chance /= 4
-
-        if player.cured:
-            infection_chance /= 2
-
-        infection_chance = max(round(infection_chance), 1)
-        infect = random.randint(0, 100) <= infection_chance
-
-        self.bot.logger.debug(message=f"Infection chance is {infection_chance}%, infect={infect}", guild=message.guild, channel=message.channel, member=message.author)
+        self.bot.logger.debug("Infection pressure is %.2f, chance is %d%%, infect=%s", pressure, infection_chance, infect, guild=message.guild, channel=message.channel, member=message.author, sample="infection")
         if infect:
-            player.infect()
-            await self.bot.db.save_player(player)
-
-    async def maybe_test(self, player, message):
-        if player.is_dead():
-            if not player.achievements.died:
-                player.achievements.died = True
-                await self.bot.db.save_player(player)
-                await message.channel.send(f"🎈 RIP {message.author.mention}. He's dead, Jim!")
-                await (message.guild.get_channel(self.config()['log_channel_id']).send(f"Looks like {message.author.mention} is dead :("))
-                if not message.author.discriminator == "0000":
-                    await message.author.add_roles(message.guild.get_role(self.config()['dead_role_id']), reason="RIP!")
+            await self.save_from_message(player)
 
+    async def maybe_test(self, player, message, weight: float = 1):
+        rng = self.bot.rng.for_guild(message.guild)
+        outcome = game_rules.roll_test(player, rng, weight)
+        if outcome is None:
             return
 
-        if player.achievements.tested_positive:
+        if outcome == "died":
+            await self.save_from_message(player)
+            await self.send_message(message.channel, f"🎈 RIP {message.author.mention}. He's dead, Jim!")
+            await self.send_log(message.guild, f"Looks like {message.author.mention} is dead :(")
+            self.update_game_role(message.author, player, reason="RIP!")
             return
 
-        if not player.is_infected() or player.percent_infected <= 15:
-            return
-
-        if random.randint(0,100) <= int(player.percent_infected / 10):
-            if player.percent_infected <= 30:
-                player.achievements.it_was_just_a_cold = True
-                await message.channel.send(f"🤒 Bruh {message.author.mention}, you don't feel so well... Maybe you should have some rest!")
-            elif player.percent_infected <= 40:
-                player.achievements.symptoms = True
-                await message.channel.send(f"🤒 Bruh {message.author.mention}, you don't feel so well... Maybe you should see a doctor!")
-            elif player.percent_infected <= 50:
-                player.achievements.bad_symptoms = True
-                await message.channel.send(f"🤒 Bruh {message.author.mention}, control yourself and stop vomiting on my shoes!")
-            elif player.percent_infected <= 60:
-                player.achievements.hospital_stay = True
-                await message.channel.send(f"🤒 Bruh {message.author.mention}, you should go to the hospital!")
+        if outcome == "it_was_just_a_cold":
+            await self.send_message(message.channel, f"🤒 Bruh {message.author.mention}, you don't feel so well... Maybe you should have some rest!")
+        elif outcome == "symptoms":
+            await self.send_message(message.channel, f"🤒 Bruh {message.author.mention}, you don't feel so well... Maybe you should see a doctor!")
+        elif outcome == "bad_symptoms":
+            await self.send_message(message.channel, f"🤒 Bruh {message.author.mention}, control yourself and stop vomiting on my shoes!")
+        elif outcome == "hospital_stay":
+            await self.send_message(message.channel, f"🤒 Bruh {message.author.mention}, you should go to the hospital!")
 
-            player.achievements.tested_positive = True
-            await self.bot.db.save_player(player)
-            if not message.author.discriminator == "0000":
-                await message.author.add_roles(message.guild.get_role(self.config()['infected_role_id']), reason="Achoo!")
+        await self.save_from_message(player)
+        self.update_game_role(message.author, player, reason="Achoo!")
 
-            await (message.guild.get_channel(self.config()['log_channel_id']).send(f"Looks like {message.author.mention} is infected :("))
+        await self.send_log(message.guild, f"Looks like {message.author.mention} is infected :(")
 
     @commands.command()
-    @commands.cooldown(2, 600, commands.BucketType.user)
+    @shared_cooldown(2, 600, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.user)
     @commands.max_concurrency(3, commands.BucketType.category)
     async def work(self, ctx: MyContext):
         """
         Work and gain some 🛠️ you can exchange for 💰 (salary)️ later at the shop.
         """
+        rng = self.bot.rng.for_guild(ctx.guild)
         player = await self.bot.db.get_player(ctx.author)
         if player.is_dead():
             await ctx.send("❌ It's harder to work if you are dead :(")
@@ -132,52 +263,54 @@ class Coronavirus(Cog):
         player.inventory.working_points += 2
         player.statistics.worked_times += 1
 
-        if random.randint(0, 100) <= 6:
+        if rng.randint(0, 100) <= 6:
             player.isolation = models.Isolation.construction_worker
 
         await self.bot.db.save_player(player)
         await ctx.send("🧰 You worked for a while")
 
     @commands.command()
-    @commands.cooldown(1, 3600, commands.BucketType.user)
+    @shared_cooldown(1, 3600, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.user)
     @commands.max_concurrency(3, commands.BucketType.category)
     async def school(self, ctx: MyContext):
         """
         When I grow up, I wanna become a doctor!
         """
+        rng = self.bot.rng.for_guild(ctx.guild)
         player = await self.bot.db.get_player(ctx.author)
         if player.is_dead():
             await ctx.send("❌ It's harder to do science when you are dead :(")
             return
 
-        if random.randint(0, 100) <= 35 * (1 + int(player.doctor)):
+        if rng.randint(0, 100) <= 35 * (1 + int(player.doctor)):
             player.inventory.education += (1 + int(player.inventory.education/10))
-            if random.randint(0, 100) <= 6:
+            if rng.randint(0, 100) <= 6:
                 player.isolation = models.Isolation.essential_worker
             await ctx.send("🧬 Let's practice medicine")
 
-        elif not player.doctor and (random.randint(0, 100) <= 10 or player.inventory.education >= 15):
+        elif not player.doctor and (rng.randint(0, 100) <= 10 or player.inventory.education >= 15):
             player.inventory.education += 3
             player.doctor = True
-            if random.randint(0, 100) <= 6:
+            if rng.randint(0, 100) <= 6:
                 player.isolation = models.Isolation.essential_worker
             await ctx.send("🎓️ Doctor, you completed your degree!")
         else:
             await ctx.send("❌ You really should stop going out every night, it would be better for your studies...")
-            if random.randint(0, 100) <= 6:
+            if rng.randint(0, 100) <= 6:
                 player.isolation = models.Isolation.goes_to_parties
 
         await self.bot.db.save_player(player)
 
     @commands.command()
-    @commands.cooldown(1, 1200, commands.BucketType.user)
+    @shared_cooldown(1, 1200, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.user)
     @commands.max_concurrency(3, commands.BucketType.category)
     async def research(self, ctx: MyContext):
         """
         Serious place for serious people to get to know 🧠 more about the sickness. Find me a cure, buddy!
         """
+        rng = self.bot.rng.for_guild(ctx.guild)
         player = await self.bot.db.get_player(ctx.author)
         if player.is_dead():
             await ctx.send("❌ It's harder to do science when you are dead :(")
@@ -189,13 +322,13 @@ class Coronavirus(Cog):
 
         player.statistics.researched_times += 1
 
-        if random.randint(0, 100) <= 5:
+        if rng.randint(0, 100) <= 5:
             await ctx.send("👎️ You failed your research, badly :(")
             player.inventory.knowledge_points = int(player.inventory.knowledge_points/10) + 1
         else:
             player.inventory.knowledge_points += 2 * player.inventory.education
 
-            if random.randint(0, 100) <= 6:
+            if rng.randint(0, 100) <= 6:
                 player.isolation = models.Isolation.medical_personnel
             await ctx.send("🧬 You are searching for a cure...")
 
@@ -203,7 +336,7 @@ class Coronavirus(Cog):
 
     @commands.command()
     @commands.guild_only()
-    @commands.cooldown(1, 200, commands.BucketType.user)
+    @shared_cooldown(1, 200, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.guild)
     async def hug(self, ctx: MyContext, *, target: discord.Member):
         """
@@ -232,17 +365,14 @@ class Coronavirus(Cog):
         player.statistics.hugs_given += 1
         target_player.statistics.hugs_recived += 1
 
-        if player.is_infected() or target_player.is_infected():
-            player.infect()
-            player.infect()
-            target_player.infect()
+        game_rules.hug_contagion(player, target_player, self.bot.rng.for_guild(ctx.guild))
 
         await self.bot.db.save_player(player)
         await self.bot.db.save_player(target_player)
         await ctx.send(f"❤️ Love is good, in these times of hardness. {ctx.author.mention} 💑 {target.mention}")
 
     @commands.command(aliases=["buy"])
-    @commands.cooldown(2, 10, commands.BucketType.user)
+    @shared_cooldown(2, 10, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.category, wait=True)
     async def shop(self, ctx: MyContext, what:str):
@@ -253,8 +383,8 @@ class Coronavirus(Cog):
         The shopkeeper is name, his name is Jeff.
         Don't go there too often, you don't wanna catch the virus I guess.
         """
+        rng = self.bot.rng.for_guild(ctx.guild)
         items = models.ItemsEmojis
-        items_list = list([e.value for e in models.ItemsEmojis])
         player = await self.bot.db.get_player(ctx.author)
         if player.is_dead():
             await ctx.send("❌ Oh no! It appears that you are not alive :(")
@@ -264,16 +394,16 @@ class Coronavirus(Cog):
             await ctx.send("It's {current_year} and we still don't know how to use emoji lol")
             return
 
-        item = next((item for item in items_list if item in what), None)
+        item = game_rules.find_item(what)
 
         if not item:
             messages = ["It's {current_year} and we still don't know what emoji to use lol",
                         "Hmm... what are you buying? 🤔",
                         "I'm sorry Dave, I'm afraid I cannot let you do that..."]
-            await ctx.send(random.choice(messages))
+            await ctx.send(rng.choice(messages))
             return
 
-        ctx.logger.debug(f"{item} buy in progress")
+        ctx.logger.debug("%s buy in progress", item)
 
         # money = fields.BigIntField(default=0)  # Comes from work
         # soap = fields.IntField(default=1)  # Can be bought
@@ -283,15 +413,15 @@ class Coronavirus(Cog):
 
         if item == items.money.value:
             if player.inventory.working_points >= 6:
-                money_to_add = random.randint(5, 30)
-                player.inventory.working_points -= random.randint(1, 6)
+                money_to_add = rng.randint(5, 30)
+                player.inventory.working_points -= rng.randint(1, 6)
                 player.inventory.money += money_to_add
                 await ctx.send(f"{item} : Here's your pay... [**money**: {money_to_add}]")
             else:
                 await ctx.send(f"{item} : Go to work, you lazy ass!")
         elif item == items.soap.value:
             if player.inventory.money >= 60:
-                cost = random.randint(-40, -10)
+                cost = rng.randint(-40, -10)
                 player.inventory.money += cost
                 player.inventory.soap += 1
                 await ctx.send(f"{item} : Wash your hands regularly... [**soap**: 1, **money**: {cost}]")
@@ -299,7 +429,7 @@ class Coronavirus(Cog):
                 await ctx.send(f"{item} : Y'know, I also need payment sometimes... Get some {items.money.value} and come back later!")
         elif item == items.food.value:
             if player.inventory.money >= 70:
-                cost = random.randint(-70, -5)
+                cost = rng.randint(-70, -5)
                 player.inventory.money += cost
                 player.inventory.food += 1
                 await ctx.send(f"{item} : Don't forget to eat 5 vegetables a day... [**food**: 1, **money**: {cost}]")
@@ -315,7 +445,7 @@ class Coronavirus(Cog):
                 await ctx.send(f"{item} : WTF No, don't fly during this outbreak!")
         elif item == items.lottery_ticket.value:
             if player.inventory.money >= 150:
-                cost = random.randint(-150, 5)
+                cost = rng.randint(-150, 5)
                 player.inventory.money += cost
                 player.inventory.lottery_ticket += 1
                 await ctx.send(f"{item} : Your chances of winning are so small... [**lottery ticket**: 1, **money**: {cost}]")
@@ -324,19 +454,20 @@ class Coronavirus(Cog):
         else:
             await ctx.send(f"{item} : I'm sorry, I don't have stock for {item} yet... Hopefully there will be a delivery sometimes soon...")
 
-        if random.randint(1, 100) <= 2:
+        if rng.randint(1, 100) <= 2:
             player.isolation = models.Isolation.goes_to_parties
 
         await self.bot.db.save_player(player)
 
     @commands.command()
-    @commands.cooldown(2, 90, commands.BucketType.user)
+    @shared_cooldown(2, 90, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.category, wait=True)
     async def hospital(self, ctx: MyContext, what:str):
         """
         The people here are trying their best to find a cure. Let them work, they are only using a lot of 🔬 anyway.
         """
+        rng = self.bot.rng.for_guild(ctx.guild)
         items = models.ItemsEmojis
 
         player = await self.bot.db.get_player(ctx.author)
@@ -346,7 +477,7 @@ class Coronavirus(Cog):
             return
 
         if not player.doctor:
-            if random.randint(0, 100) <= 2:
+            if rng.randint(0, 100) <= 2:
                 await ctx.send(f"❌ Sorry dude, this is a restricted area. You need to be part of the hospital to enter. "
                                f"(You managed to steal 1x{items.toilet_paper.value} before leaving)")
                 player.inventory.toilet_paper += 1
@@ -376,11 +507,11 @@ class Coronavirus(Cog):
             messages = ["It's {current_year} and we still don't know what emoji to use lol",
                         "Hmm... what are you making? 🤔",
                         "I know, science can be hard to understand, but that??",
-                        f"Heh, is that thing a {random.choice(items_list)}? No? Then maybe find something else to do.",
-                        f"I'd really prefer to see you creating a new {random.choice(items_list)}...",
-                        f"Why don't you make a {random.choice(items_list)} instead?"
+                        f"Heh, is that thing a {rng.choice(items_list)}? No? Then maybe find something else to do.",
+                        f"I'd really prefer to see you creating a new {rng.choice(items_list)}...",
+                        f"Why don't you make a {rng.choice(items_list)} instead?"
                         ]
-            await ctx.send(random.choice(messages))
+            await ctx.send(rng.choice(messages))
             return
 
         item_cost = medical_items[item]
@@ -399,13 +530,14 @@ class Coronavirus(Cog):
         await self.bot.db.save_player(player)
 
     @commands.command()
-    @commands.cooldown(4, 10, commands.BucketType.user)
+    @shared_cooldown(4, 10, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.category, wait=True)
     async def give(self, ctx: MyContext, who:discord.Member, what:str):
         """
         Sharing is caring, or at least that's what they told us. Should I share things or stay home ? Better stay home I think.
         """
+        rng = self.bot.rng.for_guild(ctx.guild)
         if who.id == ctx.author.id:
             await ctx.send("❌ Stop wasting my time, go away! ")
             return
@@ -426,14 +558,13 @@ class Coronavirus(Cog):
             return
 
         items = models.ItemsEmojis
-        items_list = list([e.value for e in models.ItemsEmojis])
-        item = next((item for item in items_list if item in what), None)
+        item = game_rules.find_item(what)
 
         if not item:
             messages = ["Don't you think you could give me something useful ?",
                         "Hmm... what are you making? 🤔",
                         "What do you want to give to me ??"]
-            await ctx.send(random.choice(messages))
+            await ctx.send(rng.choice(messages))
             return
 
         if item in [items.education.value, items.knowledge_points.value, items.working_points.value]:
@@ -455,13 +586,14 @@ class Coronavirus(Cog):
         await self.bot.db.save_player(target_player)
 
     @commands.command()
-    @commands.cooldown(1, 3600, commands.BucketType.user)
+    @shared_cooldown(1, 3600, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.category, wait=True)
     async def heal(self, ctx: MyContext, *, who:discord.Member):
         """
         Good ol' medicine.
         """
+        rng = self.bot.rng.for_guild(ctx.guild)
         if who.id == ctx.author.id:
             await ctx.send("❌ You need a doctor, sir ? 😟")
             return
@@ -478,21 +610,21 @@ class Coronavirus(Cog):
             return
 
         if not player.doctor:
-            if random.randint(1, 100) <= 90:
+            if rng.randint(1, 100) <= 90:
                 await ctx.send("❌ You don't really have the credentials there, buddy...")
                 return
         else:
-            if target_player.doctor and random.randint(1, 100) <= 75:
+            if target_player.doctor and rng.randint(1, 100) <= 75:
                 failures = ["❌ You tried to heal, but you missed and injected the pavement!", "❌ I'm pretty sure they can manage to heal themselves. You have better to do."]
-                await ctx.send(random.choice(failures))
+                await ctx.send(rng.choice(failures))
                 return
 
-            if random.randint(1, 100) <= 10:
+            if rng.randint(1, 100) <= 10:
                 await ctx.send("❌ Did you forget your magical healing powers? Anyway, that didn't work...")
                 return
 
         player.statistics.heals += 1
-        heal_pct = int(min(int(random.randint(-40, -6) / (int(target_player.doctor) + 1)) / (int(player.statistics.heals/10) + 1), -1))
+        heal_pct = int(min(int(rng.randint(-40, -6) / (int(target_player.doctor) + 1)) / (int(player.statistics.heals/10) + 1), -1))
         target_player.infect(heal_pct)
 
         await self.bot.db.save_player(player)
@@ -501,13 +633,14 @@ class Coronavirus(Cog):
         await ctx.send(f"⚕ {who.mention} already feels better ({heal_pct}%).")
 
     @commands.command(aliases=["brains", "eat"])
-    @commands.cooldown(1, 10, commands.BucketType.user)
+    @shared_cooldown(1, 10, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.category, wait=True)
     async def brain(self, ctx: MyContext, *, who:discord.Member):
         """
         BRAINNNNNNS!
         """
+        rng = self.bot.rng.for_guild(ctx.guild)
         player = await self.bot.db.get_player(ctx.author)
         target_player = await self.bot.db.get_player(who)
 
@@ -535,13 +668,13 @@ class Coronavirus(Cog):
 
         if target_player.inventory.education - eaten_brains <= 0:
             target_player.inventory.education = 0
-            target_player.infect()
+            target_player.infect(rng=rng)
         else:
             target_player.inventory.education = target_player.inventory.education - eaten_brains
 
         player.statistics.eaten_brains += eaten_brains
 
-        if player.statistics.eaten_brains >= 35 and not player.achievements.back_from_the_dead and random.randint(0, 100) <= 75:
+        if player.statistics.eaten_brains >= 35 and not player.achievements.back_from_the_dead and rng.randint(0, 100) <= 75:
             # Revive player!
             player.achievements.back_from_the_dead = True
             player.education = int(player.statistics.eaten_brains/15)
@@ -551,11 +684,10 @@ class Coronavirus(Cog):
             player.law = models.AlignementLaw.chaotic
             player.good = target_player.good
 
-            if not ctx.author.discriminator == "0000":
-                await ctx.author.remove_roles(ctx.guild.get_role(self.config()['dead_role_id']), reason="UN-RIP!")
+            self.update_game_role(ctx.author, player, reason="UN-RIP!")
 
-            await (ctx.guild.get_channel(self.config()['log_channel_id']).send(f"Looks like {ctx.author.mention} is back from the morgue... "
-                                                                               f"I was pretty sure he was dead... Anyway, party on I guess :)"))
+            await self.send_log(ctx.guild, f"Looks like {ctx.author.mention} is back from the morgue... "
+                                           f"I was pretty sure he was dead... Anyway, party on I guess :)")
         else:
             await ctx.send(f"🧟 Yummy! {who.mention} brains are good to eat! [**brains**: {eaten_brains}]")
 
@@ -567,15 +699,15 @@ class Coronavirus(Cog):
 
     @commands.command()
     @commands.guild_only()
-    @commands.cooldown(8, 20, commands.BucketType.user)
+    @shared_cooldown(8, 20, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.user)
     @commands.max_concurrency(3, commands.BucketType.category)
     async def use(self, ctx: MyContext, what:str, target: typing.Optional[discord.Member] = None):
         """
         I bought this! Let me open it!
         """
+        rng = self.bot.rng.for_guild(ctx.guild)
         items = models.ItemsEmojis
-        items_list = list([e.value for e in models.ItemsEmojis])
         player = await self.bot.db.get_player(ctx.author)
         if player.is_dead():
             await ctx.send("❌ Oh no! It appears that you are not alive, you can't use things if you are dead :(")
@@ -585,17 +717,19 @@ class Coronavirus(Cog):
             await ctx.send("It's {current_year} and we still don't know how to use emoji lol")
             return
 
-        item = next((item for item in items_list if item in what), None)
+        item = game_rules.find_item(what)
 
         if not item:
             messages = ["It's {current_year} and we still don't know what emoji to use lol",
                         "Hmm... what are you using? 🤔",
                         "I'm sorry Dave, I'm afraid I cannot let you do that...",
-                        f"You saw an {random.choice(items_list)} in a delivery truck yesterday, maybe you could try to buy it instead?"]
-            await ctx.send(random.choice(messages))
+                        f"You saw an {rng.choice(game_rules.ITEMS_EMOJIS)} in a delivery truck yesterday, maybe you could try to buy it instead?"]
+            await ctx.send(rng.choice(messages))
             return
 
-        ctx.logger.debug(f"{item} use in progress")
+        ctx.logger.debug("%s use in progress", item)
+        # (effect, delay, value) to schedule after the player is saved
+        effects = []
 
         # soap = fields.IntField(default=1)  # Can be bought
         # food = fields.IntField(default=2)  # Can be bought
@@ -636,7 +770,7 @@ class Coronavirus(Cog):
         elif item == items.lottery_ticket.value:
             if player.inventory.lottery_ticket >= 1:
                 player.inventory.lottery_ticket -= 1
-                random_number = random.randint(0, 100)
+                random_number = rng.randint(0, 100)
                 if random_number == 0:
                     player.cured = False
                     player.immunodeficient = True
@@ -656,7 +790,7 @@ class Coronavirus(Cog):
         elif item == items.herb.value:
             if player.inventory.herb >= 1:
                 player.inventory.herb -= 1
-                player.infect(random.randint(-10, 10))
+                player.infect(rng.randint(-10, 10))
                 player.isolation = models.Isolation.stays_at_home_country
                 await ctx.send(f"{item} : Does homeopathy works ?!")
             else:
@@ -664,8 +798,8 @@ class Coronavirus(Cog):
         elif item == items.music_cd.value:
             if player.inventory.music_cd >= 1:
                 player.inventory.music_cd -= 1
-                player.infect(random.randint(-14, 5))
-                if random.randint(0, 100) <= 15:
+                player.infect(rng.randint(-14, 5))
+                if rng.randint(0, 100) <= 15:
                     player.isolation = models.Isolation.goes_to_parties
                 await ctx.send(f"{item} : Music cures boredoom ?!")
             else:
@@ -673,39 +807,36 @@ class Coronavirus(Cog):
         elif item == items.pill.value:
             if player.inventory.pill >= 1:
                 player.inventory.pill -= 1
-                if random.randint(0, 100) <= 8:
+                if rng.randint(0, 100) <= 8:
                     await ctx.send(f"{item} : Huh ?! It's rat poison, why would you eat that ?")
-                    player.infect()
+                    player.infect(rng=rng)
                 else:
-                    player.infect(random.randint(-70, 0))
-                    if random.randint(0, 100) <= 15:
+                    player.infect(rng.randint(-70, 0))
+                    if rng.randint(0, 100) <= 15:
                         player.isolation = models.Isolation.normal_life
                     await ctx.send(f"{item} : Acetaminophen cures cancer, change my mind ?!")
             else:
                 await ctx.send(f"{item} : You'd have to go and see a doctor for that buddy.")
         elif item == items.vaccine.value:
             if player.inventory.vaccine >= 1:
-                if random.randint(0,100) <= 70:
+                if rng.randint(0,100) <= 70:
                     player.inventory.vaccine -= 1
-                    player.infect(-100)
-                    player.achievements.vaccined = True
-                    player.cured = True
-                    if not ctx.author.discriminator == "0000":
-                        await ctx.author.add_roles(ctx.guild.get_role(self.config()['cured_role_id']), reason="Vaccine! (won)")
+                    delay = timedelta(seconds=self.config().get("vaccine_delay", 3600))
+                    effects.append(("vaccine", delay, 0))
 
-                    await ctx.send(f"{item} : IMMUNITY !")
+                    await ctx.send(f"{item} : IMMUNITY ! The vaccine will kick in {human_time.human_timedelta(datetime.utcnow() + delay)}.")
 
                 else:
                     player.inventory.vaccine -= 1
-                    player.infect()
+                    player.infect(rng=rng)
                     await ctx.send(f"{item} : You fu*king junkie!")
             else:
                 await ctx.send(f"{item} : Creating a vaccine takes 18 months, do you really expect that you'll be provided one ?")
         elif item == items.mask.value:
             if player.inventory.mask >= 1:
                 player.inventory.mask -= 1
-                player.infect(random.randint(-6, 0))
-                if random.randint(0, 100) <= 15:
+                player.infect(rng.randint(-6, 0))
+                if rng.randint(0, 100) <= 15:
                     player.isolation = models.Isolation.stays_at_home_city
                 await ctx.send(f"{item} : Achoo ?!")
             else:
@@ -713,7 +844,7 @@ class Coronavirus(Cog):
         elif item == items.toilet_paper.value:
             if player.inventory.toilet_paper >= 1:
                 player.inventory.toilet_paper -= 1
-                player.infect(random.randint(-3, -1))
+                player.infect(rng.randint(-3, -1))
                 await ctx.send(f"{item} : Clean ass!")
             else:
                 await ctx.send(f"{item} : There is no more of that, buddy.")
@@ -731,12 +862,12 @@ class Coronavirus(Cog):
 
                 player.inventory.gun = 0  # Confiscated
                 player.inventory.dagger = 0  # Confiscated
-                player.isolation = models.Isolation.lives_in_bunker
+                effects.append(self.quarantine(player))
                 player.achievements.murderer = True
-                player.infect(random.randint(25, 75))
+                player.infect(rng.randint(25, 75))
 
                 target_player.achievements.victim = True
-                target_player.infect(random.randint(25,75))
+                target_player.infect(rng.randint(25,75))
                 await self.bot.db.save_player(target_player)
 
                 await ctx.send(f"{item} : BLOODY MURDER! YOU FUCKING SHOT {target.mention}!!!!!!")
@@ -760,13 +891,13 @@ class Coronavirus(Cog):
 
                     player.inventory.gun = 0  # Confiscated
                     player.inventory.dagger = 0  # Confiscated
-                    player.isolation = models.Isolation.lives_in_bunker
+                    effects.append(self.quarantine(player))
                     player.achievements.murderer = True
-                    player.infect(random.randint(5, 25))
+                    player.infect(rng.randint(5, 25))
                     target_player.achievements.victim = True
-                    target_player.infect(random.randint(5, 23))
+                    target_player.infect(rng.randint(5, 23))
 
-                    if random.randint(0, 100) <= 10:
+                    if rng.randint(0, 100) <= 10:
                         target_player.inventory.gun += 1  # Revenge
                         await ctx.send(f"{item} : Stabby stabby {target.mention}!")
                     else:
@@ -790,58 +921,75 @@ class Coronavirus(Cog):
             await ctx.send(f"{item} : Do you know how to use an {item} anyway ?")
             return
 
-        if random.randint(1, 100) <= 2:
+        if rng.randint(1, 100) <= 2:
             player.isolation = models.Isolation.stays_at_home_city
 
         await self.bot.db.save_player(player)
+        for effect, delay, value in effects:
+            await self.scheduler.schedule(player.discord_id, effect, delay, value=value)
 
     @commands.command()
-    @commands.cooldown(2, 20, commands.BucketType.user)
-    @commands.cooldown(1, 5, commands.BucketType.user)
+    @shared_cooldown(2, 20, commands.BucketType.user)
+    @shared_cooldown(1, 5, commands.BucketType.user)
     async def profile(self, ctx: MyContext, *, who:discord.User = None):
         """
         Who am I? Who are they ?
         """
         if who is None:
             who = ctx.author
-        player = await self.bot.db.get_player(who)
 
-        achievements_embed = discord.Embed(colour=discord.Colour.blurple(), title="Achievements")
-        achievements_embed.set_author(name=f"{who.name}#{who.discriminator}", icon_url=str(who.avatar_url))
+        # The embed is rebuilt only if the player was saved, or if their discord profile changed. The versions only
+        # count the saves of this process: with several clusters, the other ones save the player too, so there's no
+        # caching.
+        cache_key = (self.bot.db.player_versions[who.id], str(who), str(who.avatar_url))
+        cached = None if self.bot.cluster.clustered else self.profile_cache.get(who.id)
 
-        for achievement_name, achievement in models.AchievementsEmojis.__members__.items():
-            achievement_emoji = achievement.value
-            if player.achievements.__getattribute__(achievement_name):
-                achievements_embed.add_field(name=achievement_emoji, value=achievement_name, inline=True)
+        if cached and cached[0] == cache_key:
+            embed = cached[1]
+            self.profile_cache.move_to_end(who.id)
+        else:
+            player = await self.bot.db.get_player(who)
+            embed = self.render_profile(who, player)
+            if not self.bot.cluster.clustered:
+                self.profile_cache[who.id] = (cache_key, embed)
+                if len(self.profile_cache) > self.config().get('profile_cache_size', 1000):
+                    self.profile_cache.popitem(last=False)
+
+        await ctx.send(embed=embed)
 
-        inventory_embed = discord.Embed(colour=discord.Colour.blurple(), title="Inventory")
-        inventory_embed.set_author(name=f"{who.name}#{who.discriminator}", icon_url=str(who.avatar_url))
+    def render_profile(self, who: discord.User, player: models.Player) -> discord.Embed:
+        embed = discord.Embed(colour=discord.Colour.blurple(), title="Profile")
+        embed.set_author(name=f"{who.name}#{who.discriminator}", icon_url=str(who.avatar_url))
 
+        inventory = []
         for item_name, item in models.ItemsEmojis.__members__.items():
-            item_emoji = item.value
             qty = player.inventory.__getattribute__(item_name)
             if qty > 0:
-                inventory_embed.add_field(name=item_emoji, value=str(qty), inline=True)
+                inventory.append(f"{item.value} {qty}")
 
-        inventory_embed.add_field(name="Isolation", value=str(player.isolation.name), inline=False)
+        embed.add_field(name="Inventory", value=" • ".join(inventory) or "Empty", inline=False)
+        embed.add_field(name="Isolation", value=str(player.isolation.name), inline=False)
 
-        other_embed = discord.Embed(colour=discord.Colour.blurple(), title="Other")
-        other_embed.set_author(name=f"{who.name}#{who.discriminator}", icon_url=str(who.avatar_url))
-        other_embed.add_field(name="Is a doctor", value=str(player.doctor), inline=True)
-        other_embed.add_field(name="Is immunodeficient", value=str(player.immunodeficient), inline=True)
-        other_embed.add_field(name="Worked", value=f"{player.statistics.worked_times} times", inline=False)
-        other_embed.add_field(name="Researched", value=f"{player.statistics.researched_times} times", inline=False)
-        other_embed.add_field(name="Lawful", value=f"{player.law.name}", inline=True)
-        other_embed.add_field(name="Good", value=f"{player.good.name}", inline=True)
-        other_embed.add_field(name="Charisma", value=f"{player.charisma}", inline=True)
-        other_embed.add_field(name="Vaccines made", value=f"{player.statistics.made_vaccines}", inline=True)
+        achievements = []
+        for achievement_name, achievement in models.AchievementsEmojis.__members__.items():
+            if player.achievements.__getattribute__(achievement_name):
+                achievements.append(f"{achievement.value} {achievement_name}")
 
-        await ctx.send(embed=inventory_embed)
-        await ctx.send(embed=achievements_embed)
-        await ctx.send(embed=other_embed)
+        embed.add_field(name="Achievements", value="\n".join(achievements) or "None yet", inline=False)
+
+        embed.add_field(name="Is a doctor", value=str(player.doctor), inline=True)
+        embed.add_field(name="Is immunodeficient", value=str(player.immunodeficient), inline=True)
+        embed.add_field(name="Worked", value=f"{player.statistics.worked_times} times", inline=False)
+        embed.add_field(name="Researched", value=f"{player.statistics.researched_times} times", inline=False)
+        embed.add_field(name="Lawful", value=f"{player.law.name}", inline=True)
+        embed.add_field(name="Good", value=f"{player.good.name}", inline=True)
+        embed.add_field(name="Charisma", value=f"{player.charisma}", inline=True)
+        embed.add_field(name="Vaccines made", value=f"{player.statistics.made_vaccines}", inline=True)
+
+        return embed
 
     @commands.command()
-    @commands.cooldown(1, 600, commands.BucketType.guild)
+    @shared_cooldown(1, 600, commands.BucketType.guild)
     async def pause(self, ctx: MyContext):
         """
         Pause the simulation, cancelling everything that happen normally.
@@ -849,8 +997,8 @@ class Coronavirus(Cog):
         await ctx.send("❌ Do you really think life has a pause button ?")
 
     @commands.command()
-    @commands.cooldown(2, 600, commands.BucketType.user)
-    @commands.cooldown(1, 5, commands.BucketType.user)
+    @shared_cooldown(2, 600, commands.BucketType.user)
+    @shared_cooldown(1, 5, commands.BucketType.user)
     async def statistics(self, ctx: MyContext):
         """
         Shows some cool statistics about the game.
@@ -884,22 +1032,105 @@ class Coronavirus(Cog):
 
         await ctx.send(playpy.json(indent=4))
 
-    async def dispatch_maybes(self, message: discord.Message):
-        if message.guild is None:
+    @commands.command(name="reconcile_roles")
+    @commands.is_owner()
+    async def reconcile_roles_command(self, ctx: MyContext):
+        """
+        Fix the infected/cured/dead roles of every player, according to the database.
+        """
+        if self.reconcile_lock.locked():
+            await ctx.send("❌ A reconciliation is already running.")
+            return
+
+        await ctx.send("⏳ Reconciling roles...")
+        counts = await self.reconcile_roles()
+        await ctx.send(f"👌 {counts['players']} players checked, {counts['not in guild']} not in the guild. "
+                       f"{counts['roles added']} roles to add and {counts['roles removed']} to remove were queued.")
+
+    @commands.command()
+    @commands.is_owner()
+    async def gameplay_filter(self, ctx: MyContext):
+        """
+        How many messages went through the game, and why the others were ignored.
+        """
+        rejected = self.enablement.rejected
+        details = ", ".join(f"{reason}: {count}" for reason, count in rejected.most_common()) or "none"
+        await ctx.send(f"📨 {self.enablement.processed} messages processed, {sum(rejected.values())} rejected ({details}).")
+
+    @commands.command()
+    @commands.is_owner()
+    async def infection_table(self, ctx: MyContext):
+        """
+        Infection chance for every player state, by number of infected players that talked recently in the channel.
+        """
+        table = self.get_infection_table()
+        await ctx.send(f"Infection rules: {table.rules._asdict()}\n```\n{table.render()}\n```")
+
+    @commands.command()
+    @commands.is_owner()
+    async def contacts(self, ctx: MyContext, who: discord.User = None):
+        """
+        Contact tracing: the players that talked the most with someone recently, or the size of the contact graph.
+        """
+        contacts = self.bot.contacts
+        if who is None:
+            stats = contacts.stats()
+            await ctx.send(f"🕸️ {stats['users']} players linked by {stats['edges']} contacts, {stats['infectious']} of them infectious, "
+                           f"{stats['channels']} active channels, {stats['messages']} messages recorded.")
             return
 
-        player = await self.bot.db.get_player(message.author)
-        await self.maybe_infect(player, message)
-        await self.maybe_test(player, message)
+        lines = []
+        for user_id, weight in contacts.contacts(who.id):
+            user = self.bot.get_user(user_id)
+            state = "🦠" if user_id in contacts.infectious else "👤"
+            lines.append(f"{state} {user.mention if user else user_id}: {weight:.2f}")
 
-        if message.author.id == self.bot.user.id:
+        if not lines:
+            await ctx.send(f"{who.mention} didn't talk with anyone recently.")
+        else:
+            await ctx.send(f"Infection pressure of {who.mention}: {contacts.pressure(who.id):.2f}\n" + "\n".join(lines))
+
+    async def dispatch_maybes(self, message: discord.Message):
+        metrics = self.bot.metrics
+        contacts = self.bot.contacts
+        timestamp = message.created_at.replace(tzinfo=timezone.utc).timestamp()
+
+        weight = self.bot.load_shedder.message_weight(message.guild)
+        if weight is None:
+            # Skipped because of the load, the contacts are still recorded with the last known state of the player.
+            contacts.record(message.channel.id, message.author.id, timestamp)
             return
 
-        await self.maybe_find(player, message)
+        async with self.bot.db.lock_players(message.author.id):
+            with metrics.timer("stage", "get_player"):
+                player = await self.bot.db.get_player(message.author)
+
+            contacts.set_infectious(player.discord_id, player.is_infected())
+            contacts.record(message.channel.id, player.discord_id, timestamp)
+
+            with metrics.timer("stage", "maybe_infect"):
+                await self.maybe_infect(player, message, weight)
+            with metrics.timer("stage", "maybe_test"):
+                await self.maybe_test(player, message, weight)
+
+            if message.author.id == self.bot.user.id or not self.bot.load_shedder.finds_allowed:
+                return
+
+            with metrics.timer("stage", "maybe_find"):
+                await self.maybe_find(player, message, weight)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if not self.reconcile_lock.locked():
+            await self.reconcile_roles()
 
     @commands.Cog.listener()
     @commands.max_concurrency(1, commands.BucketType.user, wait=True)
     async def on_command_completion(self, ctx: MyContext):
+        # Counted by on_message already, like every message.
+        if not self.is_enabled_for(ctx.message, count=False):
+            return
+
         await self.dispatch_maybes(ctx.message)
 
 
@@ -909,13 +1140,18 @@ class Coronavirus(Cog):
         """
         Main on_message listener
         """
-        ctx = await self.bot.get_context(message, cls=MyContext)
-
-        if ctx.valid:
-            # ctx.logger.debug("Ignoring message since it's a command")
+        if not self.is_enabled_for(message):
             return
 
-        await self.dispatch_maybes(message)
+        with tracing.span("Coronavirus.on_message"):
+            with tracing.span("get_context"):
+                ctx = await self.bot.get_context(message, cls=MyContext)
+
+            if ctx.valid:
+                # ctx.logger.debug("Ignoring message since it's a command")
+                return
+
+            await self.dispatch_maybes(message)
 
 
 
@@ -29,7 +29,7 @@ class CommandErrorHandler(Cog):
         DELETE_ERROR_MESSAGE_AFTER = 60
         command_invoke_help = f"{ctx.prefix}{ctx.command.qualified_name} {ctx.command.signature}"
 
-        ctx.logger.debug(f"Error during processing: {exception} ({repr(exception)})")
+        ctx.logger.debug("Error during processing: %s (%r)", exception, exception)
 
         # https://discordpy.readthedocs.io/en/latest/ext/commands/api.html#discord.ext.commands.CommandError
         if isinstance(exception, commands.CommandError):
@@ -97,6 +97,10 @@ class CommandErrorHandler(Cog):
                         message = f"❌ You need to be in the {correct_guild.name} server (`{exception.must_be_in_guild_id}`)."
                     else:
                         message = f"❌ You need to be in a server with ID {exception.must_be_in_guild_id}."
+                elif isinstance(exception, checks.Overloaded):
+                    message = f"❌ The bot is under heavy load, `{ctx.command}` is paused for a moment. Please try again later."
+                elif isinstance(exception, checks.PlayersBusy):
+                    message = "❌ Someone else is already playing with you. Please try again in a few seconds."
                 else:
                     message = f"❌ Check error running this command : {str(exception)} ({type(exception).__name__})"
                     ctx.logger.error("".join(traceback.format_exception(type(exception), exception, exception.__traceback__)))
@@ -0,0 +1,131 @@
+"""
+Owner-only commands to look at how the bot is performing, and the optional Prometheus metrics listener.
+"""
+import asyncio
+import datetime
+import typing
+
+from discord.ext import commands
+
+from utils import human_time, load_shedding
+from utils.cog_class import Cog
+from utils.ctx_class import MyContext
+from utils.formats import TabularData
+from utils.prometheus import MetricsServer
+
+
+class Monitoring(Cog):
+    def __init__(self, bot, *args, **kwargs):
+        super().__init__(bot, *args, **kwargs)
+        self.metrics_server = MetricsServer(bot)
+        self.metrics_server_task: typing.Optional[asyncio.Future] = None
+
+        metrics_config = self.bot.config.get("metrics", {})
+        if metrics_config.get("enabled", False):
+            # Every cluster has its own port.
+            port = metrics_config.get("port", 9100) + self.bot.cluster.id
+            self.metrics_server_task = asyncio.ensure_future(self.metrics_server.start(metrics_config.get("host", "127.0.0.1"), port))
+            self.metrics_server_task.add_done_callback(self.metrics_server_started)
+
+    def metrics_server_started(self, task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            # A port already in use, most likely.
+            self.bot.logger.error(f"The metrics server failed to start: {task.exception()!r}")
+
+    def cog_unload(self):
+        if self.metrics_server_task is not None:
+            self.metrics_server_task.cancel()
+        asyncio.ensure_future(self.metrics_server.stop())
+
+    async def cog_check(self, ctx: MyContext):
+        if not await self.bot.is_owner(ctx.author):
+            raise commands.NotOwner()
+        return True
+
+    @commands.command()
+    async def metrics(self, ctx: MyContext, kind: str = None):
+        """
+        Latency percentiles, by command, message pipeline stage, database call and REST call.
+        """
+        histograms = sorted((key, histogram) for key, histogram in self.bot.metrics.histograms.items() if kind is None or key[0] == kind)
+        if not histograms:
+            await ctx.send("Nothing was measured yet.")
+            return
+
+        table = TabularData()
+        table.set_columns(["Kind", "Name", "Count", "p50 (ms)", "p95 (ms)", "p99 (ms)", "Max (ms)"])
+        for (histogram_kind, name), histogram in histograms:
+            table.add_row([histogram_kind, name, histogram.count] +
+                          [f"{value * 1000:.1f}" for value in (histogram.percentile(50), histogram.percentile(95), histogram.percentile(99), histogram.max)])
+
+        await ctx.send(f"```\n{table.render()}\n```")
+
+    @commands.command()
+    async def slow_callbacks(self, ctx: MyContext, index: int = None):
+        """
+        The slowest callbacks that blocked the event loop. Pass an index to see the stack of one of them.
+        """
+        watchdog = self.bot.watchdog
+        slowest = watchdog.slowest_callbacks()
+        if not slowest:
+            await ctx.send(f"The event loop was never blocked for more than {watchdog.threshold * 1000:.0f}ms.")
+            return
+
+        if index is not None:
+            if not 0 <= index < len(slowest):
+                await ctx.send(f"❌ There are only {len(slowest)} slow callbacks recorded.")
+                return
+            callback = slowest[index]
+            await ctx.send(f"**{callback.duration * 1000:.0f}ms** in `{callback.site}`\n```py\n{''.join(callback.stack)}\n```")
+            return
+
+        table = TabularData()
+        table.set_columns(["#", "Duration (ms)", "Call site", "Seen"])
+        for i, callback in enumerate(slowest):
+            seen = human_time.human_timedelta(datetime.datetime.utcfromtimestamp(callback.seen_at), brief=True)
+            table.add_row([i, f"{callback.duration * 1000:.0f}", callback.site, seen])
+
+        await ctx.send(f"{watchdog.stalls} stalls over {watchdog.threshold * 1000:.0f}ms, current lag {self.bot.metrics.loop_lag * 1000:.1f}ms.\n"
+                       f"```\n{table.render()}\n```")
+
+    @commands.command()
+    async def load_shedding(self, ctx: MyContext):
+        """
+        How overloaded the bot thinks it is, and what it stopped doing because of it.
+        """
+        shedder = self.bot.load_shedder
+        await ctx.send(f"Load shedding stage {shedder.stage}: **{load_shedding.STAGE_NAMES[shedder.stage]}**"
+                       f"{' (' + ', '.join(shedder.reasons) + ')' if shedder.reasons else ''}{'' if shedder.enabled else ' - disabled'}.\n"
+                       f"Loop lag {self.bot.metrics.loop_lag * 1000:.1f}ms, database latency {shedder.db_latency * 1000:.1f}ms, "
+                       f"{shedder.rate_limits.in_last(60)} rate limits in the last minute.\n"
+                       f"{shedder.sampled_out} messages skipped, {shedder.rejected} commands refused, {len(shedder.deferred_logs)} log posts waiting.")
+
+    @commands.command()
+    async def jobs(self, ctx: MyContext):
+        """
+        The periodic jobs: how long they take, how often they fail, and when they run next.
+        """
+        jobs = sorted(self.bot.jobs.jobs.values(), key=lambda job: job.name)
+        if not jobs:
+            await ctx.send("No job is registered.")
+            return
+
+        table = TabularData()
+        table.set_columns(["Name", "Interval (s)", "Runs", "Failures", "Skipped", "Last (ms)", "Max (ms)", "Next run"])
+        for job in jobs:
+            if job.task is None:
+                next_run = f"on cluster {self.bot.cluster.leader}"
+            elif job.running:
+                next_run = "running"
+            elif job.next_run_at() is None:
+                next_run = "waiting for ready"
+            else:
+                next_run = human_time.human_timedelta(job.next_run_at(), brief=True)
+            table.add_row([job.name + (" (executor)" if job.executor else ""), f"{job.interval:g}", job.runs, job.failures, job.skipped,
+                           f"{job.last_duration * 1000:.1f}", f"{job.max_duration * 1000:.1f}", next_run])
+
+        errors = "\n".join(f"{job.name}: {job.last_error}" for job in jobs if job.last_error)
+        await ctx.send(f"```\n{table.render()}\n```" + (f"Last errors:\n```\n{errors}\n```" if errors else ""))
+
+
+setup = Monitoring.setup
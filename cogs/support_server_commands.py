@@ -4,76 +4,130 @@ Some example of commands that can be used only in the bot support server.
 
 import datetime
 import time
+import typing
 
 import discord
-import pytz
-from discord.ext import commands, tasks
+from discord.ext import commands
 
 from utils import checks, human_time
 from utils.cog_class import Cog
 from utils.ctx_class import MyContext
-from utils.interaction import purge_channel_messages
+from utils.jobs import job
+
+# Fields that change every minute, left out when deciding whether the status message needs an edit. They are still
+# refreshed every status_refresh_minutes, so that they don't get stale during the quiet hours.
+FAST_FIELDS = {"Commands per minute", "Shard latency", "Database latency"}
 
 
 class SupportServerCommands(Cog):
     def __init__(self, bot, *args, **kwargs):
         super().__init__(bot, *args, **kwargs)
         self.index = 0
-        self.background_loop.start()
-
-    def cog_unload(self):
-        self.background_loop.cancel()
+        self.status_message: typing.Optional[discord.Message] = None
+        # Slow fields of the last edit, to skip the edits that would only refresh the rates and latencies.
+        self.status_content: typing.Optional[list] = None
+        self.status_edited_at = 0.0
+        # (when, commands used, database calls, database time) at the last update, for the rates.
+        self.status_sample = (time.monotonic(), 0, 0, 0.0)
 
     async def cog_check(self, ctx):
         return checks.is_in_server(self.config()["support_server_id"])
 
-    @tasks.loop(minutes=15)
-    async def background_loop(self):
+    @job(minutes=1, max_runtime=60)
+    async def update_status(self):
         status_channel = self.bot.get_channel(self.config()["status_channel_id"])
+        if status_channel is None and not self.bot.hosts_guild(self.config()["support_server_id"]):
+            # The support server is on a shard of another cluster, that one updates the status.
+            return
         if not status_channel or not isinstance(status_channel, discord.TextChannel):
             self.bot.logger.warning("The status channel for the support server command is misconfigured.")
             return
 
-        self.bot.logger.debug("Updating status message", guild=status_channel.guild, channel=status_channel)
-
-        await purge_channel_messages(status_channel)
-        embed = discord.Embed(colour=discord.Colour.blurple(),
-                              title=f"{self.bot.user.name}'s status")
-
-        embed.add_field(name="Guilds Count", value=f"{len(self.bot.guilds)}", inline=True)
-        embed.add_field(name="Users Count", value=f"{len(self.bot.users)}", inline=True)
-        embed.add_field(name="Messages in cache", value=f"{len(self.bot.cached_messages)}", inline=True)
-
-        ping_f = status_channel.trigger_typing()
-        t_1 = time.perf_counter()
-        await ping_f  # tell Discord that the bot is "typing", which is a very simple request
-        t_2 = time.perf_counter()
-        ping = round((t_2 - t_1) * 1000)  # calculate the time needed to trigger typing
-
-        embed.add_field(name="Average Latency", value=f"{round(self.bot.latency, 2)}ms", inline=True)
-        embed.add_field(name="Current ping", value=f"{ping}ms", inline=True)
-        embed.add_field(name="Shards Count", value=f"{self.bot.shard_count}", inline=True)
-
-        def get_bot_uptime(brief=False):
-            return human_time.human_timedelta(self.bot.uptime, accuracy=None, brief=brief, suffix=False)
-
-        embed.add_field(name="Cogs loaded", value=f"{len(self.bot.cogs)}", inline=True)
-        embed.add_field(name="Commands loaded", value=f"{len(self.bot.commands)}", inline=True)
-        embed.add_field(name="Uptime", value=f"{get_bot_uptime()}", inline=True)
+        embed = self.status_embed()
+        content = [field for field in embed.to_dict()["fields"] if field["name"] not in FAST_FIELDS]
+        refresh = self.config().get("status_refresh_minutes", 15) * 60
+        if content == self.status_content and self.status_message is not None and time.monotonic() - self.status_edited_at < refresh:
+            # None of the counters changed since the last edit, and the rates are recent enough.
+            return
 
         embed.timestamp = datetime.datetime.utcnow()
+        interval = self.bot.jobs.jobs[f"{self.qualified_name}.update_status"].interval
+        every = human_time.human_timedelta(embed.timestamp + datetime.timedelta(seconds=interval), source=embed.timestamp)
+        at_least = human_time.human_timedelta(embed.timestamp + datetime.timedelta(seconds=refresh), source=embed.timestamp)
+        embed.set_footer(text=f"Updated at most every {every}, and at least every {at_least} - Last update")
 
-        next_it = self.background_loop.next_iteration
-        now = pytz.utc.localize(datetime.datetime.utcnow())
+        self.bot.logger.debug("Updating status message", guild=status_channel.guild, channel=status_channel)
+        if self.status_message is None:
+            self.status_message = await self.find_status_message(status_channel)
+
+        if self.status_message is not None:
+            try:
+                await self.status_message.edit(embed=embed)
+            except discord.NotFound:
+                self.status_message = None
+
+        if self.status_message is None:
+            self.status_message = await status_channel.send(embed=embed)
+            try:
+                await self.status_message.pin()
+            except discord.HTTPException:
+                self.bot.logger.warning("Can't pin the status message, it will be looked up in the channel history after a restart.",
+                                        guild=status_channel.guild, channel=status_channel)
+
+        self.status_content = content
+        self.status_edited_at = time.monotonic()
+
+    async def find_status_message(self, status_channel: discord.TextChannel) -> typing.Optional[discord.Message]:
+        """
+        The status message posted before a restart: pinned, or at least recent.
+        """
+        def is_status(message: discord.Message):
+            return message.author.id == self.bot.user.id and message.embeds
 
-        delta = human_time.human_timedelta(next_it, source=now)
-        embed.set_footer(text=f"This should update every {delta} - Last update")
+        message = discord.utils.find(is_status, await status_channel.pins())
+        if message is None:
+            message = await status_channel.history(limit=50).find(is_status)
+        return message
 
-        await status_channel.send(embed=embed)
+    def status_embed(self) -> discord.Embed:
+        """
+        Built from counters that are already in memory, without any request. Other clusters report theirs regularly.
+        """
+        embed = discord.Embed(colour=discord.Colour.blurple(),
+                              title=f"{self.bot.user.name}'s status")
 
-    @background_loop.before_loop
-    async def before(self):
-        await self.bot.wait_until_ready()
+        now = time.monotonic()
+        totals = self.bot.cluster_totals()
+        commands_used = sum(totals["commands_used"].values())
+        db_count, db_total = 0, 0.0
+        for (kind, _), histogram in self.bot.metrics.histograms.items():
+            if kind == "db":
+                db_count += histogram.count
+                db_total += histogram.total
+
+        previous_at, previous_commands, previous_db_count, previous_db_total = self.status_sample
+        self.status_sample = (now, commands_used, db_count, db_total)
+        minutes = (now - previous_at) / 60
+        db_queries = db_count - previous_db_count
+        db_latency = f"{(db_total - previous_db_total) / db_queries * 1000:.0f}ms" if db_queries else "idle"
+
+        counters = self.bot.db.counters
+        for name in ("players", "infected", "dead", "cured"):
+            embed.add_field(name=name.capitalize(), value=str(counters.get(name, "...")), inline=True)
+
+        latencies = [latency for _, latency in totals["latencies"] if latency == latency]  # NaN until the first heartbeat
+        shard_latency = f"{sum(latencies) / len(latencies) * 1000:.0f}ms (max {max(latencies) * 1000:.0f}ms)" if latencies else "..."
+
+        embed.add_field(name="Commands per minute", value=f"{(commands_used - previous_commands) / minutes:.1f}", inline=True)
+        embed.add_field(name="Shard latency", value=shard_latency, inline=True)
+        embed.add_field(name="Database latency", value=db_latency, inline=True)
+
+        embed.add_field(name="Guilds Count", value=f"{totals['guilds']}", inline=True)
+        embed.add_field(name="Users Count", value=f"{totals['users']}", inline=True)
+        clusters = f" in {self.bot.cluster.count} clusters ({totals['clusters']} up)" if self.bot.cluster.clustered else ""
+        embed.add_field(name="Shards Count", value=f"{self.bot.shard_count}{clusters}", inline=True)
+        embed.add_field(name="Online since", value=self.bot.uptime.strftime("%Y-%m-%d %H:%M UTC"), inline=True)
+        return embed
 
     @commands.command(aliases=["shard_status"])
     async def shards(self, ctx: MyContext):
@@ -99,14 +153,14 @@ class SupportServerCommands(Cog):
             await ctx.send("The bot is not yet sharded.")
             return
 
-        latencies = sorted(self.bot.latencies, key=lambda l: l[0])
+        totals = self.bot.cluster_totals()
         message = "```"
 
-        for shard, latency in latencies:
+        for shard, latency in totals["latencies"]:
             if shard == ctx.guild.shard_id:
                 message += "**"
             message += f"•\t Shard ID {shard}: {round(latency, 2)}ms"
-            if shard in self.bot.shards_ready:
+            if shard in totals["shards_ready"]:
                 message += f" (ready)"
             if shard == ctx.guild.shard_id:
                 message += "**"
@@ -0,0 +1,116 @@
+"""
+Run the shards of the bot in several processes, so that it can use more than one CPU core.
+
+    python launcher.py
+
+The [cluster] section of config.toml gives the number of processes (clusters). The shards are split in that many
+contiguous ranges, and main.py runs once per range. The launcher hosts the coordinator the clusters use to lock the
+players and share their counters (see utils/coordinator.py), and restarts the clusters that exit.
+"""
+import asyncio
+import os
+import signal
+import sys
+import time
+import typing
+
+import discord
+import uvloop
+from discord.http import Route
+
+from utils.config import load_config
+from utils.coordinator import ClusterInfo, CoordinatorServer, ENVIRONMENT_VARIABLE
+from utils.logger import FakeLogger
+
+
+async def get_gateway_limits(token: str) -> typing.Tuple[int, int]:
+    """Number of shards recommended by Discord, and how many of them can identify at the same time."""
+    http = discord.http.HTTPClient()
+    try:
+        await http.static_login(token, bot=True)
+        data = await http.request(Route('GET', '/gateway/bot'))
+    finally:
+        await http.close()
+    return data['shards'], data['session_start_limit']['max_concurrency']
+
+
+def split_shards(shard_count: int, clusters: int) -> typing.List[typing.List[int]]:
+    clusters = min(clusters, shard_count)
+    return [list(range(i * shard_count // clusters, (i + 1) * shard_count // clusters)) for i in range(clusters)]
+
+
+class Launcher:
+    def __init__(self, config: dict, logger: FakeLogger):
+        self.config = config
+        self.cluster_config = config.get("cluster", {})
+        self.logger = logger
+        self.server = CoordinatorServer(self.cluster_config.get("socket", "/tmp/coroned-coordinator.sock"), logger)
+        self.processes: typing.Dict[int, asyncio.subprocess.Process] = {}
+        self.stopping = asyncio.Event()
+
+    async def run(self):
+        recommended_shards, max_concurrency = await get_gateway_limits(self.config['auth']['discord']['token'])
+        shard_count = self.cluster_config.get("shard_count", 0) or recommended_shards
+        shard_ranges = split_shards(shard_count, self.cluster_config.get("clusters", 2))
+        self.logger.info(f"Running {shard_count} shards in {len(shard_ranges)} clusters (Discord recommends {recommended_shards} shards)")
+
+        await self.server.start()
+        loop = asyncio.get_event_loop()
+        for stop_signal in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(stop_signal, self.stopping.set)
+
+        clusters = [ClusterInfo(id=cluster_id, count=len(shard_ranges), shard_ids=shard_ids, shard_count=shard_count,
+                                leader=self.cluster_config.get("leader", 0), socket=self.server.path, max_concurrency=max_concurrency)
+                    for cluster_id, shard_ids in enumerate(shard_ranges)]
+        tasks = [asyncio.ensure_future(self.keep_running(cluster)) for cluster in clusters]
+
+        await self.stopping.wait()
+        self.logger.info("Stopping the clusters...")
+        for process in self.processes.values():
+            if process.returncode is None:
+                process.terminate()
+        _, still_running = await asyncio.wait(tasks, timeout=30)
+        for task in still_running:
+            # Cancelling it kills its cluster.
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.server.close()
+
+    async def keep_running(self, cluster: ClusterInfo):
+        restart_delay = self.cluster_config.get("restart_delay", 5)
+        max_restart_delay = self.cluster_config.get("max_restart_delay", 300)
+        delay = restart_delay
+
+        while not self.stopping.is_set():
+            environment = dict(os.environ, **{ENVIRONMENT_VARIABLE: cluster.to_environment()})
+            process = self.processes[cluster.id] = await asyncio.create_subprocess_exec(sys.executable, "main.py", env=environment)
+            self.logger.info(f"Cluster {cluster.id} started (pid {process.pid}) with shards {cluster.shard_ids[0]} to {cluster.shard_ids[-1]}")
+            started = time.monotonic()
+
+            try:
+                return_code = await process.wait()
+            except asyncio.CancelledError:
+                process.kill()
+                raise
+
+            if self.stopping.is_set():
+                self.logger.info(f"Cluster {cluster.id} stopped")
+                return
+
+            if time.monotonic() - started > max_restart_delay:
+                # It ran fine for a while, this isn't a crash loop.
+                delay = restart_delay
+            self.logger.warning(f"Cluster {cluster.id} exited with code {return_code}, restarting it in {delay}s")
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, max_restart_delay)
+
+
+if __name__ == '__main__':
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    config = load_config()
+    launcher = Launcher(config, FakeLogger(config=config.get("logging", {}), file_prefix="launcher-"))
+    asyncio.get_event_loop().run_until_complete(launcher.run())
@@ -1,6 +1,10 @@
 import asyncio
 import collections
 import datetime
+import os
+import resource
+import sys
+import time
 import traceback
 
 import discord
@@ -8,28 +12,116 @@ from discord.ext.commands.bot import AutoShardedBot
 from discord.ext import commands
 
 from utils import config as config
+from utils import cooldowns
+from utils import coordinator
+from utils.contacts import ContactGraph
 from utils.ctx_class import MyContext
 from utils.database import Database
+from utils.jobs import JobRegistry
+from utils.load_shedding import LoadShedder
 from utils.logger import FakeLogger
+from utils.metrics import Metrics
+from utils.rng import game_rng
+from utils.roles import RoleUpdater
+from utils.traffic import TrafficRecorder
+from utils import tracing
+from utils.watchdog import LoopWatchdog
 
 
 class MyBot(AutoShardedBot):
     def __init__(self, *args, **kwargs):
-        self.logger = FakeLogger()
         self.config:dict = {}
         self.reload_config()
+        self.cluster = coordinator.ClusterInfo.from_environment()
+        self.logger = FakeLogger(config=self.config.get("logging", {}), file_prefix=f"cluster-{self.cluster.id}-" if self.cluster.clustered else "")
+        if self.cluster.shard_ids is not None:
+            kwargs.update(shard_ids=self.cluster.shard_ids, shard_count=self.cluster.shard_count)
         activity = discord.Game(self.config["bot"]["playing"])
-        super().__init__(*args, command_prefix=get_prefix, activity=activity, case_insensitive=self.config["bot"]["commands_are_case_insensitive"], **kwargs)
+        super().__init__(*args, command_prefix=get_prefix, activity=activity, case_insensitive=self.config["bot"]["commands_are_case_insensitive"], **get_cache_options(self.config), **kwargs)
         self.commands_used = collections.Counter()
+        self.metrics = Metrics()
+        self.rng = game_rng
+        self.rng.configure(self.config.get("rng", {}))
+        self.contacts = ContactGraph.from_config(self.config.get("contacts", {}))
+        self.tracer = tracing.Tracer(self.config.get("tracing", {}))
+        self.recorder = TrafficRecorder(get_recording_config(self.config, self.cluster))
+        self.watchdog = LoopWatchdog(self)
+        self.watchdog.start()
+        self.jobs = JobRegistry(self)
+        self.load_shedder = LoadShedder(self, self.config.get("load_shedding", {}))
+        self.jobs.add("load_shedding", self.load_shedder.evaluate, interval=1, wait_until_ready=False)
+        self.add_check(self.load_shedder.check)
+        cooldowns_config = self.config.get("cooldowns", {})
+        self.cooldowns = cooldowns.create_store(self, cooldowns_config)
+        self.jobs.add("cooldowns.prune", self.cooldowns.prune, interval=cooldowns_config.get("prune_interval", 300))
+        cluster_config = self.config.get("cluster", {})
+        self.coordinator = coordinator.create_coordinator(self, cluster_config)
+        self.report_interval = cluster_config.get("report_interval", 15)
+        if self.cluster.clustered:
+            self.jobs.add("coordinator.report", self.report_cluster, interval=self.report_interval)
         self.uptime = datetime.datetime.utcnow()
         self.shards_ready = set()
         db_config = self.config['database']
         self.db = Database(self)
-        asyncio.ensure_future(self.db.init(f"postgres://{db_config['username']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}"))
+        db_url = db_config.get('url') or f"postgres://{db_config['username']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}"
+        asyncio.ensure_future(self.db.init(db_url))
+        self.role_updater = RoleUpdater(self)
+        self.role_updater.start()
 
     def reload_config(self):
         self.config = config.load_config()
 
+    def add_cog(self, cog):
+        super().add_cog(cog)
+        self.jobs.add_cog(cog)
+
+    def remove_cog(self, name):
+        cog = self.get_cog(name)
+        super().remove_cog(name)
+        if cog is not None:
+            self.jobs.remove_cog(cog)
+
+    async def close(self):
+        self.jobs.stop()
+        await super().close()
+        await self.coordinator.close()
+        self.watchdog.stop()
+        self.load_shedder.close()
+        self.tracer.close()
+        self.recorder.close()
+        self.logger.shutdown()
+
+    async def report_cluster(self):
+        await self.coordinator.report(coordinator.cluster_report(self))
+
+    def cluster_totals(self) -> dict:
+        """
+        Counters of the whole bot: this process, and the last reports of the other clusters.
+        """
+        stale = time.time() - 3 * self.report_interval
+        reports = [report for cluster, report in self.coordinator.reports.items() if cluster != self.cluster.id and report["at"] > stale]
+        return coordinator.aggregate([coordinator.cluster_report(self)] + reports)
+
+    def hosts_guild(self, guild_id: int) -> bool:
+        """Whether the guild is on a shard of this process."""
+        return self.shard_ids is None or (guild_id >> 22) % self.shard_count in self.shard_ids
+
+    async def before_identify_hook(self, shard_id, *, initial=False):
+        if not self.cluster.clustered:
+            return await super().before_identify_hook(shard_id, initial=initial)
+
+        # The identify rate limit is shared by every cluster: max_concurrency shards every 5 seconds.
+        await self.coordinator.acquire([f"identify:{shard_id % self.cluster.max_concurrency}"], lease=5, timeout=5 * self.shard_count + 5, hold=True)
+
+    def dispatch(self, event_name, *args, **kwargs):
+        if event_name != "message":
+            return super().dispatch(event_name, *args, **kwargs)
+
+        # The listener tasks copy the context, so they are part of the message trace.
+        message = args[0]
+        with self.tracer.trace("message", message_id=message.id, channel_id=message.channel.id, author_id=message.author.id):
+            super().dispatch(event_name, *args, **kwargs)
+
     async def on_message(self, message):
         if not self.is_ready():
             return  # Ignoring messages when not ready
@@ -37,13 +129,26 @@ class MyBot(AutoShardedBot):
         #if message.author.bot:
         #    return  # ignore messages from other bots
 
-        ctx = await self.get_context(message, cls=MyContext)
-        if ctx.prefix is not None:
-            await self.invoke(ctx)
+        with tracing.span("MyBot.on_message"):
+            with tracing.span("get_context"):
+                ctx = await self.get_context(message, cls=MyContext)
+            if ctx.command is not None:
+                self.recorder.record(message, ctx.command.qualified_name, message.content[ctx.view.index:].strip())
+            else:
+                self.recorder.record(message, None)
+            if ctx.prefix is not None:
+                await self.invoke(ctx)
+
+    async def invoke(self, ctx: MyContext):
+        if ctx.command is None:
+            return await super().invoke(ctx)
+
+        with self.metrics.timer("command", ctx.command.qualified_name):
+            return await super().invoke(ctx)
 
     async def on_command(self, ctx: MyContext):
         self.commands_used[ctx.command.name] += 1
-        ctx.logger.info(f"{ctx.message.clean_content}")
+        ctx.logger.info("%s", ctx.message.clean_content)
 
     async def on_shard_ready(self, shard_id):
         self.shards_ready.add(shard_id)
@@ -53,8 +158,13 @@ class MyBot(AutoShardedBot):
 
     async def on_ready(self):
         messages = ["-----------", f"The bot is ready.", f"Logged in as {self.user.name} ({self.user.id})."]
-        total_members = len(self.users)
-        messages.append(f"I see {len(self.guilds)} guilds, and {total_members} members.")
+        total_members = sum(guild.member_count for guild in self.guilds)
+        messages.append(f"I see {len(self.guilds)} guilds, and {total_members} members ({len(self.users)} users in cache).")
+        messages.append(f"Memory used: {get_memory_usage() / 1024 / 1024:.1f} MiB")
+        for shard_id in sorted(self.shards):
+            shard_guilds = [guild for guild in self.guilds if guild.shard_id == shard_id]
+            cached_members = sum(len(guild.members) for guild in shard_guilds)
+            messages.append(f"Shard {shard_id}: {len(shard_guilds)} guilds, {cached_members} members in cache.")
         messages.append(f"To invite your bot to your server, use the following link: https://discordapp.com/api/oauth2/authorize?client_id={self.user.id}&scope=bot&permissions=0")
         cogs_count = len(self.cogs)
         messages.append(f"{cogs_count} cogs are loaded")
@@ -74,4 +184,47 @@ async def get_prefix(bot: MyBot, message: discord.Message):
         return commands.when_mentioned_or(*forced_prefixes, "")(bot, message)
 
     else:
-        return commands.when_mentioned_or(*forced_prefixes)(bot, message)
\ No newline at end of file
+        return commands.when_mentioned_or(*forced_prefixes)(bot, message)
+
+
+def get_cache_options(bot_config: dict) -> dict:
+    cache_config = bot_config["bot"].get("cache", {})
+
+    intents = discord.Intents.none()
+    for intent in cache_config.get("intents", ["default"]):
+        if intent == "default":
+            intents.value |= discord.Intents.default().value
+        else:
+            setattr(intents, intent, True)
+
+    member_cache_flags = discord.MemberCacheFlags.none()
+    for flag in cache_config.get("member_cache", []):
+        setattr(member_cache_flags, flag, True)
+
+    return {
+        "intents": intents,
+        "chunk_guilds_at_startup": cache_config.get("chunk_guilds_at_startup", False),
+        "member_cache_flags": member_cache_flags,
+        "max_messages": cache_config.get("max_messages", 1000) or None,
+    }
+
+
+def get_recording_config(bot_config: dict, cluster: coordinator.ClusterInfo) -> dict:
+    recording_config = bot_config.get("recording", {})
+    if not cluster.clustered:
+        return recording_config
+
+    # Every cluster records to its own file.
+    root, extension = os.path.splitext(recording_config.get("path", "recordings/traffic.bin"))
+    return dict(recording_config, path=f"{root}-cluster-{cluster.id}{extension}")
+
+
+def get_memory_usage() -> int:
+    """Resident memory of the process, in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # Not on linux, use the peak usage instead.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
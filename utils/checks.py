@@ -7,6 +7,16 @@ class NotInServer(commands.CheckFailure):
         self.must_be_in_guild_id = must_be_in_guild_id
 
 
+class Overloaded(commands.CheckFailure):
+    """Exception raised when a non-essential command is refused because the bot is overloaded."""
+    pass
+
+
+class PlayersBusy(commands.CheckFailure):
+    """Exception raised when the players of a command are held by another command for too long."""
+    pass
+
+
 def is_in_server(must_be_in_guild_id):
     def predicate(ctx):
         if not ctx.guild:
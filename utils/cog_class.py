@@ -2,6 +2,7 @@ import toml
 from discord.ext import commands
 
 from utils.bot_class import MyBot
+from utils.cooldowns import take_shared_cooldowns
 
 
 class Cog(commands.Cog):
@@ -13,6 +14,9 @@ class Cog(commands.Cog):
     def setup(cls, bot: MyBot):
         return bot.add_cog(cls(bot))
 
+    async def cog_before_invoke(self, ctx):
+        await take_shared_cooldowns(ctx)
+
     def config(self):
         config = self.bot.config
         cog_config = config["cogs"].get(self.qualified_name, {})
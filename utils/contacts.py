@@ -0,0 +1,218 @@
+"""
+Who talked with whom, recently.
+
+Every message links its author with the players that talked in the same channel during the last `window` seconds.
+Links are weighted, and their weight decays exponentially. The decay is lazy: an edge keeps its weight at the time it
+was last updated, and is decayed when it's read.
+
+Every player also has an infection pressure, the sum of the weights of their edges with infected (or dead) players.
+All the weights decay at the same rate, so their sum does too, and the pressure is updated incrementally when an edge
+is reinforced or a player state changes, instead of being recomputed from the channel for every message.
+
+Weak edges are dropped, which keeps the memory bounded. An edge weighs at most `max_weight`, so once it wasn't
+reinforced for `expiry` seconds it's weaker than `prune_below`. Every edge has one entry in an expiry queue, and every
+message pops at most `prune_batch` of the entries that are due: the edges that were reinforced since are queued again,
+the others are dropped. Stale speakers and channels are forgotten the same way, oldest first. No message pays for a
+walk of the whole graph.
+"""
+import collections
+import math
+import typing
+
+
+class ContactGraph:
+    def __init__(self, *, window: float = 900, half_life: float = 600, contact_weight: float = 1.0, max_weight: float = 1.0,
+                 channel_history: int = 10, prune_below: float = 0.05, prune_batch: int = 100):
+        self.window = window
+        self.rate = math.log(2) / half_life
+        self.contact_weight = contact_weight
+        self.max_weight = max_weight
+        self.channel_history = channel_history
+        self.prune_below = prune_below
+        self.prune_batch = prune_batch
+        self.expiry = math.log(max_weight / prune_below) / self.rate if max_weight > prune_below else 0.0
+
+        # Timestamp of the latest message, every update happens at that time.
+        self.now = 0.0
+        self.recorded = 0
+        # channel id -> (timestamp, user id) of the latest messages, the channel that was quiet for the longest first
+        self.channels: typing.OrderedDict[int, typing.Deque[typing.Tuple[float, int]]] = collections.OrderedDict()
+        # user id -> neighbour id -> [weight, updated at]. Both directions share the same list.
+        self.edges: typing.Dict[int, typing.Dict[int, list]] = {}
+        # user id -> [pressure, updated at]
+        self.pressures: typing.Dict[int, list] = {}
+        self.infectious: typing.Set[int] = set()
+        # user id -> timestamp of their latest message, the user that was quiet for the longest first
+        self.spoke_at: typing.OrderedDict[int, float] = collections.OrderedDict()
+        # (due at, user id, neighbour id), one per edge. Only roughly in order: the edges queued again can be due before
+        # the ones queued after them, and wait for these to be popped.
+        self.expiring: typing.Deque[typing.Tuple[float, int, int]] = collections.deque()
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'ContactGraph':
+        return cls(**config)
+
+    def decayed(self, value: float, at: float, now: float) -> float:
+        if now <= at:
+            return value
+        return value * math.exp(-self.rate * (now - at))
+
+    def add_pressure(self, user_id: int, amount: float, now: float):
+        pressure = self.pressures.get(user_id)
+        if pressure is None:
+            if amount > 0:
+                self.pressures[user_id] = [amount, now]
+        else:
+            # Hot path, the decay is inlined.
+            value, updated_at = pressure
+            if now > updated_at:
+                value *= math.exp(-self.rate * (now - updated_at))
+            value += amount
+            # Rounding errors could make it slightly negative after removals.
+            pressure[0] = value if value > 0 else 0.0
+            pressure[1] = now
+
+    def pressure(self, user_id: int) -> float:
+        """Decayed weight of the contacts of this user with infected players."""
+        pressure = self.pressures.get(user_id)
+        if pressure is None:
+            return 0.0
+        return self.decayed(pressure[0], pressure[1], self.now)
+
+    def link(self, user_id: int, other_id: int, now: float):
+        neighbours = self.edges.get(user_id)
+        if neighbours is None:
+            neighbours = self.edges[user_id] = {}
+        edge = neighbours.get(other_id)
+        if edge is None:
+            weight = 0.0
+            edge = neighbours[other_id] = [0.0, now]
+            self.edges.setdefault(other_id, {})[user_id] = edge
+            self.expiring.append((now + self.expiry, user_id, other_id))
+        else:
+            weight, updated_at = edge
+            if now > updated_at:
+                weight *= math.exp(-self.rate * (now - updated_at))
+
+        reinforced = min(weight + self.contact_weight, self.max_weight)
+        edge[0], edge[1] = reinforced, now
+
+        gained = reinforced - weight
+        if gained > 0:
+            if other_id in self.infectious:
+                self.add_pressure(user_id, gained, now)
+            if user_id in self.infectious:
+                self.add_pressure(other_id, gained, now)
+
+    def record(self, channel_id: int, user_id: int, timestamp: float) -> typing.Set[int]:
+        """
+        A message was sent: link its author with the recent speakers of the channel, and return them.
+        """
+        now = self.now = max(self.now, timestamp)
+
+        history = self.channels.get(channel_id)
+        if history is None:
+            history = self.channels[channel_id] = collections.deque(maxlen=self.channel_history)
+        else:
+            self.channels.move_to_end(channel_id)
+
+        since = timestamp - self.window
+        speakers = {speaker for spoke_at, speaker in history if spoke_at >= since and speaker != user_id}
+        for speaker in speakers:
+            self.link(user_id, speaker, now)
+        history.append((timestamp, user_id))
+        self.spoke_at[user_id] = timestamp
+        self.spoke_at.move_to_end(user_id)
+
+        self.recorded += 1
+        self.prune(now)
+
+        return speakers
+
+    def set_infectious(self, user_id: int, infectious: bool):
+        """
+        The user was (or wasn't anymore) infected: move the pressure of their contacts accordingly.
+        """
+        if infectious == (user_id in self.infectious):
+            return
+
+        if infectious:
+            self.infectious.add(user_id)
+            sign = 1
+        else:
+            self.infectious.discard(user_id)
+            sign = -1
+
+        now = self.now
+        for neighbour, (weight, updated_at) in self.edges.get(user_id, {}).items():
+            self.add_pressure(neighbour, sign * self.decayed(weight, updated_at, now), now)
+
+    def contacts(self, user_id: int, limit: int = 10) -> typing.List[typing.Tuple[int, float]]:
+        """Strongest contacts of the user, as (user id, weight)."""
+        now = self.now
+        weights = [(neighbour, self.decayed(weight, updated_at, now))
+                   for neighbour, (weight, updated_at) in self.edges.get(user_id, {}).items()]
+        weights.sort(key=lambda contact: contact[1], reverse=True)
+        return weights[:limit]
+
+    def prune(self, now: float):
+        """Drop the expired edges, then forget the stale speakers and channels, prune_batch of each at most."""
+        expiring = self.expiring
+        for _ in range(self.prune_batch):
+            if not expiring or expiring[0][0] > now:
+                break
+            _, user_id, other_id = expiring.popleft()
+            edge = self.edges[user_id][other_id]
+            if edge[1] + self.expiry > now:
+                # Reinforced since it was queued.
+                expiring.append((edge[1] + self.expiry, user_id, other_id))
+            else:
+                self.unlink(user_id, other_id, self.decayed(edge[0], edge[1], now), now)
+
+        since = now - self.window
+        for _ in range(self.prune_batch):
+            if not self.spoke_at:
+                break
+            user_id = next(iter(self.spoke_at))
+            if self.spoke_at[user_id] >= since:
+                break
+            del self.spoke_at[user_id]
+            if user_id not in self.edges:
+                self.forget(user_id)
+
+        for _ in range(self.prune_batch):
+            if not self.channels:
+                break
+            channel_id = next(iter(self.channels))
+            if self.channels[channel_id][-1][0] >= since:
+                break
+            del self.channels[channel_id]
+
+    def unlink(self, user_id: int, other_id: int, weight: float, now: float):
+        self.unlink_side(user_id, other_id, weight, now)
+        self.unlink_side(other_id, user_id, weight, now)
+
+    def unlink_side(self, user_id: int, other_id: int, weight: float, now: float):
+        neighbours = self.edges[user_id]
+        del neighbours[other_id]
+        if other_id in self.infectious:
+            self.add_pressure(user_id, -weight, now)
+        if not neighbours:
+            del self.edges[user_id]
+            if user_id not in self.spoke_at:
+                self.forget(user_id)
+
+    def forget(self, user_id: int):
+        # Without edges, nothing is left to keep: the users send their state again with their next message.
+        self.pressures.pop(user_id, None)
+        self.infectious.discard(user_id)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self.edges),
+            # One entry per edge.
+            "edges": len(self.expiring),
+            "channels": len(self.channels),
+            "infectious": len(self.infectious),
+            "messages": self.recorded,
+        }
@@ -0,0 +1,200 @@
+"""
+Command cooldowns that survive restarts, and can be shared by several processes.
+
+They are token buckets: a bucket holds up to `rate` tokens, every use takes one, and they come back at `rate` per
+`per` seconds. With the database backend, a use is a single upsert (on Postgres), that refills all the buckets of the
+command, takes a token from each of them if they all have one, and returns the result. Buckets refused locally are cached until they get a token back, so a user spamming a
+command on cooldown doesn't cost a query every time. Full buckets are pruned regularly.
+
+    @shared_cooldown(2, 600, commands.BucketType.user)
+
+replaces @commands.cooldown(2, 600, commands.BucketType.user), and raises the same CommandOnCooldown. Tokens are only
+taken when the command is invoked, once its checks passed (see Cog.cog_before_invoke), so that listing the commands in
+the help doesn't use them. Every cooldown stacked on a command applies: a use needs a token from each of its buckets,
+and takes none unless they all have one.
+"""
+import time
+import typing
+
+from discord.ext import commands
+from tortoise import Tortoise
+
+from utils.models import CooldownBucket
+
+# Takes a token from every bucket of a use if they all have one, or none. The buckets are refilled from their row as
+# it was when the statement started to decide, then once more from the locked row when they are updated: a concurrent
+# use still can't take a token that isn't there.
+TAKE_QUERY = """
+WITH wanted (bucket, rate, per, used_at) AS (VALUES {values}),
+refilled AS (
+    SELECT wanted.bucket, wanted.rate, wanted.per, wanted.used_at,
+        CASE WHEN {table}.bucket IS NULL THEN wanted.rate ELSE {peek_refill} END AS tokens
+    FROM wanted LEFT JOIN {table} ON {table}.bucket = wanted.bucket
+),
+verdict AS (SELECT MIN(tokens) >= 1 AS allowed FROM refilled)
+INSERT INTO {table} (bucket, rate, per, tokens, allowed, updated_at, expires_at)
+SELECT bucket, rate, per, CASE WHEN verdict.allowed THEN rate - 1 ELSE rate END, verdict.allowed, used_at,
+    CASE WHEN verdict.allowed THEN used_at + per / rate ELSE used_at END
+FROM wanted, verdict WHERE TRUE
+ON CONFLICT (bucket) DO UPDATE SET
+    tokens = CASE WHEN excluded.allowed AND {refill} >= 1 THEN {refill} - 1 ELSE {refill} END,
+    allowed = excluded.allowed AND {refill} >= 1,
+    expires_at = excluded.updated_at + (excluded.rate - CASE WHEN excluded.allowed AND {refill} >= 1 THEN {refill} - 1 ELSE {refill} END) * excluded.per / excluded.rate,
+    rate = excluded.rate,
+    per = excluded.per,
+    updated_at = excluded.updated_at
+"""
+
+# Tokens of the bucket when the new use happens, before taking one. The SET expressions see the old row.
+REFILL = """(CASE WHEN {table}.tokens + ({new}.{updated_at} - {table}.updated_at) * {new}.rate / {new}.per > {new}.rate
+    THEN {new}.rate ELSE {table}.tokens + ({new}.{updated_at} - {table}.updated_at) * {new}.rate / {new}.per END)"""
+
+
+Bucket = typing.Tuple[str, int, float]  # (key, rate, per)
+
+
+def refill(tokens: float, updated_at: float, rate: int, per: float, now: float) -> float:
+    return min(rate, tokens + (now - updated_at) * rate / per)
+
+
+def wait_for_token(tokens: float, rate: int, per: float) -> float:
+    return 0.0 if tokens >= 1 else (1 - tokens) * per / rate
+
+
+class MemoryCooldownStore:
+    """Buckets of this process only."""
+    def __init__(self):
+        # bucket -> (tokens, updated at, expires at)
+        self.buckets: typing.Dict[str, typing.Tuple[float, float, float]] = {}
+
+    async def take(self, buckets: typing.List[Bucket], now: float = None) -> typing.List[float]:
+        """
+        Take a token from every bucket if they all have one. Returns how many seconds to wait for a token, per bucket.
+        """
+        now = now or time.time()
+        tokens = []
+        for bucket, rate, per in buckets:
+            bucket_tokens, updated_at, _ = self.buckets.get(bucket, (rate, now, now))
+            tokens.append(refill(bucket_tokens, updated_at, rate, per, now))
+
+        retry_afters = [wait_for_token(bucket_tokens, rate, per) for bucket_tokens, (_, rate, per) in zip(tokens, buckets)]
+        if any(retry_afters):
+            return retry_afters
+
+        for bucket_tokens, (bucket, rate, per) in zip(tokens, buckets):
+            bucket_tokens -= 1
+            self.buckets[bucket] = (bucket_tokens, now, now + (rate - bucket_tokens) * per / rate)
+        return retry_afters
+
+    async def prune(self, now: float = None) -> int:
+        now = now or time.time()
+        expired = [bucket for bucket, (_, _, expires_at) in self.buckets.items() if expires_at <= now]
+        for bucket in expired:
+            del self.buckets[bucket]
+        return len(expired)
+
+
+class DatabaseCooldownStore:
+    """Buckets in the database, shared by every process using it."""
+    def __init__(self, bot):
+        self.bot = bot
+        # bucket -> time until which it's known to be empty
+        self.refused: typing.Dict[str, float] = {}
+        self.queries: typing.Dict[str, str] = {}
+        # Used while the database can't be reached, so that commands still work.
+        self.fallback = MemoryCooldownStore()
+
+    def take_query(self, connection, count: int) -> str:
+        dialect = connection.capabilities.dialect
+        query = self.queries.get((dialect, count))
+        if query is None:
+            table = CooldownBucket._meta.table
+            if dialect == "postgres":
+                # The parameters of VALUES would be text otherwise.
+                values = [f"(CAST(${i * 4 + 1} AS TEXT), CAST(${i * 4 + 2} AS INTEGER), CAST(${i * 4 + 3} AS DOUBLE PRECISION), CAST(${i * 4 + 4} AS DOUBLE PRECISION))"
+                          for i in range(count)]
+            else:
+                values = ["(?, ?, ?, ?)"] * count
+            query = TAKE_QUERY.format(table=table, values=", ".join(values),
+                                      peek_refill=REFILL.format(table=table, new="wanted", updated_at="used_at"),
+                                      refill=REFILL.format(table=table, new="excluded", updated_at="updated_at"))
+            if dialect == "postgres":
+                query += "RETURNING bucket, tokens, allowed"
+            self.queries[(dialect, count)] = query
+        return query
+
+    async def execute_take(self, connection, buckets: typing.List[Bucket], now: float) -> typing.Dict[str, dict]:
+        values = [value for bucket, rate, per in buckets for value in (bucket, rate, float(per), now)]
+        rows = await connection.execute_query_dict(self.take_query(connection, len(buckets)), values)
+        if not rows:
+            # The sqlite driver only applies an INSERT ... RETURNING once its cursor is reset, so it's read back
+            # separately. The database is in the process anyway.
+            keys = [bucket for bucket, _, _ in buckets]
+            rows = await connection.execute_query_dict(f"SELECT bucket, tokens, allowed FROM {CooldownBucket._meta.table} WHERE bucket IN ({', '.join('?' * len(keys))})", keys)
+        return {row["bucket"]: row for row in rows}
+
+    async def take(self, buckets: typing.List[Bucket], now: float = None) -> typing.List[float]:
+        """
+        Take a token from every bucket if they all have one. Returns how many seconds to wait for a token, per bucket.
+        """
+        now = now or time.time()
+        retry_afters = [max(0.0, self.refused.get(bucket, now) - now) for bucket, _, _ in buckets]
+        if any(retry_afters):
+            return retry_afters
+
+        try:
+            connection = Tortoise.get_connection("default")
+            with self.bot.metrics.timer("db", "cooldown"):
+                # Stacked cooldowns are taken together, a single statement whatever their number.
+                rows = await self.execute_take(connection, buckets, now)
+            retry_afters = [0.0 if rows[bucket]["allowed"] else wait_for_token(rows[bucket]["tokens"], rate, per)
+                            for bucket, rate, per in buckets]
+        except Exception as e:
+            self.bot.logger.warning(f"Shared cooldowns unavailable, using local ones: {e}")
+            return await self.fallback.take(buckets, now)
+
+        for (bucket, _, _), retry_after in zip(buckets, retry_afters):
+            if retry_after:
+                self.refused[bucket] = now + retry_after
+        return retry_afters
+
+    async def prune(self, now: float = None) -> int:
+        now = now or time.time()
+        for bucket in [bucket for bucket, refused_until in self.refused.items() if refused_until <= now]:
+            del self.refused[bucket]
+        await self.fallback.prune(now)
+        return await CooldownBucket.filter(expires_at__lte=now).delete()
+
+
+def create_store(bot, config: dict):
+    if config.get("backend", "database") == "memory":
+        return MemoryCooldownStore()
+    return DatabaseCooldownStore(bot)
+
+
+def shared_cooldown(rate: int, per: float, type: commands.BucketType = commands.BucketType.default):
+    """
+    Same as commands.cooldown, with the buckets in the bot cooldown store. Several of them can be stacked on a command.
+    """
+    def decorator(func):
+        callback = func.callback if isinstance(func, commands.Command) else func
+        if not hasattr(callback, "__shared_cooldowns__"):
+            callback.__shared_cooldowns__ = []
+        callback.__shared_cooldowns__.append(commands.Cooldown(rate, per, type))
+        return func
+
+    return decorator
+
+
+async def take_shared_cooldowns(ctx):
+    """Take the tokens of the command being invoked, raises CommandOnCooldown when one of its buckets is empty."""
+    cooldowns = getattr(ctx.command.callback, "__shared_cooldowns__", None)
+    if not cooldowns:
+        return
+
+    buckets = [(f"{ctx.command.qualified_name}:{cooldown.rate}/{cooldown.per}:{cooldown.type.name}:{cooldown.type.get_key(ctx.message)}", cooldown.rate, cooldown.per)
+               for cooldown in cooldowns]
+    retry_afters = await ctx.bot.cooldowns.take(buckets)
+    if any(retry_afters):
+        retry_after, cooldown = max(zip(retry_afters, cooldowns), key=lambda pair: pair[0])
+        raise commands.CommandOnCooldown(cooldown, retry_after)
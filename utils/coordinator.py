@@ -0,0 +1,446 @@
+"""
+Coordination of the clusters started by launcher.py: every cluster is a process running a range of the shards, and they
+all talk to a coordinator hosted by the launcher, over a unix socket.
+
+The coordinator holds locks, so that two clusters never change the same player at the same time (a hug between players
+seen on different shards), and the counters every cluster reports, so that the status shows the whole bot. The
+protocol is one JSON object per line. Requests carry an id, repeated in their response, and requests without an id
+get no response. A cluster that stops waiting for its locks cancels the request, and the server releases them if it
+granted them meanwhile.
+
+Locks are leases: they are released by their holder, when it disconnects, or after `lease` seconds, so that a stuck or
+dead cluster can't block players forever. A bot started with main.py uses a LocalCoordinator, with the same interface
+and the locks of its own process.
+"""
+import abc
+import asyncio
+import collections
+import contextlib
+import itertools
+import json
+import os
+import time
+import typing
+
+ENVIRONMENT_VARIABLE = "CORONED_CLUSTER"
+
+
+class ClusterInfo:
+    """Which part of the bot this process runs. A bot started with main.py runs all of it."""
+    def __init__(self, id: int = 0, count: int = 1, shard_ids: typing.List[int] = None, shard_count: int = None,
+                 leader: int = 0, socket: str = None, max_concurrency: int = 1):
+        self.id = id
+        self.count = count
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        # Cluster running the jobs that must only run once for the whole bot.
+        self.leader = leader
+        self.socket = socket
+        # Number of shards that can identify at the same time.
+        self.max_concurrency = max_concurrency
+
+    @property
+    def clustered(self) -> bool:
+        return self.socket is not None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.id == self.leader
+
+    @classmethod
+    def from_environment(cls) -> 'ClusterInfo':
+        value = os.environ.get(ENVIRONMENT_VARIABLE)
+        return cls(**json.loads(value)) if value else cls()
+
+    def to_environment(self) -> str:
+        return json.dumps(vars(self))
+
+
+class LockTimeout(Exception):
+    """Raised when locks couldn't be taken before the timeout."""
+    pass
+
+
+class Lease:
+    __slots__ = ('token', 'keys', 'owner', 'request', 'hold', 'expiry')
+
+    def __init__(self, token: int, keys: typing.List[str], owner, request, hold: bool, expiry: asyncio.TimerHandle):
+        self.token = token
+        self.keys = keys
+        self.owner = owner
+        # Id of the request of the owner that got it.
+        self.request = request
+        # Held until it expires, on purpose.
+        self.hold = hold
+        self.expiry = expiry
+
+
+class LockTable:
+    """Named locks, taken several at once, and released when their lease expires if their holder didn't."""
+    def __init__(self, logger):
+        self.logger = logger
+        self.locks: typing.Dict[str, asyncio.Lock] = {}
+        # Number of holders and waiters of every lock, to forget the unused ones.
+        self.users: typing.Counter[str] = collections.Counter()
+        self.leases: typing.Dict[int, Lease] = {}
+        self.tokens = itertools.count(1)
+        self.timeouts = 0
+        self.expired = 0
+
+    async def acquire(self, keys: typing.Iterable[str], lease: float, timeout: float, owner=None, hold: bool = False, request=None) -> Lease:
+        # Always in the same order, so that two requests for the same keys can't deadlock.
+        keys = sorted(set(keys))
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        acquired = []
+        for key in keys:
+            self.users[key] += 1
+
+        try:
+            for key in keys:
+                lock = self.locks.get(key)
+                if lock is None:
+                    lock = self.locks[key] = asyncio.Lock()
+                if lock.locked():
+                    await asyncio.wait_for(lock.acquire(), max(0.0, deadline - loop.time()))
+                else:
+                    await lock.acquire()
+                acquired.append(key)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.unlock(keys, acquired)
+            raise LockTimeout(f"Timed out after {timeout}s waiting for {', '.join(keys)}") from None
+        except BaseException:
+            self.unlock(keys, acquired)
+            raise
+
+        token = next(self.tokens)
+        self.leases[token] = Lease(token, keys, owner, request, hold, loop.call_later(lease, self.expire, token))
+        return self.leases[token]
+
+    def unlock(self, keys: typing.List[str], acquired: typing.List[str]):
+        for key in acquired:
+            self.locks[key].release()
+        for key in keys:
+            self.users[key] -= 1
+            if not self.users[key]:
+                del self.users[key]
+                del self.locks[key]
+
+    def release(self, token: int) -> bool:
+        """Returns False when the lease had already expired."""
+        lease = self.leases.pop(token, None)
+        if lease is None:
+            return False
+        lease.expiry.cancel()
+        self.unlock(lease.keys, lease.keys)
+        return True
+
+    def release_owner(self, owner):
+        for token in [token for token, lease in self.leases.items() if lease.owner == owner]:
+            self.release(token)
+
+    def release_request(self, owner, request) -> bool:
+        for token, lease in self.leases.items():
+            if lease.owner == owner and lease.request == request:
+                return self.release(token)
+        return False
+
+    def expire(self, token: int):
+        lease = self.leases[token]
+        if not lease.hold:
+            self.expired += 1
+            self.logger.warning(f"The lease of {', '.join(lease.keys)} expired before its holder released it")
+        self.release(token)
+
+
+class CoordinatorServer:
+    """Hosted by the launcher."""
+    def __init__(self, path: str, logger):
+        self.path = path
+        self.logger = logger
+        self.locks = LockTable(logger)
+        # cluster id -> its last report
+        self.reports: typing.Dict[int, dict] = {}
+        self.server: typing.Optional[asyncio.AbstractServer] = None
+        self.connections = itertools.count(1)
+
+    async def start(self):
+        if os.path.exists(self.path):
+            # Left by a launcher that didn't stop cleanly.
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self.handle_connection, path=self.path)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = next(self.connections)
+        cluster = None
+        # request id -> task waiting for its locks
+        acquiring: typing.Dict[int, asyncio.Future] = {}
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                message = json.loads(line)
+                op = message["op"]
+                if op == "acquire":
+                    # In its own task, the other requests of the cluster must not wait for the locks.
+                    task = acquiring[message["id"]] = asyncio.ensure_future(self.acquire(message, connection, writer))
+                    task.add_done_callback(lambda _, request=message["id"]: acquiring.pop(request, None))
+                elif op == "release":
+                    self.locks.release(message["token"])
+                elif op == "cancel":
+                    # The cluster stopped waiting: it won't release what it gets.
+                    task = acquiring.get(message["request"])
+                    if task is not None and not task.done():
+                        task.cancel()
+                    else:
+                        self.locks.release_request(connection, message["request"])
+                elif op == "hello":
+                    cluster = message["cluster"]
+                    self.logger.info(f"Cluster {cluster} connected to the coordinator")
+                elif op == "report":
+                    self.reports[cluster] = message["report"]
+                    self.respond(writer, message, reports=self.reports)
+                else:
+                    self.respond(writer, message, error=f"Unknown op {op}")
+        except (ConnectionError, ValueError, KeyError) as e:
+            self.logger.warning(f"Dropping the connection of cluster {cluster}: {type(e).__name__}: {e}")
+        finally:
+            for task in list(acquiring.values()):
+                task.cancel()
+            self.locks.release_owner(connection)
+            self.reports.pop(cluster, None)
+            writer.close()
+            self.logger.info(f"Cluster {cluster} disconnected from the coordinator")
+
+    async def acquire(self, message: dict, connection: int, writer: asyncio.StreamWriter):
+        try:
+            lease = await self.locks.acquire(message["keys"], message["lease"], message["timeout"], owner=connection, hold=message.get("hold", False),
+                                             request=message["id"])
+        except LockTimeout as e:
+            self.respond(writer, message, error=str(e))
+        else:
+            self.respond(writer, message, token=lease.token)
+
+    @staticmethod
+    def respond(writer: asyncio.StreamWriter, request: dict, **response):
+        if request.get("id") is not None and not writer.is_closing():
+            response["id"] = request["id"]
+            writer.write(json.dumps(response).encode() + b"\n")
+
+
+class BaseCoordinator(abc.ABC):
+    def __init__(self, bot, lock_lease: float = 30, lock_timeout: float = 10):
+        self.bot = bot
+        self.lock_lease = lock_lease
+        self.lock_timeout = lock_timeout
+        # cluster id -> its last report
+        self.reports: typing.Dict[int, dict] = {}
+
+    @abc.abstractmethod
+    async def acquire(self, keys: typing.Iterable[str], lease: float = None, timeout: float = None, hold: bool = False):
+        """Take the locks of the keys, raises LockTimeout if they are still held by someone else after the timeout."""
+
+    @abc.abstractmethod
+    def release(self, lease):
+        pass
+
+    @abc.abstractmethod
+    async def report(self, report: dict) -> typing.Dict[int, dict]:
+        """Send the counters of this cluster, returns the last ones of every cluster."""
+
+    @abc.abstractmethod
+    async def close(self):
+        pass
+
+    @contextlib.asynccontextmanager
+    async def lock(self, *keys: str):
+        """Hold the locks of the keys during the block."""
+        with self.bot.metrics.timer("lock", "acquire"):
+            lease = await self.acquire(keys)
+        try:
+            yield
+        finally:
+            self.release(lease)
+
+
+class LocalCoordinator(BaseCoordinator):
+    """For a bot running every shard itself, locks only have to work within the process."""
+    def __init__(self, bot, lock_lease: float = 30, lock_timeout: float = 10):
+        super().__init__(bot, lock_lease, lock_timeout)
+        self.locks = LockTable(bot.logger)
+
+    async def acquire(self, keys: typing.Iterable[str], lease: float = None, timeout: float = None, hold: bool = False) -> Lease:
+        return await self.locks.acquire(keys, lease or self.lock_lease, timeout or self.lock_timeout, hold=hold)
+
+    def release(self, lease: Lease):
+        self.locks.release(lease.token)
+
+    async def report(self, report: dict) -> typing.Dict[int, dict]:
+        self.reports = {report["cluster"]: report}
+        return self.reports
+
+    async def close(self):
+        pass
+
+
+class CoordinatorClient(BaseCoordinator):
+    """
+    Connection of a cluster to the coordinator. While it can't be reached, the locks of this process are used instead,
+    so that the game keeps going.
+    """
+    def __init__(self, bot, path: str, lock_lease: float = 30, lock_timeout: float = 10):
+        super().__init__(bot, lock_lease, lock_timeout)
+        self.path = path
+        self.writer: typing.Optional[asyncio.StreamWriter] = None
+        self.read_task: typing.Optional[asyncio.Task] = None
+        self.responses: typing.Dict[int, asyncio.Future] = {}
+        self.request_ids = itertools.count(1)
+        self.connecting = asyncio.Lock()
+        self.retry_at = 0.0
+        self.fallback = LocalCoordinator(bot, lock_lease, lock_timeout)
+        self.using_fallback = False
+
+    async def connect(self):
+        if self.writer is not None:
+            return
+        if time.monotonic() < self.retry_at:
+            raise ConnectionError("The coordinator was unreachable a moment ago")
+
+        async with self.connecting:
+            if self.writer is not None:
+                return
+            try:
+                reader, self.writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                self.retry_at = time.monotonic() + 5
+                raise
+
+            self.read_task = asyncio.ensure_future(self.read_responses(reader))
+            self.send({"op": "hello", "cluster": self.bot.cluster.id})
+            self.using_fallback = False
+            self.bot.logger.info(f"Connected to the coordinator on {self.path}")
+
+    async def read_responses(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self.responses.pop(response["id"], None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        finally:
+            self.writer.close()
+            self.writer = None
+            for future in self.responses.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Disconnected from the coordinator"))
+            self.responses.clear()
+
+    def send(self, message: dict):
+        self.writer.write(json.dumps(message).encode() + b"\n")
+
+    async def request(self, message: dict, timeout: float) -> dict:
+        await self.connect()
+        request_id = message["id"] = next(self.request_ids)
+        future = self.responses[request_id] = asyncio.get_event_loop().create_future()
+        self.send(message)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.responses.pop(request_id, None)
+
+    def unreachable(self, error: Exception):
+        if not self.using_fallback:
+            self.using_fallback = True
+            self.bot.logger.error(f"Coordinator unreachable, players are only locked within this cluster: {type(error).__name__}: {error}")
+
+    async def acquire(self, keys: typing.Iterable[str], lease: float = None, timeout: float = None, hold: bool = False) -> typing.Union[int, Lease]:
+        timeout = timeout or self.lock_timeout
+        message = {"op": "acquire", "keys": list(keys), "lease": lease or self.lock_lease, "timeout": timeout, "hold": hold}
+        try:
+            response = await self.request(message, timeout=timeout + 5)
+        except (OSError, asyncio.TimeoutError) as e:
+            self.cancel(message)
+            self.unreachable(e)
+            return await self.fallback.acquire(keys, lease, timeout, hold)
+        except asyncio.CancelledError:
+            self.cancel(message)
+            raise
+
+        if "error" in response:
+            raise LockTimeout(response["error"])
+        return response["token"]
+
+    def cancel(self, message: dict):
+        """The response to the request won't be read, the locks it may get are released by the coordinator."""
+        if "id" in message and self.writer is not None:
+            self.send({"op": "cancel", "request": message["id"]})
+
+    def release(self, lease: typing.Union[int, Lease]):
+        if isinstance(lease, Lease):
+            # Taken while the coordinator was unreachable.
+            self.fallback.release(lease)
+        elif self.writer is not None:
+            self.send({"op": "release", "token": lease})
+
+    async def report(self, report: dict) -> typing.Dict[int, dict]:
+        """Send the counters of this cluster, returns the last ones of every cluster."""
+        try:
+            response = await self.request({"op": "report", "report": report}, timeout=5)
+        except (OSError, asyncio.TimeoutError) as e:
+            self.unreachable(e)
+            self.reports = {report["cluster"]: report}
+        else:
+            self.reports = {int(cluster): cluster_report for cluster, cluster_report in response["reports"].items()}
+        return self.reports
+
+    async def close(self):
+        if self.read_task is not None:
+            self.read_task.cancel()
+
+
+def create_coordinator(bot, config: dict) -> BaseCoordinator:
+    lock_lease, lock_timeout = config.get("lock_lease", 30), config.get("lock_timeout", 10)
+    if not bot.cluster.clustered:
+        return LocalCoordinator(bot, lock_lease, lock_timeout)
+    return CoordinatorClient(bot, bot.cluster.socket, lock_lease, lock_timeout)
+
+
+def cluster_report(bot) -> dict:
+    """Counters of this process, sent to the coordinator."""
+    return {
+        "cluster": bot.cluster.id,
+        "at": time.time(),
+        "guilds": len(bot.guilds),
+        "users": len(bot.users),
+        "commands_used": dict(bot.commands_used),
+        "latencies": [[shard_id, latency] for shard_id, latency in bot.latencies],
+        "shards_ready": sorted(bot.shards_ready),
+    }
+
+
+def aggregate(reports: typing.Iterable[dict]) -> dict:
+    """Counters of the whole bot. Users seen by several clusters are counted once per cluster."""
+    totals = {"clusters": 0, "guilds": 0, "users": 0, "commands_used": collections.Counter(), "latencies": [], "shards_ready": set()}
+    for report in reports:
+        totals["clusters"] += 1
+        totals["guilds"] += report["guilds"]
+        totals["users"] += report["users"]
+        totals["commands_used"].update(report["commands_used"])
+        totals["latencies"].extend((shard_id, latency) for shard_id, latency in report["latencies"])
+        totals["shards_ready"].update(report["shards_ready"])
+    totals["latencies"].sort()
+    return totals
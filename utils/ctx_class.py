@@ -43,7 +43,8 @@ class MyContext(commands.Context):
             else:
                 file = message_file
 
-        message = await super().send(content, file=file, files=files, **kwargs)
+        with self.bot.metrics.timer("rest", "send"):
+            message = await super().send(content, file=file, files=files, **kwargs)
 
         # Message deletion if source is deleted
         if delete_on_invoke_removed:
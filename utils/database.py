@@ -1,15 +1,22 @@
 import asyncio
-import random
+import collections
+import typing
 
 import discord
 from tortoise import Tortoise
+from tortoise.transactions import in_transaction
 
-from .models import Player, Achievements, Inventory, Statistics, AlignementGood, AlignementLaw
+from . import game_rules
+from .models import Player, Achievements, Inventory, Statistics
 
 
 class Database:
     def __init__(self, bot):
         self.bot = bot
+        # Bumped every time a player is saved, so that anything built from a player state can be cached.
+        self.player_versions = collections.Counter()
+        # Number of players, infected, dead and cured players, as of the last refresh_counters.
+        self.counters: typing.Dict[str, int] = {}
 
     async def init(self, url):
         await Tortoise.init(
@@ -19,18 +26,28 @@ class Database:
         # Generate the schema
         await Tortoise.generate_schemas()
 
+    async def refresh_counters(self) -> typing.Dict[str, int]:
+        with self.bot.metrics.timer("db", "refresh_counters"):
+            self.counters = {
+                "players": await Player.all().count(),
+                "infected": await Player.filter(percent_infected__gt=0, percent_infected__lt=100).count(),
+                "dead": await Player.filter(percent_infected__gte=100).count(),
+                "cured": await Player.filter(cured=True).count(),
+            }
+        return self.counters
+
     async def get_player(self, user: discord.User) -> Player:
+        with self.bot.metrics.timer("db", "get_player"):
+            return await self._get_player(user)
+
+    async def _get_player(self, user: discord.User) -> Player:
         player = await Player.filter(discord_id=user.id).first()
 
         if not player:
+            rng = self.bot.rng.for_guild(getattr(user, "guild", None))
             player = Player(discord_id=user.id,
                             discord_name=user.name,
-                            immunodeficient=random.randint(0, 100) <= 15,
-                            doctor=random.randint(0, 100) <= 2,
-                            good=random.choice(list(AlignementGood)),
-                            law=random.choice(list(AlignementLaw)),
-                            charisma=random.randint(0, 10)
-            )
+                            **game_rules.new_player_traits(rng))
             await player.save()
             inventory = Inventory(player=player)
             await inventory.save()
@@ -42,10 +59,50 @@ class Database:
         await player.fetch_related('inventory', 'statistics', 'achievements')
         return player
 
+    async def get_players(self, discord_ids: typing.Iterable[int]) -> typing.List[Player]:
+        """
+        Existing players only, with their related models, in a few queries whatever their number.
+        """
+        with self.bot.metrics.timer("db", "get_players"):
+            return await Player.filter(discord_id__in=list(discord_ids)).prefetch_related('inventory', 'statistics', 'achievements')
+
+    def lock_players(self, *discord_ids: int):
+        """
+        Hold the players while they are read, changed and saved, so that no other task or cluster changes them meanwhile.
+
+            async with bot.db.lock_players(author.id, target.id):
+                ...
+        """
+        return self.bot.coordinator.lock(*self.player_keys(discord_ids))
+
+    @staticmethod
+    def player_keys(discord_ids: typing.Iterable[int]) -> typing.List[str]:
+        return [f"player:{discord_id}" for discord_id in discord_ids]
+
+    def player_changed(self, player: Player):
+        self.player_versions[player.discord_id] += 1
+        self.bot.contacts.set_infectious(player.discord_id, player.is_infected())
+
     async def save_player(self, player: Player) -> None:
-        await player.save()
-        await player.inventory.save()
-        await player.achievements.save()
-        await player.statistics.save()
+        self.player_changed(player)
+        with self.bot.metrics.timer("db", "save_player"):
+            await self._save_player(player)
+
+    async def save_players(self, players: typing.Iterable[Player], using_db=None) -> None:
+        """
+        Save many players in a single transaction, or in the one given.
+        """
+        if using_db is None:
+            async with in_transaction() as connection:
+                return await self.save_players(players, using_db=connection)
 
+        with self.bot.metrics.timer("db", "save_players"):
+            for player in players:
+                self.player_changed(player)
+                await self._save_player(player, using_db)
 
+    async def _save_player(self, player: Player, using_db=None) -> None:
+        await player.save(using_db=using_db)
+        await player.inventory.save(using_db=using_db)
+        await player.achievements.save(using_db=using_db)
+        await player.statistics.save(using_db=using_db)
@@ -0,0 +1,57 @@
+"""
+Decide, as cheaply as possible, whether a message should go through the game.
+
+The allow/deny lists come from the cog configuration and are stored as frozensets, so a message is checked with
+a handful of set lookups, before any context parsing or database access.
+"""
+import collections
+
+import discord
+
+
+class EnablementIndex:
+    def __init__(self, *, enabled_guilds=(), disabled_guilds=(), enabled_channels=(), disabled_channels=(), ignore_bots=True):
+        # Empty allow lists mean "everywhere".
+        self.enabled_guilds = frozenset(enabled_guilds)
+        self.disabled_guilds = frozenset(disabled_guilds)
+        self.enabled_channels = frozenset(enabled_channels)
+        self.disabled_channels = frozenset(disabled_channels)
+        self.ignore_bots = ignore_bots
+
+        self.processed = 0
+        self.rejected = collections.Counter()
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'EnablementIndex':
+        return cls(enabled_guilds=config.get('enabled_guilds', ()),
+                   disabled_guilds=config.get('disabled_guilds', ()),
+                   enabled_channels=config.get('enabled_channels', ()),
+                   disabled_channels=config.get('disabled_channels', ()),
+                   ignore_bots=config.get('ignore_bots', True))
+
+    def rejection_reason(self, message: discord.Message):
+        guild = message.guild
+        if guild is None:
+            return "private message"
+        elif self.ignore_bots and message.author.bot:
+            return "bot"
+        elif guild.id in self.disabled_guilds or (self.enabled_guilds and guild.id not in self.enabled_guilds):
+            return "guild"
+
+        channel_id = message.channel.id
+        if channel_id in self.disabled_channels or (self.enabled_channels and channel_id not in self.enabled_channels):
+            return "channel"
+
+        return None
+
+    def allows(self, message: discord.Message, count: bool = True) -> bool:
+        """With count False, the counters are left alone, for a message that was already checked."""
+        reason = self.rejection_reason(message)
+        if not count:
+            return reason is None
+        elif reason is None:
+            self.processed += 1
+            return True
+        else:
+            self.rejected[reason] += 1
+            return False
@@ -0,0 +1,253 @@
+"""
+Pure game rules, kept away from discord and the database so they can be benchmarked and simulated offline.
+
+The roll_* functions update the player in place and return what happened, the callers save the player and tell the
+players about it.
+"""
+import array
+import itertools
+import typing
+
+from utils import models
+from utils.formats import TabularData
+from utils.rng import GameRNG
+
+ITEMS_EMOJIS = [item.value for item in models.ItemsEmojis]
+ALIGNEMENTS_GOOD = list(models.AlignementGood)
+ALIGNEMENTS_LAW = list(models.AlignementLaw)
+
+_items = models.ItemsEmojis
+FOUND_ITEMS = [_items.herb, _items.music_cd, _items.toilet_paper,
+               _items.virus_test, _items.music_cd, _items.toilet_paper,
+               _items.virus_test, _items.music_cd,
+               _items.virus_test, _items.mask]  # 1/10 of each
+
+# Achievements given when a player tests positive, by maximum infection percentage.
+SYMPTOMS = [(30, "it_was_just_a_cold"), (40, "symptoms"), (50, "bad_symptoms"), (60, "hospital_stay")]
+
+
+class InfectionRules(typing.NamedTuple):
+    base: float = 10
+    infected_neighbour: float = 8
+    immunodeficient_factor: float = 2
+    already_infected_malus: float = 10
+    divisor: float = 4
+    cured_divisor: float = 2
+
+
+DEFAULT_INFECTION_RULES = InfectionRules()
+
+
+def new_player_traits(rng: GameRNG) -> dict:
+    """Random traits of a new player."""
+    return {
+        "immunodeficient": rng.randint(0, 100) <= 15,
+        "doctor": rng.randint(0, 100) <= 2,
+        "good": rng.choice(ALIGNEMENTS_GOOD),
+        "law": rng.choice(ALIGNEMENTS_LAW),
+        "charisma": rng.randint(0, 10),
+    }
+
+
+def chance_for(rules: InfectionRules, immunodeficient: bool, isolation: int, infected: bool, cured: bool,
+               infected_neighbours: int) -> int:
+    """
+    Chance (in percent) for a player to be infected, given how many of the players that talked recently in the same
+    channel are infected. Dead players are infected too, so they count as infected neighbours.
+    """
+    chance = rules.base + infected_neighbours * rules.infected_neighbour
+
+    if immunodeficient:
+        chance *= rules.immunodeficient_factor
+
+    chance *= isolation/10
+
+    if infected:
+        # Less chance to up the infection is we are already infected
+        chance -= rules.already_infected_malus
+        chance /= 2
+
+    chance /= rules.divisor
+
+    if cured:
+        chance /= rules.cured_divisor
+
+    return max(round(chance), 1)
+
+
+class InfectionTable:
+    """
+    Every infection chance, precomputed for all the players states and neighbours counts. A roll is then an index in
+    the table and a comparison with a uniform variate, with the same odds as rng.randint(0, 100) <= chance.
+    """
+    MAX_NEIGHBOURS = 10
+    ISOLATIONS = sorted({isolation.value for isolation in models.Isolation})
+
+    def __init__(self, rules: InfectionRules = DEFAULT_INFECTION_RULES):
+        self.rules = rules
+        self.isolation_index = {isolation: i for i, isolation in enumerate(self.ISOLATIONS)}
+        self.chances = array.array('B')
+        self.thresholds = array.array('d')
+        for immunodeficient, isolation, infected, cured, neighbours in itertools.product(
+                (False, True), self.ISOLATIONS, (False, True), (False, True), range(self.MAX_NEIGHBOURS + 1)):
+            chance = min(chance_for(rules, immunodeficient, isolation, infected, cured, neighbours), 255)
+            self.chances.append(chance)
+            self.thresholds.append((min(chance, 100) + 1) / 101)
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'InfectionTable':
+        return cls(DEFAULT_INFECTION_RULES._replace(**config))
+
+    def index(self, immunodeficient: bool, isolation: int, infected: bool, cured: bool, infected_neighbours: int) -> int:
+        row = ((immunodeficient * len(self.ISOLATIONS) + self.isolation_index[isolation]) * 2 + infected) * 2 + cured
+        return row * (self.MAX_NEIGHBOURS + 1) + min(infected_neighbours, self.MAX_NEIGHBOURS)
+
+    def pressure_index(self, player: models.Player, pressure: float) -> int:
+        """Index for an infection pressure from the contact graph, a decayed count of infected contacts."""
+        return self.index(player.immunodeficient, player.isolation, player.is_infected(), player.cured, round(pressure))
+
+    def render(self) -> str:
+        table = TabularData()
+        table.set_columns(["Immunodeficient", "Isolation", "Infected", "Cured"] + [f"{n} inf." for n in range(self.MAX_NEIGHBOURS + 1)])
+        width = self.MAX_NEIGHBOURS + 1
+        for row, (immunodeficient, isolation, infected, cured) in enumerate(itertools.product((False, True), self.ISOLATIONS, (False, True), (False, True))):
+            table.add_row([immunodeficient, models.Isolation(isolation).name, infected, cured] +
+                          [f"{chance}%" for chance in self.chances[row * width:(row + 1) * width]])
+        return table.render()
+
+
+DEFAULT_INFECTION_TABLE = InfectionTable()
+
+
+def roll_exposure(player: models.Player, pressure: float, rng: GameRNG, table: InfectionTable = DEFAULT_INFECTION_TABLE,
+                  weight: float = 1) -> typing.Tuple[int, bool]:
+    """
+    Maybe infect a living, not vaccinated, player, given their infection pressure in the contact graph. Returns the
+    infection chance and whether the player was infected.
+    """
+    return _roll_index(player, table.pressure_index(player, pressure), rng, table, weight)
+
+
+def weighted(probability: float, weight: float) -> float:
+    """
+    Probability that at least one of weight independent rolls succeeds. Used when a message stands for several ones,
+    because the others were skipped by the load shedding.
+    """
+    if weight == 1:
+        return probability
+    return 1 - (1 - min(probability, 1.0)) ** weight
+
+
+def successes(probability: float, weight: float, rng: GameRNG) -> int:
+    """
+    How many of weight independent rolls succeeded, knowing at least one did. On average, that's weight * probability
+    over all the weighted rolls, like the rolls of every message would.
+    """
+    if weight == 1:
+        return 1
+    expected = weight * min(probability, 1.0) / weighted(probability, weight)
+    whole = int(expected)
+    return whole + (rng.random() < expected - whole)
+
+
+def _roll_index(player: models.Player, index: int, rng: GameRNG, table: InfectionTable, weight: float = 1) -> typing.Tuple[int, bool]:
+    threshold = table.thresholds[index]
+    infect = rng.random() < weighted(threshold, weight)
+    if infect:
+        # The infection gets worse once per message the roll stands for, to progress at the same pace under load.
+        for _ in range(successes(threshold, weight, rng)):
+            player.infect(rng=rng)
+    return table.chances[index], infect
+
+
+def roll_test(player: models.Player, rng: GameRNG, weight: float = 1) -> typing.Optional[str]:
+    """
+    Returns "died" the first time a dead player talks, and the symptoms achievement, or "tested_positive" without
+    symptoms, the first time an infected player tests positive.
+    """
+    if player.is_dead():
+        if not player.achievements.died:
+            player.achievements.died = True
+            return "died"
+        return None
+
+    if player.achievements.tested_positive:
+        return None
+
+    if not player.is_infected() or player.percent_infected <= 15:
+        return None
+
+    # rng.randint(0, 100) <= n has a (n + 1) / 101 chance.
+    if rng.random() < weighted((int(player.percent_infected / 10) + 1) / 101, weight):
+        player.achievements.tested_positive = True
+        for maximum, achievement in SYMPTOMS:
+            if player.percent_infected <= maximum:
+                setattr(player.achievements, achievement, True)
+                return achievement
+        return "tested_positive"
+
+    return None
+
+
+def roll_find(player: models.Player, rng: GameRNG, weight: float = 1) -> typing.Optional[models.ItemsEmojis]:
+    """
+    Maybe give an item to a living player, and return it.
+    """
+    if player.is_dead():
+        return None
+
+    find_chance = int(player.isolation/2)
+    if rng.random() < weighted((find_chance + 1) / 1001, weight):
+        choice = rng.choice(FOUND_ITEMS)
+        setattr(player.inventory, choice.name, getattr(player.inventory, choice.name) + 1)
+        return choice
+
+    return None
+
+
+def hug_contagion(player: models.Player, target_player: models.Player, rng: GameRNG) -> bool:
+    """
+    A hug infects both players when one of them is infected. Returns whether it did.
+    """
+    if player.is_infected() or target_player.is_infected():
+        player.infect(rng=rng)
+        player.infect(rng=rng)
+        target_player.infect(rng=rng)
+        return True
+    return False
+
+
+def vaccine_effect(player: models.Player, value: int, rng: GameRNG) -> typing.Optional[str]:
+    """
+    A vaccine kicks in, some time after the injection.
+    """
+    if player.is_dead():
+        return None
+    player.infect(-100)
+    player.achievements.vaccined = True
+    player.cured = True
+    return "cured"
+
+
+def quarantine_end_effect(player: models.Player, value: int, rng: GameRNG) -> typing.Optional[str]:
+    """
+    Players locked in their bunker get out, back to the isolation they had before, given as value.
+    """
+    if player.isolation != models.Isolation.lives_in_bunker:
+        return None
+    player.isolation = models.Isolation(value)
+    return "released"
+
+
+# Effects that can be scheduled for later, see utils.scheduler.
+EFFECTS = {
+    "vaccine": vaccine_effect,
+    "quarantine_end": quarantine_end_effect,
+}
+
+
+def find_item(what: str) -> typing.Optional[str]:
+    """
+    The first item emoji found in what the player typed.
+    """
+    return next((item for item in ITEMS_EMOJIS if item in what), None)
@@ -30,4 +30,18 @@ async def purge_channel_messages(channel: discord.TextChannel, check=None, **kwa
     else:
         check = lambda m: check(m) and check_pinned(m)
 
-    return await channel.purge(check=check, **kwargs)
\ No newline at end of file
+    return await channel.purge(check=check, **kwargs)
+
+
+async def get_member(guild: discord.Guild, user_id: int) -> typing.Optional[discord.Member]:
+    """
+    Get a member from the cache, or fetch it from the API when the member cache is disabled.
+    """
+    member = guild.get_member(user_id)
+    if member is not None:
+        return member
+
+    try:
+        return await guild.fetch_member(user_id)
+    except discord.NotFound:
+        return None
@@ -0,0 +1,156 @@
+"""
+Periodic jobs, declared on cogs with the @job decorator.
+
+    @job(minutes=15, jitter=30)
+    async def refresh_counters(self):
+        ...
+
+The jobs of a cog are registered when it's added to the bot, and cancelled when it's removed. Every job has its own
+task, so a run never overlaps the previous one: a run that takes longer than the interval skips the runs it missed.
+Runs are cancelled after max_runtime seconds. Jobs with executor=True are plain functions, run in the default thread
+pool so that CPU-heavy work doesn't block the event loop. Since a thread can't be cancelled, their next run waits for
+the previous one to really finish. Jobs with leader_only=True, that must only run once for the whole bot, only run in
+the leader cluster when the shards are split between processes (see launcher.py).
+"""
+import asyncio
+import datetime
+import random
+import time
+import typing
+
+
+def job(*, seconds: float = 0, minutes: float = 0, hours: float = 0, jitter: float = 0, max_runtime: float = None,
+        executor: bool = False, wait_until_ready: bool = True, leader_only: bool = False):
+    """
+    Run the decorated cog method every interval, plus or minus jitter seconds.
+    """
+    def decorator(function):
+        function.__job_options__ = {
+            "interval": seconds + minutes * 60 + hours * 3600,
+            "jitter": jitter,
+            "max_runtime": max_runtime,
+            "executor": executor,
+            "wait_until_ready": wait_until_ready,
+            "leader_only": leader_only,
+        }
+        return function
+    return decorator
+
+
+class Job:
+    def __init__(self, name: str, function: typing.Callable, owner=None, *, interval: float, jitter: float = 0,
+                 max_runtime: float = None, executor: bool = False, wait_until_ready: bool = True, leader_only: bool = False):
+        self.name = name
+        self.function = function
+        self.owner = owner
+        self.interval = interval
+        self.jitter = jitter
+        self.max_runtime = max_runtime
+        self.executor = executor
+        self.wait_until_ready = wait_until_ready
+        self.leader_only = leader_only
+
+        self.task: typing.Optional[asyncio.Task] = None
+        self.thread_future: typing.Optional[asyncio.Future] = None
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.last_error: typing.Optional[str] = None
+        self.next_run: typing.Optional[float] = None  # time.time()
+
+    def next_delay(self) -> float:
+        return max(0.0, self.interval + random.uniform(-self.jitter, self.jitter))
+
+    def next_run_at(self) -> typing.Optional[datetime.datetime]:
+        return datetime.datetime.utcfromtimestamp(self.next_run) if self.next_run is not None else None
+
+
+class JobRegistry:
+    def __init__(self, bot):
+        self.bot = bot
+        self.jobs: typing.Dict[str, Job] = {}
+
+    def add(self, name: str, function: typing.Callable, owner=None, **options) -> Job:
+        if name in self.jobs:
+            raise ValueError(f"A job named {name} is already registered")
+
+        job = self.jobs[name] = Job(name, function, owner, **options)
+        if job.leader_only and not self.bot.cluster.is_leader:
+            # Another cluster runs it.
+            return job
+        job.task = asyncio.ensure_future(self.run_forever(job))
+        return job
+
+    def remove(self, name: str):
+        job = self.jobs.pop(name, None)
+        if job is not None and job.task is not None:
+            job.task.cancel()
+
+    def add_cog(self, cog):
+        for name in dir(type(cog)):
+            function = getattr(type(cog), name, None)
+            options = getattr(function, "__job_options__", None)
+            if options is not None:
+                self.add(f"{cog.qualified_name}.{name}", getattr(cog, name), cog, **options)
+
+    def remove_cog(self, cog):
+        for name in [name for name, job in self.jobs.items() if job.owner is cog]:
+            self.remove(name)
+
+    def stop(self):
+        for name in list(self.jobs):
+            self.remove(name)
+
+    async def run_forever(self, job: Job):
+        if job.wait_until_ready:
+            await self.bot.wait_until_ready()
+
+        loop = asyncio.get_event_loop()
+        job.next_run = time.time()
+        while True:
+            delay = job.next_run - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if job.thread_future is not None and not job.thread_future.done():
+                # The previous run timed out, but its thread is still going.
+                job.skipped += 1
+            else:
+                await self.run_once(job, loop)
+
+            job.next_run += job.next_delay()
+            now = time.time()
+            if job.next_run < now:
+                # The run took longer than the interval, don't try to catch up.
+                job.skipped += 1
+                job.next_run = now + job.next_delay()
+
+    async def run_once(self, job: Job, loop: asyncio.AbstractEventLoop):
+        job.running = True
+        started = time.perf_counter()
+        try:
+            if job.executor:
+                job.thread_future = loop.run_in_executor(None, job.function)
+                # Shielded, the thread can't be cancelled anyway.
+                await asyncio.wait_for(asyncio.shield(job.thread_future), timeout=job.max_runtime)
+            else:
+                await asyncio.wait_for(job.function(), timeout=job.max_runtime)
+        except asyncio.TimeoutError:
+            job.timeouts += 1
+            job.failures += 1
+            job.last_error = f"Timed out after {job.max_runtime}s"
+            self.bot.logger.warning(f"Job {job.name} timed out after {job.max_runtime}s")
+        except Exception as e:
+            job.failures += 1
+            job.last_error = f"{type(e).__name__}: {e}"
+            self.bot.logger.exception(f"Job {job.name} failed")
+        finally:
+            job.running = False
+            job.runs += 1
+            job.last_duration = time.perf_counter() - started
+            job.max_duration = max(job.max_duration, job.last_duration)
+            self.bot.metrics.observe("job", job.name, job.last_duration)
@@ -0,0 +1,166 @@
+"""
+Load shedding: when the bot is overloaded, do less flavor work, so that the commands stay responsive.
+
+Every second, the controller looks at the event loop lag, the mean database latency and the number of REST rate limits
+(429) hit during the last minute. While one of them is over its limit, it escalates one stage every `escalate_after`
+evaluations, and steps down one stage after `recover_after` calm evaluations. Stages add up:
+
+    1. sampling: only `sample_rate` of the messages go through the game. The rolls of the sampled messages are
+       re-weighted, as if they were rolled once for each message they stand for, so the game odds don't change. An
+       infection also progresses once per message it stands for. Tests and finds happen at most once per sampled
+       message: their odds are kept, but two finds the skipped messages would have made count as one.
+    2. no finds: items are not found anymore, which saves their database writes and messages.
+    3. deferred logs: the log channel posts are queued, and sent once the bot is back under stage 3.
+    4. rejecting: the non-essential commands are refused.
+"""
+import collections
+import logging
+import time
+import typing
+
+import discord
+
+from utils import checks
+
+NORMAL, SAMPLING, NO_FINDS, DEFERRED_LOGS, REJECTING = range(5)
+STAGE_NAMES = ["normal", "sampling", "no finds", "deferred logs", "rejecting commands"]
+
+
+class RateLimitCounter(logging.Handler):
+    """Count the 429 warnings of discord.py, with their time."""
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.times: typing.Deque[float] = collections.deque(maxlen=10000)
+
+    def emit(self, record: logging.LogRecord):
+        if "rate limit" in str(record.msg):
+            self.times.append(time.monotonic())
+
+    def in_last(self, seconds: float) -> int:
+        since = time.monotonic() - seconds
+        while self.times and self.times[0] < since:
+            self.times.popleft()
+        return len(self.times)
+
+
+class LoadShedder:
+    def __init__(self, bot, config: dict):
+        self.bot = bot
+        self.enabled = config.get("enabled", True)
+        self.max_loop_lag = config.get("max_loop_lag", 0.25)
+        self.max_db_latency = config.get("max_db_latency", 0.2)
+        self.max_rate_limits = config.get("max_rate_limits", 10)
+        self.escalate_after = config.get("escalate_after", 3)
+        self.recover_after = config.get("recover_after", 30)
+        self.sample_rate = config.get("sample_rate", 0.5)
+        self.non_essential_commands = frozenset(config.get("non_essential_commands", ()))
+        self.max_deferred_logs = config.get("max_deferred_logs", 1000)
+
+        self.stage = NORMAL
+        self.pressured_evaluations = 0
+        self.calm_evaluations = 0
+        self.reasons: typing.List[str] = []
+        self.db_sample = (0, 0.0)
+        self.db_latency = 0.0
+        self.sampled_out = 0
+        self.rejected = 0
+        # (send, channel, content) of the log posts waiting for the load to go down.
+        self.deferred_logs: typing.Deque[tuple] = collections.deque(maxlen=self.max_deferred_logs)
+
+        self.rate_limits = RateLimitCounter()
+        logging.getLogger("discord.http").addHandler(self.rate_limits)
+
+    def close(self):
+        logging.getLogger("discord.http").removeHandler(self.rate_limits)
+
+    def measure_db_latency(self) -> float:
+        """Mean latency of the database calls since the previous evaluation."""
+        count, total = 0, 0.0
+        for (kind, _), histogram in self.bot.metrics.histograms.items():
+            if kind == "db":
+                count += histogram.count
+                total += histogram.total
+
+        previous_count, previous_total = self.db_sample
+        self.db_sample = (count, total)
+        if count > previous_count:
+            self.db_latency = (total - previous_total) / (count - previous_count)
+        return self.db_latency
+
+    def pressure_reasons(self) -> typing.List[str]:
+        reasons = []
+        loop_lag = self.bot.metrics.loop_lag
+        if loop_lag > self.max_loop_lag:
+            reasons.append(f"loop lag {loop_lag * 1000:.0f}ms")
+        db_latency = self.measure_db_latency()
+        if db_latency > self.max_db_latency:
+            reasons.append(f"database latency {db_latency * 1000:.0f}ms")
+        rate_limits = self.rate_limits.in_last(60)
+        if rate_limits > self.max_rate_limits:
+            reasons.append(f"{rate_limits} rate limits in the last minute")
+        return reasons
+
+    async def evaluate(self):
+        if not self.enabled:
+            return
+
+        self.reasons = self.pressure_reasons()
+        if self.reasons:
+            self.calm_evaluations = 0
+            self.pressured_evaluations += 1
+            if self.pressured_evaluations >= self.escalate_after and self.stage < REJECTING:
+                self.pressured_evaluations = 0
+                self.set_stage(self.stage + 1)
+        else:
+            self.pressured_evaluations = 0
+            self.calm_evaluations += 1
+            if self.calm_evaluations >= self.recover_after and self.stage > NORMAL:
+                self.calm_evaluations = 0
+                self.set_stage(self.stage - 1)
+
+        if self.stage < DEFERRED_LOGS and self.deferred_logs:
+            await self.flush_logs()
+
+    def set_stage(self, stage: int):
+        level = logging.WARNING if stage > self.stage else logging.INFO
+        self.bot.logger.log(level, f"Load shedding: {STAGE_NAMES[self.stage]} -> {STAGE_NAMES[stage]} ({', '.join(self.reasons) or 'recovered'})")
+        self.stage = stage
+
+    def message_weight(self, guild: typing.Optional[discord.Guild]) -> typing.Optional[float]:
+        """
+        None when the message should be skipped, else how many messages its rolls stand for. The sampling draws from
+        the game RNG of the guild, so a seeded run samples the same messages.
+        """
+        if self.stage < SAMPLING:
+            return 1
+        if self.bot.rng.for_guild(guild).random() < self.sample_rate:
+            return 1 / self.sample_rate
+        self.sampled_out += 1
+        return None
+
+    @property
+    def finds_allowed(self) -> bool:
+        return self.stage < NO_FINDS
+
+    def defer_log(self, send, channel: discord.TextChannel, content: str) -> bool:
+        """
+        Queue the log post when logs are deferred, returns whether it was. It's sent later with send(channel, content).
+        """
+        if self.stage < DEFERRED_LOGS:
+            return False
+        self.deferred_logs.append((send, channel, content))
+        return True
+
+    async def flush_logs(self, limit: int = 5):
+        """Send some of the deferred log posts, a few every evaluation to avoid a burst."""
+        for _ in range(min(limit, len(self.deferred_logs))):
+            send, channel, content = self.deferred_logs.popleft()
+            if channel is not None:
+                await send(channel, content)
+
+    def check(self, ctx) -> bool:
+        """Global command check, refusing the non-essential commands at the last stage."""
+        if self.stage >= REJECTING and ctx.command.qualified_name in self.non_essential_commands:
+            self.rejected += 1
+            raise checks.Overloaded()
+        return True
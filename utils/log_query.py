@@ -0,0 +1,102 @@
+"""
+Filter and aggregate JSON logs (see the `format` option in the [logging] config section).
+
+Files are read line by line, and can be gzipped segments, so this works on logs of any size.
+
+    python -m utils.log_query all.log --where guild_id=336642139381301249 --level WARNING
+    python -m utils.log_query all.log.*.gz all.log --contains "Infection chance" --count-by user_id --top 10
+"""
+import argparse
+import collections
+import gzip
+import logging
+import sys
+import typing
+
+import rapidjson
+
+
+def open_log(path: str) -> typing.TextIO:
+    if path == "-":
+        return sys.stdin
+    elif path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    else:
+        return open(path, "r", encoding="utf-8", errors="replace")
+
+
+def read_records(paths: typing.Iterable[str]) -> typing.Iterator[dict]:
+    for path in paths:
+        with open_log(path) as f:
+            for line in f:
+                try:
+                    yield rapidjson.loads(line)
+                except ValueError:
+                    # Text logs, or a line being written.
+                    continue
+
+
+def parse_conditions(conditions: typing.List[str]) -> typing.Dict[str, str]:
+    parsed = {}
+    for condition in conditions:
+        field, sep, value = condition.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"Conditions must look like field=value, not {condition}")
+        parsed[field] = value
+    return parsed
+
+
+def parse_level(level: str) -> int:
+    number = logging.getLevelName(level.upper())
+    if not isinstance(number, int):
+        raise argparse.ArgumentTypeError(f"Unknown level {level}, use DEBUG, INFO, WARNING, ERROR or CRITICAL")
+    return number
+
+
+def record_level(record: dict) -> typing.Optional[int]:
+    level = record.get("level")
+    number = logging.getLevelName(level) if isinstance(level, str) else None
+    return number if isinstance(number, int) else None
+
+
+def filter_records(records: typing.Iterable[dict], where: typing.Dict[str, str], min_level: int = 0, contains: str = None) -> typing.Iterator[dict]:
+    for record in records:
+        if min_level:
+            # Records without a known level can't be compared, they are not kept.
+            level = record_level(record)
+            if level is None or level < min_level:
+                continue
+        if contains and contains not in record.get("message", ""):
+            continue
+        if any(str(record.get(field)) != value for field, value in where.items()):
+            continue
+        yield record
+
+
+def main(argv: typing.List[str] = None):
+    parser = argparse.ArgumentParser(description="Filter and aggregate the bot JSON logs.")
+    parser.add_argument("files", nargs="+", help="Log files to read, in order. Use - for stdin.")
+    parser.add_argument("--where", action="append", default=[], metavar="FIELD=VALUE", help="Only keep records where FIELD is VALUE. Can be repeated.")
+    parser.add_argument("--level", type=parse_level, default=0, help="Only keep records at this level or above.")
+    parser.add_argument("--contains", default=None, help="Only keep records whose message contains this text.")
+    parser.add_argument("--count-by", default=None, metavar="FIELD", help="Count the records by FIELD instead of printing them.")
+    parser.add_argument("--top", type=int, default=None, help="With --count-by, only print the N most common values.")
+    args = parser.parse_args(argv)
+
+    records = filter_records(read_records(args.files), parse_conditions(args.where), args.level, args.contains)
+
+    try:
+        if args.count_by:
+            counts = collections.Counter(str(record.get(args.count_by)) for record in records)
+            for value, count in counts.most_common(args.top):
+                print(f"{count}\t{value}")
+        else:
+            for record in records:
+                print(rapidjson.dumps(record, ensure_ascii=False))
+    except BrokenPipeError:
+        # Piped into head or similar.
+        pass
+
+
+if __name__ == '__main__':
+    main()
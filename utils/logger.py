@@ -1,29 +1,136 @@
+import atexit
+import collections
+import concurrent.futures
+import datetime
+import glob
+import gzip
 import logging
+import logging.handlers
+import os
+import queue
+import shutil
 import typing
 
 import discord
+import rapidjson
+
+
+class PrefixFormatter(logging.Formatter):
+    """
+    Text formatter, that writes the guild/channel/member prefix built by FakeLogger in front of the message.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        if not hasattr(record, "prefix"):
+            record.prefix = ""
+        return super().format(record)
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Structured formatter, writing one JSON object per line, with the discord IDs as separate fields.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.datetime.utcfromtimestamp(record.created).isoformat() + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "guild_id": getattr(record, "guild_id", None),
+            "channel_id": getattr(record, "channel_id", None),
+            "user_id": getattr(record, "user_id", None),
+        }
+
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+
+        return rapidjson.dumps(data, ensure_ascii=False)
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Size-bounded log file. Full segments are renamed with a timestamp, then gzipped in a background thread, and only
+    the `backupCount` most recent compressed segments are kept.
+    """
+    compressor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-compressor")
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        if os.path.exists(self.baseFilename):
+            segment_name = f"{self.baseFilename}.{datetime.datetime.utcnow():%Y%m%d-%H%M%S-%f}"
+            os.rename(self.baseFilename, segment_name)
+            self.compressor.submit(self.compress_segment, segment_name)
+
+        if not self.delay:
+            self.stream = self._open()
+
+    def compress_segment(self, segment_name: str):
+        with open(segment_name, 'rb') as source, gzip.open(segment_name + ".gz", 'wb') as destination:
+            shutil.copyfileobj(source, destination)
+        os.remove(segment_name)
+
+        # The timestamp in the names sorts the segments from the oldest to the newest.
+        segments = sorted(glob.glob(glob.escape(self.baseFilename) + ".*.gz"))
+        for old_segment in segments[:-self.backupCount or None]:
+            os.remove(old_segment)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records in a queue for a writer thread, without ever blocking the caller.
+    When the queue is full, records below WARNING are dropped and counted.
+    """
+    def __init__(self, records_queue: queue.SimpleQueue, max_size: int):
+        super().__init__(records_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting is left to the writer thread.
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if record.levelno < logging.WARNING and self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+        else:
+            self.queue.put_nowait(record)
 
 
-def init_logger() -> logging.Logger:
+def init_logger(config: dict = None, file_prefix: str = "") -> typing.Tuple[logging.Logger, typing.Optional[logging.handlers.QueueListener]]:
     # Create the logger
+    if config is None:
+        config = {}
 
     base_logger = logging.getLogger("matchmaking")
-    base_logger.setLevel(logging.DEBUG)
+    base_logger.setLevel(config.get("level", "DEBUG"))
+    handlers = []
 
-    formatter = logging.Formatter('%(asctime)s :: %(levelname)s :: %(message)s')
+    formatter = PrefixFormatter('%(asctime)s :: %(levelname)s :: %(prefix)s%(message)s')
 
     # Logging to a file
     from logging.handlers import RotatingFileHandler
 
-    file_handler = RotatingFileHandler('all.log', 'a', 10000000, 1)
-    file_handler.setFormatter(formatter)
+    if config.get("format", "text") == "json":
+        file_formatter = JSONFormatter()
+        file_handler_class = CompressingRotatingFileHandler
+    else:
+        file_formatter = formatter
+        file_handler_class = RotatingFileHandler
+
+    max_bytes = config.get("max_bytes", 10000000)
+    backup_count = config.get("backup_count", 1)
+
+    file_handler = file_handler_class(f'{file_prefix}all.log', 'a', max_bytes, backup_count)
+    file_handler.setFormatter(file_formatter)
     file_handler.setLevel(logging.DEBUG)
-    base_logger.addHandler(file_handler)
+    handlers.append(file_handler)
 
-    file_handler = RotatingFileHandler('errors.log', 'a', 10000000, 1)
-    file_handler.setFormatter(formatter)
+    file_handler = file_handler_class(f'{file_prefix}errors.log', 'a', max_bytes, backup_count)
+    file_handler.setFormatter(file_formatter)
     file_handler.setLevel(logging.WARNING)
-    base_logger.addHandler(file_handler)
+    handlers.append(file_handler)
 
     # And to console
 
@@ -144,7 +251,18 @@ def init_logger() -> logging.Logger:
     steam_handler.setLevel(logging.DEBUG)
 
     steam_handler.setFormatter(formatter)
-    base_logger.addHandler(steam_handler)
+    handlers.append(steam_handler)
+
+    listener = None
+    if config.get("queued", False):
+        # Formatting and writing happen in a dedicated thread, the event loop only pays for a queue insertion.
+        records_queue = queue.SimpleQueue()
+        base_logger.addHandler(DroppingQueueHandler(records_queue, config.get("queue_size", 10000)))
+        listener = logging.handlers.QueueListener(records_queue, *handlers, respect_handler_level=True)
+        listener.start()
+    else:
+        for handler in handlers:
+            base_logger.addHandler(handler)
 
     discord_logger = logging.getLogger('discord')
     discord_logger.setLevel(logging.WARNING)
@@ -156,15 +274,37 @@ def init_logger() -> logging.Logger:
     discord_steam_handler.setFormatter(discord_formatter)
     discord_logger.addHandler(discord_steam_handler)
 
-    return base_logger
+    return base_logger, listener
 
 
 class FakeLogger:
-    def __init__(self, logger: logging.Logger = None):
+    def __init__(self, logger: logging.Logger = None, config: dict = None, file_prefix: str = ""):
+        if config is None:
+            config = {}
+
+        self.listener = None
         if not logger:
-            logger = init_logger()
+            logger, self.listener = init_logger(config, file_prefix)
+            atexit.register(self.shutdown)
         self.logger = logger
 
+        self.sampling: typing.Dict[str, int] = config.get("sampling", {})
+        self.sampling_counters: typing.Dict[str, int] = collections.defaultdict(int)
+
+    @property
+    def dropped(self) -> int:
+        return sum(getattr(handler, "dropped", 0) for handler in self.logger.handlers)
+
+    def shutdown(self):
+        """
+        Write every queued record, and stop the writer thread.
+        """
+        if self.listener is not None:
+            listener, self.listener = self.listener, None
+            if self.dropped:
+                self.logger.warning(f"{self.dropped} log records were dropped because the logging queue was full.")
+            listener.stop()
+
     def make_message_prefix(self, guild: typing.Optional[discord.Guild] = None, channel: typing.Optional[discord.ChannelType] = None, member: typing.Optional[discord.Member] = None):
         if guild and channel and member:
             return f"{guild.id} - #{channel.name[:15]} :: <{member.name}#{member.discriminator}> "
@@ -181,23 +321,61 @@ class FakeLogger:
         else:
             return f""
 
-    def debug(self, message: str, guild: typing.Optional[discord.Guild] = None, channel: typing.Optional[discord.ChannelType] = None, member: typing.Optional[discord.Member] = None):
-        return self.logger.debug(self.make_message_prefix(guild, channel, member) + str(message))
+    def is_sampled(self, event: str) -> bool:
+        """
+        For high frequency log lines, only keep one record every `every` of them, as configured in [logging.sampling].
+        """
+        every = self.sampling.get(event, 1)
+        if every <= 1:
+            return True
+
+        count = self.sampling_counters[event]
+        self.sampling_counters[event] = count + 1
+        return count % every == 0
+
+    def log(self, level: int, message: str, *args, guild: typing.Optional[discord.Guild] = None, channel: typing.Optional[discord.ChannelType] = None,
+            member: typing.Optional[discord.Member] = None, sample: str = None, exc_info: bool = False):
+        """
+        Log a message, %-formatted with args only if the record is emitted.
+        Nothing (not even the guild/channel/member prefix) is computed when the level is disabled.
+        """
+        if not self.logger.isEnabledFor(level):
+            return
+
+        if sample is not None and not self.is_sampled(sample):
+            return
+
+        extra = {
+            "prefix": self.make_message_prefix(guild, channel, member),
+            "guild_id": guild.id if guild else None,
+            "channel_id": channel.id if channel else None,
+            "user_id": member.id if member else None,
+        }
+
+        return self.logger.log(level, message, *args, exc_info=exc_info, extra=extra)
+
+    def debug(self, message: str, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            return self.log(logging.DEBUG, message, *args, **kwargs)
 
-    def info(self, message: str, guild: typing.Optional[discord.Guild] = None, channel: typing.Optional[discord.ChannelType] = None, member: typing.Optional[discord.Member] = None):
-        return self.logger.info(self.make_message_prefix(guild, channel, member) + str(message))
+    def info(self, message: str, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.INFO):
+            return self.log(logging.INFO, message, *args, **kwargs)
 
-    def warn(self, message: str, guild: typing.Optional[discord.Guild] = None, channel: typing.Optional[discord.ChannelType] = None, member: typing.Optional[discord.Member] = None):
-        return self.logger.warn(self.make_message_prefix(guild, channel, member) + str(message))
+    def warn(self, message: str, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.WARNING):
+            return self.log(logging.WARNING, message, *args, **kwargs)
 
-    def warning(self, message: str, guild: typing.Optional[discord.Guild] = None, channel: typing.Optional[discord.ChannelType] = None, member: typing.Optional[discord.Member] = None):
-        return self.logger.warning(self.make_message_prefix(guild, channel, member) + str(message))
+    def warning(self, message: str, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.WARNING):
+            return self.log(logging.WARNING, message, *args, **kwargs)
 
-    def error(self, message: str, guild: typing.Optional[discord.Guild] = None, channel: typing.Optional[discord.ChannelType] = None, member: typing.Optional[discord.Member] = None):
-        return self.logger.error(self.make_message_prefix(guild, channel, member) + str(message))
+    def error(self, message: str, *args, **kwargs):
+        if self.logger.isEnabledFor(logging.ERROR):
+            return self.log(logging.ERROR, message, *args, **kwargs)
 
-    def exception(self, message: str, guild: typing.Optional[discord.Guild] = None, channel: typing.Optional[discord.ChannelType] = None, member: typing.Optional[discord.Member] = None):
-        return self.logger.exception(self.make_message_prefix(guild, channel, member) + str(message))
+    def exception(self, message: str, *args, **kwargs):
+        return self.log(logging.ERROR, message, *args, exc_info=True, **kwargs)
 
 
 class LoggerConstant:
@@ -207,21 +385,28 @@ class LoggerConstant:
         self.channel = channel
         self.member = member
 
-    def debug(self, message: str):
-        return self.logger.debug(message, self.guild, self.channel, self.member)
+    def log(self, level: int, message: str, *args, **kwargs):
+        return self.logger.log(level, message, *args, guild=self.guild, channel=self.channel, member=self.member, **kwargs)
 
-    def info(self, message: str):
-        return self.logger.info(message, self.guild, self.channel, self.member)
+    def debug(self, message: str, *args, **kwargs):
+        if self.logger.logger.isEnabledFor(logging.DEBUG):
+            return self.log(logging.DEBUG, message, *args, **kwargs)
 
-    def warn(self, message: str):
-        return self.logger.warn(message, self.guild, self.channel, self.member)
+    def info(self, message: str, *args, **kwargs):
+        if self.logger.logger.isEnabledFor(logging.INFO):
+            return self.log(logging.INFO, message, *args, **kwargs)
 
-    def warning(self, message: str):
-        return self.logger.warning(message, self.guild, self.channel, self.member)
+    def warn(self, message: str, *args, **kwargs):
+        if self.logger.logger.isEnabledFor(logging.WARNING):
+            return self.log(logging.WARNING, message, *args, **kwargs)
 
-    def error(self, message: str):
-        return self.logger.error(message, self.guild, self.channel, self.member)
+    def warning(self, message: str, *args, **kwargs):
+        if self.logger.logger.isEnabledFor(logging.WARNING):
+            return self.log(logging.WARNING, message, *args, **kwargs)
 
-    def exception(self, message: str):
-        return self.logger.exception(message, self.guild, self.channel, self.member)
+    def error(self, message: str, *args, **kwargs):
+        if self.logger.logger.isEnabledFor(logging.ERROR):
+            return self.log(logging.ERROR, message, *args, **kwargs)
 
+    def exception(self, message: str, *args, **kwargs):
+        return self.log(logging.ERROR, message, *args, exc_info=True, **kwargs)
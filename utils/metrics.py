@@ -0,0 +1,94 @@
+"""
+Latency instrumentation.
+
+Every timed operation (commands, message pipeline stages, database and REST calls) goes into a LogHistogram, keyed by
+a kind and a name. Histograms use fixed, logarithmic buckets, so their memory use doesn't depend on the traffic.
+"""
+import array
+import contextlib
+import math
+import time
+import typing
+
+from utils import tracing
+
+
+class LogHistogram:
+    """
+    Histogram of durations (in seconds), with BUCKETS_PER_OCTAVE buckets every time the value doubles.
+    Percentiles are accurate to about 9% of their value, from 1µs to about 4 minutes.
+    """
+    MIN_VALUE = 1e-6
+    BUCKETS_PER_OCTAVE = 8
+    BUCKETS_COUNT = 8 * 28
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = array.array('Q', [0]) * self.BUCKETS_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @classmethod
+    def bucket_for(cls, value: float) -> int:
+        if value <= cls.MIN_VALUE:
+            return 0
+        return min(int(math.log2(value / cls.MIN_VALUE) * cls.BUCKETS_PER_OCTAVE), cls.BUCKETS_COUNT - 1)
+
+    @classmethod
+    def bucket_upper_bound(cls, bucket: int) -> float:
+        return cls.MIN_VALUE * 2 ** ((bucket + 1) / cls.BUCKETS_PER_OCTAVE)
+
+    def record(self, value: float):
+        self.counts[self.bucket_for(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent: float) -> float:
+        if not self.count:
+            return 0.0
+
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for bucket, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(self.bucket_upper_bound(bucket), self.max)
+
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class Metrics:
+    def __init__(self):
+        # (kind, name) -> histogram. Kinds are command, stage, db, rest, loop, job and lock.
+        self.histograms: typing.Dict[typing.Tuple[str, str], LogHistogram] = {}
+        # How late (in seconds) the event loop woke up the last watchdog beat.
+        self.loop_lag = 0.0
+
+    def histogram(self, kind: str, name: str) -> LogHistogram:
+        key = (kind, name)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LogHistogram()
+        return histogram
+
+    def observe(self, kind: str, name: str, seconds: float):
+        self.histogram(kind, name).record(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, kind: str, name: str):
+        """Time the block, and trace it as a span when the current trace is sampled."""
+        span = tracing.start_span(f"{kind}.{name}")
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(kind, name, time.perf_counter() - start)
+            tracing.finish_span(span)
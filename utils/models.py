@@ -1,10 +1,11 @@
 import datetime
-import random
 
 from tortoise.models import Model
 from tortoise import fields
 from enum import Enum, IntEnum
 
+from utils.rng import GameRNG, game_rng
+
 
 class AlignementLaw(IntEnum):
     lawful = 1
@@ -63,15 +64,16 @@ class Player(Model):
     def is_infected(self) -> bool:
         return self.percent_infected > 0
 
-    def can_be_touched(self) -> bool:
+    def can_be_touched(self, now: datetime.datetime = None) -> bool:
+        now = now or datetime.datetime.utcnow()
         if not self.is_dead():
-            return self.touched_last + datetime.timedelta(hours=3) < datetime.datetime.utcnow()
+            return self.touched_last + datetime.timedelta(hours=3) < now
         else:
-            return self.touched_last + datetime.timedelta(hours=1) < datetime.datetime.utcnow()
+            return self.touched_last + datetime.timedelta(hours=1) < now
 
-    def infect(self, add_infected: int = None) -> None:
+    def infect(self, add_infected: int = None, rng: GameRNG = None) -> None:
         if add_infected is None:
-            add_infected = random.randint(1, 8)
+            add_infected = (rng or game_rng.default).randint(1, 8)
 
         if self.achievements.vaccined:
             add_infected = min(0, add_infected)
@@ -183,3 +185,32 @@ class Statistics(Model):
     heals = fields.BigIntField(default=0)
     been_eaten_times = fields.BigIntField(default=0)
     eaten_brains = fields.BigIntField(default=0)
+
+
+class ScheduledEffect(Model):
+    """
+    Something that will happen to a player later, see utils.scheduler.
+    """
+    id = fields.BigIntField(pk=True)
+    player: fields.ForeignKeyRelation[Player] = fields.ForeignKeyField(
+        "models.Player", on_delete=fields.CASCADE, related_name="scheduled_effects"
+    )
+    effect = fields.CharField(max_length=50)
+    value = fields.IntField(default=0)
+    due_at = fields.DatetimeField(index=True)
+    # Indexed for the polls of the leader cluster.
+    created_at = fields.DatetimeField(auto_now_add=True, index=True)
+
+
+class CooldownBucket(Model):
+    """
+    Token bucket of a shared command cooldown, see utils.cooldowns.
+    """
+    bucket = fields.CharField(max_length=200, pk=True)
+    rate = fields.IntField()
+    per = fields.FloatField()
+    tokens = fields.FloatField()
+    allowed = fields.BooleanField(default=True)
+    updated_at = fields.FloatField()  # time.time()
+    # When the bucket is full again, and can be forgotten.
+    expires_at = fields.FloatField(index=True)
@@ -0,0 +1,125 @@
+"""
+Minimal HTTP listener serving the bot metrics in the Prometheus text exposition format.
+
+It runs on the bot event loop, and every scrape only reads counters that are already maintained in memory, so it can
+be scraped every few seconds.
+"""
+import asyncio
+import math
+import typing
+
+from tortoise import Tortoise
+
+from utils.metrics import LogHistogram
+
+if typing.TYPE_CHECKING:
+    from utils.bot_class import MyBot
+
+# Upper bounds (in seconds) of the exported histogram buckets, roughly.
+EXPORTED_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# For every exported bucket, number of LogHistogram buckets it adds up. The exported bounds are moved to the closest
+# LogHistogram bucket edge (1ms is 1.024ms), so that their counts are exact.
+BUCKETS_CUTOFFS = [round(math.log2(bound / LogHistogram.MIN_VALUE) * LogHistogram.BUCKETS_PER_OCTAVE) for bound in EXPORTED_BUCKETS]
+EXPORTED_BOUNDS = [LogHistogram.bucket_upper_bound(cutoff - 1) for cutoff in BUCKETS_CUTOFFS]
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class MetricsServer:
+    def __init__(self, bot: 'MyBot'):
+        self.bot = bot
+        self.server: typing.Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str, port: int):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.bot.logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass  # Headers are not needed.
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found, try /metrics\n"
+
+            writer.write(f"HTTP/1.1 {status}\r\n"
+                         f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def render(self) -> str:
+        bot = self.bot
+        lines = []
+
+        def metric(name: str, metric_type: str, help_text: str, samples: typing.Iterable[typing.Tuple[dict, float]]):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                if labels:
+                    labels_str = ",".join(f'{key}="{escape_label(label)}"' for key, label in labels.items())
+                    lines.append(f"{name}{{{labels_str}}} {value}")
+                else:
+                    lines.append(f"{name} {value}")
+
+        metric("coroned_commands_total", "counter", "Commands invoked, by command.",
+               (({"command": command}, count) for command, count in bot.commands_used.items()))
+
+        lines.append("# HELP coroned_latency_seconds Latency of commands, message pipeline stages, database and REST calls.")
+        lines.append("# TYPE coroned_latency_seconds histogram")
+        for (kind, name), histogram in bot.metrics.histograms.items():
+            labels = f'kind="{escape_label(kind)}",name="{escape_label(name)}"'
+            counts = histogram.counts
+            for bound, cutoff in zip(EXPORTED_BOUNDS, BUCKETS_CUTOFFS):
+                lines.append(f'coroned_latency_seconds_bucket{{{labels},le="{bound}"}} {sum(counts[:cutoff])}')
+            lines.append(f'coroned_latency_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f'coroned_latency_seconds_sum{{{labels}}} {histogram.total}')
+            lines.append(f'coroned_latency_seconds_count{{{labels}}} {histogram.count}')
+
+        metric("coroned_shard_ready", "gauge", "1 if the shard is ready.",
+               (({"shard": shard_id}, int(shard_id in bot.shards_ready)) for shard_id in sorted(bot.shards)))
+        metric("coroned_shard_latency_seconds", "gauge", "Gateway heartbeat latency, by shard.",
+               (({"shard": shard_id}, latency) for shard_id, latency in bot.latencies))
+
+        metric("coroned_event_loop_lag_seconds", "gauge", "How late the event loop woke up the last watchdog beat.",
+               [({}, bot.metrics.loop_lag)])
+        metric("coroned_pending_tasks", "gauge", "Tasks pending on the event loop.",
+               [({}, len(asyncio.all_tasks()))])
+
+        metric("coroned_role_updates_total", "counter", "Role updates, by outcome.",
+               (({"outcome": outcome}, getattr(bot.role_updater, outcome)) for outcome in ("queued", "superseded", "applied", "skipped", "failed")))
+
+        pool = self.get_db_pool()
+        if pool is not None:
+            pool_stats = {"size": pool.get_size(), "max_size": pool.get_max_size()}
+            if hasattr(pool, "get_idle_size"):
+                pool_stats["idle"] = pool.get_idle_size()
+            metric("coroned_db_pool_connections", "gauge", "Database pool connections.",
+                   (({"state": state}, value) for state, value in pool_stats.items()))
+
+        lines.append("")
+        return "\n".join(lines)
+
+    @staticmethod
+    def get_db_pool():
+        try:
+            connection = Tortoise.get_connection("default")
+        except KeyError:
+            return None
+        return getattr(connection, "_pool", None)
@@ -0,0 +1,98 @@
+"""
+Randomness of the game.
+
+Every gameplay roll goes through a GameRNG, so a run can be seeded and replayed. Uniform variates are drawn in blocks
+(with numpy when it's installed), and handed out one by one, which is cheaper than a random.randint call per roll.
+Streams can be split per guild, so that the activity of a guild doesn't change the rolls of another one.
+"""
+import hashlib
+import os
+import random
+import typing
+
+import discord
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class GameRNG:
+    __slots__ = ('generator', 'block_size', 'block', 'index')
+
+    def __init__(self, seed: int, block_size: int = 4096):
+        self.generator = numpy.random.default_rng(seed) if numpy is not None else random.Random(seed)
+        self.block_size = block_size
+        self.block: typing.List[float] = []
+        self.index = 0
+
+    def refill(self):
+        if numpy is not None:
+            self.block = self.generator.random(self.block_size).tolist()
+        else:
+            draw = self.generator.random
+            self.block = [draw() for _ in range(self.block_size)]
+        self.index = 0
+
+    def random(self) -> float:
+        """Uniform float in [0, 1)."""
+        index = self.index
+        if index >= len(self.block):
+            self.refill()
+            index = 0
+        self.index = index + 1
+        return self.block[index]
+
+    def randint(self, a: int, b: int) -> int:
+        """Integer in [a, b], both included, like random.randint."""
+        return a + int(self.random() * (b - a + 1))
+
+    def choice(self, sequence: typing.Sequence):
+        return sequence[int(self.random() * len(sequence))]
+
+
+class GameRNGs:
+    def __init__(self):
+        self.base_seed = 0
+        self.per_guild = False
+        self.block_size = 4096
+        self.default: GameRNG = None
+        self.guilds: typing.Dict[int, GameRNG] = {}
+        self.seed()
+
+    def configure(self, config: dict):
+        self.per_guild = config.get("per_guild", False)
+        self.block_size = config.get("block_size", 4096)
+        seed = config.get("seed")
+        if seed is None or seed == "":
+            self.seed(None)
+            return
+
+        # Quoted seeds are fine, but numpy only takes non-negative integers, and random.Random anything hashable.
+        try:
+            seed = int(str(seed))
+            if seed < 0:
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"rng.seed must be a non-negative integer, not {config['seed']!r}") from None
+        self.seed(seed)
+
+    def seed(self, seed: typing.Optional[int] = None):
+        """Restart every stream from this seed, or from a random one."""
+        self.base_seed = seed if seed is not None else int.from_bytes(os.urandom(8), "little")
+        self.default = GameRNG(self.base_seed, self.block_size)
+        self.guilds = {}
+
+    def for_guild(self, guild: typing.Optional[discord.Guild]) -> GameRNG:
+        if not self.per_guild or guild is None:
+            return self.default
+
+        rng = self.guilds.get(guild.id)
+        if rng is None:
+            digest = hashlib.blake2b(f"{self.base_seed}:{guild.id}".encode(), digest_size=8).digest()
+            rng = self.guilds[guild.id] = GameRNG(int.from_bytes(digest, "little"), self.block_size)
+        return rng
+
+
+game_rng = GameRNGs()
@@ -0,0 +1,153 @@
+"""
+Background queue for the game roles (infected, cured, dead...).
+
+Commands and listeners only enqueue the changes they want. A worker task merges every pending change for a member,
+and applies what differs from the member roles while respecting a per-guild edit rate, so the game never waits for
+the Discord API to hand out a role.
+
+Roles can be exclusive, like the game states: giving one of them removes the others of its group, so an infected then
+dead player within the coalescing window only gets the dead role. Only the difference is sent, with one role added or
+removed per request, so roles changed meanwhile by a moderator or another bot are left alone.
+"""
+import asyncio
+import time
+import typing
+
+import discord
+
+from utils.interaction import get_member
+
+if typing.TYPE_CHECKING:
+    from utils.bot_class import MyBot
+
+
+class RoleUpdater:
+    def __init__(self, bot: 'MyBot'):
+        self.bot = bot
+
+        # (guild_id, member_id) -> {role_id: True to add the role, False to remove it}
+        self.pending: typing.Dict[typing.Tuple[int, int], typing.Dict[int, bool]] = {}
+        self.reasons: typing.Dict[typing.Tuple[int, int], typing.List[str]] = {}
+
+        self.next_edit_at: typing.Dict[int, float] = {}
+        self.wakeup = asyncio.Event()
+        self.task: typing.Optional[asyncio.Future] = None
+
+        self.queued = 0
+        self.superseded = 0
+        self.applied = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def config(self) -> dict:
+        return self.bot.config.get("roles", {})
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def add(self, member: typing.Union[discord.Member, discord.User], role_id: int, reason: str = None):
+        self.enqueue(member, role_id, True, reason)
+
+    def remove(self, member: typing.Union[discord.Member, discord.User], role_id: int, reason: str = None):
+        self.enqueue(member, role_id, False, reason)
+
+    def set_exclusive(self, member: typing.Union[discord.Member, discord.User], group: typing.Iterable[int], role_id: typing.Optional[int], reason: str = None):
+        """Give role_id, and remove every other role of the group. With role_id None, all of them are removed."""
+        for group_role_id in group:
+            self.enqueue(member, group_role_id, group_role_id == role_id, reason)
+
+    def enqueue(self, member: typing.Union[discord.Member, discord.User], role_id: int, add: bool, reason: str = None):
+        guild = getattr(member, "guild", None)
+        if guild is None or member.discriminator == "0000":
+            # Webhooks and users outside of a guild can't get roles.
+            return
+
+        key = (guild.id, member.id)
+        changes = self.pending.setdefault(key, {})
+        if role_id in changes and changes[role_id] != add:
+            # The latest request for a role wins.
+            self.superseded += 1
+        changes[role_id] = add
+
+        if reason and reason not in self.reasons.setdefault(key, []):
+            self.reasons[key].append(reason)
+
+        self.queued += 1
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+
+            # Give some time for other changes to come in, so they can be merged in the same edit.
+            await asyncio.sleep(self.config().get("coalesce_window", 2))
+            self.wakeup.clear()
+
+            pending, self.pending = self.pending, {}
+            reasons, self.reasons = self.reasons, {}
+
+            by_guild: typing.Dict[int, typing.List[typing.Tuple[int, typing.Dict[int, bool]]]] = {}
+            for (guild_id, member_id), changes in pending.items():
+                by_guild.setdefault(guild_id, []).append((member_id, changes))
+
+            results = await asyncio.gather(*(self.flush_guild(guild_id, members, reasons) for guild_id, members in by_guild.items()),
+                                           return_exceptions=True)
+            for result in results:
+                # This task is the only one applying roles, it must survive anything.
+                if isinstance(result, Exception):
+                    self.bot.logger.error(f"Role updates failed: {result!r}")
+
+    async def wait_for_guild(self, guild_id: int):
+        interval = 1 / self.config().get("guild_edits_per_second", 5)
+        now = time.monotonic()
+        next_edit_at = max(self.next_edit_at.get(guild_id, now), now)
+        self.next_edit_at[guild_id] = next_edit_at + interval
+
+        if next_edit_at > now:
+            await asyncio.sleep(next_edit_at - now)
+
+    async def flush_guild(self, guild_id: int, members: typing.List[typing.Tuple[int, typing.Dict[int, bool]]], reasons: dict):
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            self.failed += len(members)
+            return
+
+        for member_id, changes in members:
+            reason = ", ".join(reasons.get((guild_id, member_id), [])) or None
+            try:
+                await self.apply(guild, member_id, changes, reason)
+            except discord.HTTPException as e:
+                self.failed += 1
+                self.bot.logger.warning(f"Couldn't update roles of {member_id}: {e}", guild=guild)
+            except Exception:
+                self.failed += 1
+                self.bot.logger.exception(f"Couldn't update roles of {member_id}", guild=guild)
+
+    async def apply(self, guild: discord.Guild, member_id: int, changes: typing.Dict[int, bool], reason: str = None):
+        member = await get_member(guild, member_id)
+        if member is None:
+            self.failed += 1
+            return
+
+        current_roles = {role.id for role in member.roles}
+        to_add = [guild.get_role(role_id) for role_id, add in changes.items() if add and role_id not in current_roles]
+        to_add = [role for role in to_add if role is not None]
+        to_remove = [discord.Object(role_id) for role_id, add in changes.items() if not add and role_id in current_roles]
+
+        if not to_add and not to_remove:
+            self.skipped += 1
+            return
+
+        # One request per role, so the roles that aren't part of the changes can't be overwritten.
+        for roles, change in ((to_add, member.add_roles), (to_remove, member.remove_roles)):
+            for role in roles:
+                await self.wait_for_guild(guild.id)
+                with self.bot.metrics.timer("rest", "member_role"):
+                    await change(role, reason=reason)
+        self.applied += 1
@@ -0,0 +1,131 @@
+"""
+Game effects that happen later: a vaccine kicking in after a while, the end of a quarantine...
+
+Pending effects are stored in the database (models.ScheduledEffect) so that they survive restarts, and in memory in a
+single min-heap ordered by due time, instead of a sleeping task per effect. Every tick pops the due effects in a batch,
+applies them to their players, then saves the players and deletes the effects in the same transaction.
+
+When the shards are split between processes, only the leader cluster applies effects. The other ones only store them,
+and the leader polls the effects created since its previous poll.
+"""
+import datetime
+import heapq
+import typing
+
+from tortoise.transactions import in_transaction
+
+from utils.models import Player, ScheduledEffect
+from utils.rng import GameRNG
+
+# Polls look this far before the previous one, for the effects committed a bit after they were created.
+POLL_OVERLAP = datetime.timedelta(seconds=60)
+
+# effect(player, value, rng) -> outcome, None when nothing happened
+Effect = typing.Callable[[Player, int, GameRNG], typing.Optional[str]]
+
+
+def naive_utc(moment: datetime.datetime) -> datetime.datetime:
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+class EffectScheduler:
+    def __init__(self, bot, effects: typing.Dict[str, Effect], batch_size: int = 1000):
+        self.bot = bot
+        self.effects = effects
+        self.batch_size = batch_size
+        # (due at, effect id, player id, effect, value)
+        self.heap: typing.List[typing.Tuple[datetime.datetime, int, int, str, int]] = []
+        # Ids of the effects in the heap.
+        self.pending_ids: typing.Set[int] = set()
+        self.applied = 0
+        self.loaded = False
+        self.polled_at: typing.Optional[datetime.datetime] = None
+
+    async def load(self) -> int:
+        """Read the pending effects from the database, returns how many there are."""
+        self.polled_at = datetime.datetime.utcnow()
+        rows = await ScheduledEffect.all().values_list("due_at", "id", "player_id", "effect", "value")
+        self.heap = [(naive_utc(due_at), effect_id, player_id, effect, value) for due_at, effect_id, player_id, effect, value in rows]
+        heapq.heapify(self.heap)
+        self.pending_ids = {effect_id for _, effect_id, _, _, _ in self.heap}
+        self.loaded = True
+        return len(self.heap)
+
+    async def poll(self) -> int:
+        """Read the effects scheduled by the other clusters since the last poll, returns how many there were."""
+        now = datetime.datetime.utcnow()
+        rows = await ScheduledEffect.filter(created_at__gte=self.polled_at - POLL_OVERLAP).values_list("due_at", "id", "player_id", "effect", "value")
+        self.polled_at = now
+
+        new = 0
+        for due_at, effect_id, player_id, effect, value in rows:
+            if effect_id not in self.pending_ids:
+                self.push((naive_utc(due_at), effect_id, player_id, effect, value))
+                new += 1
+        return new
+
+    def push(self, entry: typing.Tuple[datetime.datetime, int, int, str, int]):
+        heapq.heappush(self.heap, entry)
+        self.pending_ids.add(entry[1])
+
+    async def schedule(self, player_id: int, effect: str, delay: datetime.timedelta, value: int = 0) -> ScheduledEffect:
+        if effect not in self.effects:
+            raise ValueError(f"Unknown effect {effect}")
+
+        scheduled = await ScheduledEffect.create(player_id=player_id, effect=effect, value=value, due_at=datetime.datetime.utcnow() + delay)
+        if self.bot.cluster.is_leader:
+            self.push((naive_utc(scheduled.due_at), scheduled.id, player_id, effect, value))
+        return scheduled
+
+    def next_due(self) -> typing.Optional[datetime.datetime]:
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now: datetime.datetime) -> list:
+        due = []
+        heap = self.heap
+        while heap and heap[0][0] <= now and len(due) < self.batch_size:
+            entry = heapq.heappop(heap)
+            self.pending_ids.discard(entry[1])
+            due.append(entry)
+        return due
+
+    async def tick(self, now: datetime.datetime = None) -> typing.List[typing.Tuple[Player, str, str]]:
+        """
+        Apply a batch of due effects. Returns (player, effect, outcome) for the effects that did something.
+        """
+        due = self.pop_due(now or datetime.datetime.utcnow())
+        if not due:
+            return []
+
+        try:
+            player_ids = {player_id for _, _, player_id, _, _ in due}
+            async with self.bot.db.lock_players(*player_ids):
+                players = {player.discord_id: player for player in await self.bot.db.get_players(player_ids)}
+                rng = self.bot.rng.for_guild(None)
+                changed = {}
+                applied = []
+                for _, _, player_id, effect, value in due:
+                    player = players.get(player_id)
+                    function = self.effects.get(effect)
+                    if player is None or function is None:
+                        self.bot.logger.warning(f"Dropping the scheduled {effect} of player {player_id}")
+                        continue
+
+                    outcome = function(player, value, rng)
+                    if outcome is not None:
+                        changed[player_id] = player
+                        applied.append((player, effect, outcome))
+
+                async with in_transaction() as connection:
+                    await self.bot.db.save_players(changed.values(), using_db=connection)
+                    await ScheduledEffect.filter(id__in=[effect_id for _, effect_id, _, _, _ in due]).using_db(connection).delete()
+        except BaseException:
+            # Nothing was applied in the database (the players were busy, or the tick was cancelled), try again next tick.
+            for entry in due:
+                self.push(entry)
+            raise
+
+        self.applied += len(due)
+        return applied
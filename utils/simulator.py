@@ -0,0 +1,208 @@
+"""
+Offline epidemic simulator, to try balancing changes before they reach production.
+
+A synthetic population is created with the same traits as Database.get_player, then simulated days of chat go through
+the real game rules (utils.game_rules): infection from the contact graph (utils.contacts), tests, found items and hugs.
+No discord and no database are involved, players live in memory.
+
+Usage:
+    python -m utils.simulator --players 100000 --messages 1000000 --days 7
+    python -m utils.simulator --sweep infected_neighbour=4,8,12 --sweep divisor=3,4 --seeds 3 --output curves.csv
+
+Sweeps run every combination of the InfectionRules values given, in a process pool.
+"""
+import argparse
+import collections
+import csv
+import datetime
+import itertools
+import multiprocessing
+import random
+import sys
+import time
+import typing
+
+from utils import game_rules, models
+from utils.contacts import ContactGraph
+from utils.formats import TabularData
+from utils.rng import GameRNG
+
+START = datetime.datetime(2020, 4, 1)
+
+
+class SimulationParameters(typing.NamedTuple):
+    players: int = 10000
+    messages: int = 100000
+    days: float = 7
+    channels: int = 100
+    initial_infected: int = 10
+    hug_rate: float = 0.01
+    sample_every: float = 1  # hours
+    seed: int = 0
+    rules: game_rules.InfectionRules = game_rules.DEFAULT_INFECTION_RULES
+
+
+class SimulationResult(typing.NamedTuple):
+    parameters: SimulationParameters
+    # (hour, infected, dead, cured)
+    curve: typing.List[typing.Tuple[float, int, int, int]]
+    elapsed: float
+
+
+def create_population(count: int, rng: GameRNG) -> typing.List[models.Player]:
+    players = []
+    for discord_id in range(1, count + 1):
+        player = models.Player(discord_id=discord_id, discord_name=f"Player {discord_id}", touched_last=START - datetime.timedelta(days=1),
+                               **game_rules.new_player_traits(rng))
+        player.inventory = models.Inventory(player_id=discord_id)
+        player.achievements = models.Achievements(player_id=discord_id)
+        player.statistics = models.Statistics(player_id=discord_id)
+        players.append(player)
+    return players
+
+
+def player_state(player: models.Player) -> typing.Tuple[bool, bool, bool]:
+    dead = player.is_dead()
+    return player.is_infected() and not dead, dead, player.cured
+
+
+def simulate(parameters: SimulationParameters) -> SimulationResult:
+    started = time.perf_counter()
+    game_rng = GameRNG(parameters.seed)
+    traffic = random.Random(parameters.seed)
+
+    players = create_population(parameters.players, game_rng)
+    for player in traffic.sample(players, min(parameters.initial_infected, len(players))):
+        player.infect(rng=game_rng)
+
+    counts = collections.Counter()
+    for player in players:
+        infected, dead, cured = player_state(player)
+        counts["infected"] += infected
+        counts["dead"] += dead
+        counts["cured"] += cured
+
+    def update_counts(before, after):
+        for key, was, now in zip(("infected", "dead", "cured"), before, after):
+            counts[key] += now - was
+
+    # Some players talk a lot more than others, mostly in their own channel.
+    activity = [traffic.paretovariate(1.2) for _ in players]
+    home_channels = [traffic.randrange(parameters.channels) for _ in players]
+    contacts = ContactGraph()
+
+    infection_table = game_rules.InfectionTable(parameters.rules)
+    seconds_per_message = parameters.days * 86400 / parameters.messages
+    sample_every = parameters.sample_every * 3600
+    next_sample = 0.0
+    curve = []
+    batch_size = 10000
+
+    for batch_start in range(0, parameters.messages, batch_size):
+        batch = min(batch_size, parameters.messages - batch_start)
+        authors = traffic.choices(range(len(players)), weights=activity, k=batch)
+        for i, author in enumerate(authors):
+            now = (batch_start + i) * seconds_per_message
+            if now >= next_sample:
+                curve.append((now / 3600, counts["infected"], counts["dead"], counts["cured"]))
+                next_sample += sample_every
+
+            channel = home_channels[author] if traffic.random() < 0.8 else traffic.randrange(parameters.channels)
+            player = players[author]
+            before = player_state(player)
+
+            # Same as the message pipeline: contacts, infection, test, then find.
+            history = contacts.channels.get(channel)
+            last_speaker = history[-1][1] if history else None
+            contacts.set_infectious(author, player.is_infected())
+            contacts.record(channel, author, now)
+            if not player.is_dead() and not player.achievements.vaccined:
+                game_rules.roll_exposure(player, contacts.pressure(author), game_rng, infection_table)
+            game_rules.roll_test(player, game_rng)
+            game_rules.roll_find(player, game_rng)
+
+            if last_speaker is not None and traffic.random() < parameters.hug_rate:
+                target = players[last_speaker]
+                sim_now = START + datetime.timedelta(seconds=now)
+                if target is not player and not player.is_dead() and player.can_be_touched(sim_now) and target.can_be_touched(sim_now):
+                    target_before = player_state(target)
+                    player.touched_last = target.touched_last = sim_now
+                    game_rules.hug_contagion(player, target, game_rng)
+                    update_counts(target_before, player_state(target))
+                    contacts.set_infectious(target.discord_id - 1, target.is_infected())
+
+            update_counts(before, player_state(player))
+            contacts.set_infectious(author, player.is_infected())
+
+    curve.append((parameters.days * 24, counts["infected"], counts["dead"], counts["cured"]))
+    return SimulationResult(parameters, curve, time.perf_counter() - started)
+
+
+def parse_sweeps(sweeps: typing.List[str]) -> typing.List[game_rules.InfectionRules]:
+    values = {}
+    for sweep in sweeps:
+        name, _, options = sweep.partition("=")
+        if name not in game_rules.InfectionRules._fields:
+            raise SystemExit(f"Unknown infection rule {name}, try one of {', '.join(game_rules.InfectionRules._fields)}")
+        values[name] = [float(option) for option in options.split(",")]
+
+    names = list(values)
+    return [game_rules.DEFAULT_INFECTION_RULES._replace(**dict(zip(names, combination)))
+            for combination in itertools.product(*values.values())]
+
+
+def report(results: typing.List[SimulationResult], swept: typing.List[str]):
+    table = TabularData()
+    table.set_columns(swept + ["Seed", "Peak infected", "Peak hour", "Dead", "Cured", "Time (s)"])
+    for result in results:
+        peak = max(result.curve, key=lambda point: point[1])
+        final = result.curve[-1]
+        table.add_row([getattr(result.parameters.rules, name) for name in swept] +
+                      [result.parameters.seed, peak[1], f"{peak[0]:.0f}", final[2], final[3], f"{result.elapsed:.1f}"])
+    print(table.render())
+
+
+def write_curves(results: typing.List[SimulationResult], path: str):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(list(game_rules.InfectionRules._fields) + ["seed", "hour", "infected", "dead", "cured"])
+        for result in results:
+            for point in result.curve:
+                writer.writerow(list(result.parameters.rules) + [result.parameters.seed] + list(point))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate the epidemic offline, with the real game rules.")
+    parser.add_argument("--players", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--channels", type=int, default=100)
+    parser.add_argument("--initial-infected", type=int, default=10)
+    parser.add_argument("--hug-rate", type=float, default=0.01, help="fraction of the messages followed by a hug")
+    parser.add_argument("--sample-every", type=float, default=1, help="hours between two points of the curves")
+    parser.add_argument("--sweep", action="append", default=[], metavar="RULE=V1,V2", help="infection rule values to try")
+    parser.add_argument("--seeds", type=int, default=1, help="number of runs with different seeds for every combination")
+    parser.add_argument("--processes", type=int, default=None, help="size of the process pool, one per CPU by default")
+    parser.add_argument("--output", help="write the curves to this CSV file")
+    args = parser.parse_args(argv)
+
+    runs = [SimulationParameters(players=args.players, messages=args.messages, days=args.days, channels=args.channels,
+                                 initial_infected=args.initial_infected, hug_rate=args.hug_rate,
+                                 sample_every=args.sample_every, seed=seed, rules=rules)
+            for rules in parse_sweeps(args.sweep) for seed in range(args.seeds)]
+
+    if len(runs) == 1:
+        results = [simulate(runs[0])]
+    else:
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.map(simulate, runs)
+
+    report(results, [sweep.partition("=")[0] for sweep in args.sweep])
+    if args.output:
+        write_curves(results, args.output)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+import math
+
+from utils.contacts import ContactGraph
+
+
+def test_record_links_recent_speakers():
+    contacts = ContactGraph(window=60)
+    contacts.record(1, 10, 0)
+    contacts.record(1, 11, 30)
+    # 10 spoke more than window seconds ago.
+    assert contacts.record(1, 12, 80) == {11}
+    assert {user_id for user_id, _ in contacts.contacts(11)} == {10, 12}
+    # Other channels don't count.
+    assert contacts.record(2, 13, 81) == set()
+
+
+def test_weights_decay_with_half_life():
+    contacts = ContactGraph(half_life=100, contact_weight=0.5, max_weight=1.0)
+    contacts.record(1, 10, 0)
+    contacts.record(1, 11, 0)
+    contacts.now = 100
+    [(neighbour, weight)] = contacts.contacts(10)
+    assert neighbour == 11
+    assert math.isclose(weight, 0.25)
+
+
+def test_weights_are_capped():
+    contacts = ContactGraph(contact_weight=0.6, max_weight=1.0)
+    for _ in range(5):
+        contacts.record(1, 10, 0)
+        contacts.record(1, 11, 0)
+    assert contacts.contacts(10) == [(11, 1.0)]
+
+
+def test_pressure_follows_infectious_contacts():
+    contacts = ContactGraph(half_life=100)
+    contacts.record(1, 10, 0)
+    contacts.record(1, 11, 0)
+    contacts.record(1, 12, 0)
+    assert contacts.pressure(12) == 0
+
+    contacts.set_infectious(10, True)
+    assert math.isclose(contacts.pressure(12), 1.0)
+    contacts.set_infectious(11, True)
+    assert math.isclose(contacts.pressure(12), 2.0)
+
+    contacts.now = 100
+    assert math.isclose(contacts.pressure(12), 1.0)
+
+    contacts.set_infectious(10, False)
+    assert math.isclose(contacts.pressure(12), 0.5)
+
+
+def test_pressure_grows_with_reinforced_edges():
+    contacts = ContactGraph(half_life=100, contact_weight=0.5, max_weight=1.0)
+    contacts.set_infectious(10, True)
+    contacts.record(1, 10, 0)
+    contacts.record(1, 11, 0)
+    assert math.isclose(contacts.pressure(11), 0.5)
+    contacts.record(1, 11, 0)
+    assert math.isclose(contacts.pressure(11), 1.0)
+
+
+def test_expired_edges_are_pruned():
+    contacts = ContactGraph(window=10, half_life=10, prune_below=0.25, max_weight=1.0)
+    contacts.set_infectious(10, True)
+    contacts.record(1, 10, 0)
+    contacts.record(1, 11, 0)
+    assert contacts.stats()["edges"] == 1
+
+    # Two half lives later, the edge is down to prune_below.
+    contacts.record(2, 12, contacts.expiry + 1)
+    assert contacts.stats()["edges"] == 0
+    assert contacts.contacts(11) == []
+    assert contacts.pressure(11) == 0
+    # The speakers are forgotten too, with their state.
+    assert contacts.stats()["infectious"] == 0
+
+
+def test_reinforced_edges_are_kept():
+    contacts = ContactGraph(window=1000, half_life=10, prune_below=0.25, max_weight=1.0)
+    contacts.record(1, 10, 0)
+    contacts.record(1, 11, 0)
+    contacts.record(1, 10, contacts.expiry - 1)
+    contacts.record(2, 12, contacts.expiry + 1)
+    assert [user_id for user_id, _ in contacts.contacts(11)] == [10]
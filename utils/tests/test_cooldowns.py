@@ -0,0 +1,47 @@
+import asyncio
+
+from utils.cooldowns import MemoryCooldownStore
+
+
+def take(store, buckets, now):
+    return asyncio.new_event_loop().run_until_complete(store.take(buckets, now))
+
+
+def test_tokens_come_back():
+    store = MemoryCooldownStore()
+    bucket = [("work:2/600:user:1", 2, 600)]
+    assert take(store, bucket, 1000) == [0.0]
+    assert take(store, bucket, 1000) == [0.0]
+    # Empty, one token comes back every 300 seconds.
+    assert take(store, bucket, 1000) == [300.0]
+    assert take(store, bucket, 1150) == [150.0]
+    assert take(store, bucket, 1300) == [0.0]
+
+
+def test_refill_is_capped():
+    store = MemoryCooldownStore()
+    bucket = [("work:2/600:user:1", 2, 600)]
+    take(store, bucket, 1000)
+    # Long after, the bucket only holds rate tokens.
+    assert take(store, bucket, 100000) == [0.0]
+    assert take(store, bucket, 100000) == [0.0]
+    assert take(store, bucket, 100000) == [300.0]
+
+
+def test_stacked_buckets_take_all_or_nothing():
+    store = MemoryCooldownStore()
+    short, long = ("a", 2, 10), ("b", 1, 100)
+    assert take(store, [short, long], 1000) == [0.0, 0.0]
+    assert take(store, [short, long], 1001) == [0.0, 99.0]
+    # The refused use didn't take from the first bucket.
+    assert take(store, [short], 1001) == [0.0]
+    assert take(store, [short], 1001) == [4.0]
+
+
+def test_full_buckets_are_pruned():
+    store = MemoryCooldownStore()
+    take(store, [("a", 2, 10)], 1000)
+    loop = asyncio.new_event_loop()
+    assert loop.run_until_complete(store.prune(1004)) == 0
+    assert loop.run_until_complete(store.prune(1005)) == 1
+    assert store.buckets == {}
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+
+import pytest
+
+from utils.coordinator import LockTable, LockTimeout
+
+
+def run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+def test_locks_are_exclusive():
+    async def scenario():
+        table = LockTable(logging.getLogger("test"))
+        lease = await table.acquire(["a", "b"], lease=10, timeout=1)
+        with pytest.raises(LockTimeout):
+            await table.acquire(["b"], lease=10, timeout=0.01)
+        # Unrelated keys are free.
+        await table.acquire(["c"], lease=10, timeout=0.01)
+
+        assert table.release(lease.token)
+        await table.acquire(["b"], lease=10, timeout=0.01)
+        assert table.timeouts == 1
+    run(scenario())
+
+
+def test_expired_leases_are_released():
+    async def scenario():
+        table = LockTable(logging.getLogger("test"))
+        lease = await table.acquire(["a"], lease=0.01, timeout=1)
+        # Waits for the expiry.
+        await table.acquire(["a"], lease=10, timeout=1)
+        assert table.expired == 1
+        # Too late for its holder.
+        assert not table.release(lease.token)
+    run(scenario())
+
+
+def test_held_leases_expire_quietly():
+    async def scenario():
+        table = LockTable(logging.getLogger("test"))
+        await table.acquire(["identify:0"], lease=0.01, timeout=1, hold=True)
+        await table.acquire(["identify:0"], lease=10, timeout=1)
+        assert table.expired == 0
+    run(scenario())
+
+
+def test_unused_locks_are_forgotten():
+    async def scenario():
+        table = LockTable(logging.getLogger("test"))
+        lease = await table.acquire(["a", "b"], lease=10, timeout=1)
+        table.release(lease.token)
+        assert table.locks == {}
+        assert not table.users
+    run(scenario())
+
+
+def test_release_request():
+    async def scenario():
+        table = LockTable(logging.getLogger("test"))
+        await table.acquire(["a"], lease=10, timeout=1, owner=1, request=7)
+        assert not table.release_request(2, 7)
+        assert table.release_request(1, 7)
+        assert table.locks == {}
+    run(scenario())
@@ -0,0 +1,70 @@
+import itertools
+
+from utils import game_rules, models
+from utils.rng import GameRNG
+
+
+def make_player(**fields) -> models.Player:
+    player = models.Player(discord_id=138751484517941259, discord_name="Eyesofcreeper#0001", good=models.AlignementGood.neutral,
+                           law=models.AlignementLaw.neutral, charisma=5, **fields)
+    player.achievements = models.Achievements(player_id=player.discord_id)
+    return player
+
+
+def states():
+    return itertools.product((False, True), game_rules.InfectionTable.ISOLATIONS, (False, True), (False, True),
+                             range(game_rules.InfectionTable.MAX_NEIGHBOURS + 1))
+
+
+def test_table_matches_chance_for():
+    table = game_rules.InfectionTable()
+    for state in states():
+        assert table.chances[table.index(*state)] == game_rules.chance_for(table.rules, *state)
+
+
+def test_thresholds_have_the_odds_of_randint():
+    table = game_rules.InfectionTable()
+    for state in states():
+        index = table.index(*state)
+        chance = table.chances[index]
+        # rng.randint(0, 100) <= chance
+        odds = sum(1 for roll in range(101) if roll <= chance) / 101
+        assert abs(table.thresholds[index] - odds) < 1e-12
+
+
+def test_neighbours_are_capped():
+    table = game_rules.InfectionTable()
+    maximum = game_rules.InfectionTable.MAX_NEIGHBOURS
+    isolation = models.Isolation.normal_life.value
+    assert table.index(False, isolation, False, False, maximum + 5) == table.index(False, isolation, False, False, maximum)
+
+
+def test_rules_from_config():
+    table = game_rules.InfectionTable.from_config({"base": 40})
+    isolation = models.Isolation.normal_life.value
+    assert table.rules.base == 40
+    assert table.chances[table.index(False, isolation, False, False, 0)] == game_rules.chance_for(table.rules, False, isolation, False, False, 0)
+
+
+def test_pressure_index_rounds_the_pressure():
+    table = game_rules.InfectionTable()
+    player = make_player(percent_infected=0, immunodeficient=True)
+    assert table.pressure_index(player, 2.4) == table.index(True, player.isolation, False, player.cured, 2)
+    assert table.pressure_index(player, 2.6) == table.index(True, player.isolation, False, player.cured, 3)
+
+
+def test_weighted_successes_keep_the_mean():
+    rng = GameRNG(0)
+    draws = 100000
+    for probability, weight in [(0.05, 2), (0.3, 3.5), (0.9, 2)]:
+        total = 0
+        for _ in range(draws):
+            if rng.random() < game_rules.weighted(probability, weight):
+                total += game_rules.successes(probability, weight, rng)
+        assert abs(total / draws - probability * weight) < 0.02
+
+
+def test_unweighted_successes_draw_nothing():
+    rng = GameRNG(1)
+    assert game_rules.successes(0.5, 1, rng) == 1
+    assert rng.random() == GameRNG(1).random()
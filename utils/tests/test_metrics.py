@@ -0,0 +1,39 @@
+import random
+
+from utils import prometheus
+from utils.metrics import LogHistogram
+
+
+def test_bucket_bounds():
+    for bucket in range(LogHistogram.BUCKETS_COUNT - 1):
+        upper = LogHistogram.bucket_upper_bound(bucket)
+        assert LogHistogram.bucket_for(upper * 0.999) == bucket
+        assert LogHistogram.bucket_for(upper * 1.001) == bucket + 1
+
+
+def test_bucket_edges():
+    assert LogHistogram.bucket_for(0) == 0
+    assert LogHistogram.bucket_for(LogHistogram.MIN_VALUE / 2) == 0
+    assert LogHistogram.bucket_for(1e6) == LogHistogram.BUCKETS_COUNT - 1
+
+
+def test_percentiles():
+    histogram = LogHistogram()
+    for value in range(1, 101):
+        histogram.record(value / 1000)
+    assert histogram.count == 100
+    assert abs(histogram.mean - 0.0505) < 1e-9
+    # Accurate to a bucket width, about 9%.
+    for percent in (50, 90, 99):
+        assert percent / 1000 <= histogram.percentile(percent) <= percent / 1000 * 1.1
+    assert histogram.percentile(100) == 0.1
+
+
+def test_exported_buckets_are_exact():
+    histogram = LogHistogram()
+    rng = random.Random(0)
+    values = [rng.lognormvariate(-5, 2) for _ in range(10000)]
+    for value in values:
+        histogram.record(value)
+    for bound, cutoff in zip(prometheus.EXPORTED_BOUNDS, prometheus.BUCKETS_CUTOFFS):
+        assert sum(histogram.counts[:cutoff]) == sum(1 for value in values if value < bound)
@@ -0,0 +1,42 @@
+import datetime
+
+from utils.scheduler import EffectScheduler, naive_utc
+
+START = datetime.datetime(2020, 4, 1)
+
+
+def make_scheduler(batch_size: int = 1000) -> EffectScheduler:
+    scheduler = EffectScheduler(None, {}, batch_size=batch_size)
+    # Pushed out of order on purpose.
+    for effect_id, minutes in [(1, 30), (2, 10), (3, 20), (4, 10)]:
+        scheduler.push((START + datetime.timedelta(minutes=minutes), effect_id, 100 + effect_id, "vaccine", 0))
+    return scheduler
+
+
+def test_pop_due_in_order():
+    scheduler = make_scheduler()
+    due = scheduler.pop_due(START + datetime.timedelta(minutes=20))
+    assert [effect_id for _, effect_id, _, _, _ in due] == [2, 4, 3]
+    assert scheduler.pending_ids == {1}
+    assert scheduler.next_due() == START + datetime.timedelta(minutes=30)
+
+
+def test_pop_due_leaves_the_future_effects():
+    scheduler = make_scheduler()
+    assert scheduler.pop_due(START) == []
+    assert scheduler.pending_ids == {1, 2, 3, 4}
+
+
+def test_pop_due_in_batches():
+    scheduler = make_scheduler(batch_size=2)
+    later = START + datetime.timedelta(hours=1)
+    assert [entry[1] for entry in scheduler.pop_due(later)] == [2, 4]
+    assert [entry[1] for entry in scheduler.pop_due(later)] == [3, 1]
+    assert scheduler.pop_due(later) == []
+    assert scheduler.next_due() is None
+
+
+def test_naive_utc():
+    aware = datetime.datetime(2020, 4, 1, 14, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+    assert naive_utc(aware) == datetime.datetime(2020, 4, 1, 12)
+    assert naive_utc(START) == START
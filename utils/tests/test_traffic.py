@@ -0,0 +1,35 @@
+from utils.traffic import Anonymizer
+
+
+def test_ids_are_consistent_per_key():
+    anonymizer = Anonymizer(b"key")
+    hashed = anonymizer.id(138751484517941259)
+    assert hashed == anonymizer.id(138751484517941259) == Anonymizer(b"key").id(138751484517941259)
+    assert hashed != Anonymizer(b"other key").id(138751484517941259)
+    assert hashed != 138751484517941259
+    assert hashed > 0 and hashed % 2
+    assert anonymizer.id(0) == anonymizer.id(None) == 0
+
+
+def test_text_keeps_its_shape():
+    anonymizer = Anonymizer(b"key")
+    user_id = anonymizer.id(138751484517941259)
+    role_id = anonymizer.id(694973756359311433)
+    text = anonymizer.text("hug <@!138751484517941259> <@&694973756359311433> 🧻 5")
+    assert text == f"hug <@!{user_id}> <@&{role_id}> 🧻 5".replace("hug", str(anonymizer.hash("hug")))
+
+
+def test_free_text_is_hashed():
+    anonymizer = Anonymizer(b"key")
+    text = anonymizer.text("Eyesofcreeper#0001 138751484517941259")
+    assert "Eyesofcreeper" not in text
+    assert "138751484517941259" not in text
+    assert text.split()[1] == str(anonymizer.id(138751484517941259))
+
+
+def test_item_emojis_are_kept():
+    anonymizer = Anonymizer(b"key")
+    assert anonymizer.word("🧼") == "🧼"
+    # Clients add a variation selector to some of them.
+    assert anonymizer.word("✈\ufe0f") == "✈\ufe0f"
+    assert anonymizer.word("❤") == str(anonymizer.hash("❤"))
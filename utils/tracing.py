@@ -0,0 +1,177 @@
+"""
+Sampled tracing of the message pipeline.
+
+A trace is started when a message is dispatched, and a fraction (`sample_rate`) of them are recorded. The current span
+is kept in a context variable, so it follows the awaits and is copied into the listener tasks discord.py creates for the
+message. Every Metrics.timer opens a span, so commands, pipeline stages, database and REST calls all show up.
+
+Recorded traces are appended to a file in the Chrome trace-event format, which opens in chrome://tracing or
+https://ui.perfetto.dev. Each asyncio task of a trace gets its own row.
+
+A trace is written once, when its last span is done. Tasks that copied its context can still run after that, like
+deferred logs or role updates: the spans they open are not recorded, only counted.
+"""
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import os
+import random
+import time
+import typing
+
+import rapidjson
+
+current_span: contextvars.ContextVar[typing.Optional['Span']] = contextvars.ContextVar("current_span", default=None)
+
+
+class Trace:
+    __slots__ = ('tracer', 'name', 'root', 'open_spans', 'events', 'tids', 'end', 'written')
+
+    def __init__(self, tracer: 'Tracer', name: str):
+        self.tracer = tracer
+        self.name = name
+        self.root: typing.Optional[Span] = None
+        self.open_spans = 0
+        self.events: typing.List[dict] = []
+        # asyncio task -> row in the trace viewer.
+        self.tids: typing.Dict[typing.Optional[asyncio.Task], int] = {}
+        self.end = 0.0
+        self.written = False
+
+    def tid_for_current_task(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+
+        tid = self.tids.get(task)
+        if tid is None:
+            tid = self.tids[task] = next(self.tracer.tids)
+            task_name = task.get_coro().__qualname__ if task is not None else "main"
+            self.events.append({"name": "thread_name", "ph": "M", "pid": self.tracer.pid, "tid": tid,
+                                "args": {"name": f"{self.name} / {task_name}"}})
+        return tid
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'args', 'tid', 'start', 'token')
+
+    def __init__(self, trace: Trace, name: str, args: dict):
+        self.trace = trace
+        self.name = name
+        self.args = args
+        self.tid = trace.tid_for_current_task()
+        self.start = time.perf_counter()
+        self.token = None
+
+
+def start_span(name: str, **args) -> typing.Optional[Span]:
+    """
+    Open a span under the current one. Returns None, at almost no cost, when the current trace isn't sampled.
+    """
+    parent = current_span.get()
+    if parent is None:
+        return None
+
+    if parent.trace.written:
+        parent.trace.tracer.late_spans += 1
+        return None
+
+    span = Span(parent.trace, name, args)
+    span.trace.open_spans += 1
+    span.token = current_span.set(span)
+    return span
+
+
+def finish_span(span: typing.Optional[Span]):
+    if span is None:
+        return
+
+    end = time.perf_counter()
+    current_span.reset(span.token)
+    trace = span.trace
+    trace.end = max(trace.end, end)
+    trace.events.append(span_event(span, end))
+
+    release(trace)
+
+
+def release(trace: Trace):
+    trace.open_spans -= 1
+    if trace.open_spans == 0:
+        # The root span lasts until everything that was started under it is done.
+        trace.events.append(span_event(trace.root, trace.end))
+        trace.written = True
+        trace.tracer.write(trace)
+
+
+def span_event(span: Span, end: float) -> dict:
+    return {"name": span.name, "ph": "X", "pid": span.trace.tracer.pid, "tid": span.tid,
+            "ts": int(span.start * 1_000_000), "dur": int((end - span.start) * 1_000_000), "args": span.args}
+
+
+@contextlib.contextmanager
+def span(name: str, **args):
+    opened = start_span(name, **args)
+    try:
+        yield opened
+    finally:
+        finish_span(opened)
+
+
+class Tracer:
+    def __init__(self, config: dict):
+        self.sample_rate = config.get("sample_rate", 0.0)
+        self.directory = config.get("directory", "traces")
+        self.pid = os.getpid()
+        self.tids = itertools.count(1)
+        self.file: typing.Optional[typing.TextIO] = None
+
+        self.started = 0
+        self.sampled = 0
+        # Spans opened after their trace was written.
+        self.late_spans = 0
+
+    @contextlib.contextmanager
+    def trace(self, name: str, **args):
+        """
+        Start a trace, recorded if it's sampled. It's written once its root span, and every span opened from it (in
+        this task or in the tasks started under it), are finished.
+        """
+        self.started += 1
+        if current_span.get() is not None or not self.sample_rate or random.random() >= self.sample_rate:
+            yield None
+            return
+
+        self.sampled += 1
+        trace = Trace(self, name)
+        root = trace.root = Span(trace, name, args)
+        trace.open_spans += 1
+        root.token = current_span.set(root)
+        try:
+            yield root
+        finally:
+            current_span.reset(root.token)
+            trace.end = time.perf_counter()
+            # Tasks created under the root only open their spans once they start running, so wait for them to start.
+            asyncio.get_event_loop().call_soon(release, trace)
+
+    def write(self, trace: Trace):
+        if self.file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"trace-{time.strftime('%Y%m%d-%H%M%S')}-{self.pid}.json")
+            # The JSON array format doesn't need the closing bracket, so a crash doesn't leave an unreadable file.
+            self.file = open(path, "w", encoding="utf-8")
+            self.file.write("[\n")
+        else:
+            self.file.write(",\n")
+
+        self.file.write(",\n".join(rapidjson.dumps(event, ensure_ascii=False) for event in trace.events))
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.write("\n]\n")
+            self.file.close()
+            self.file = None
@@ -0,0 +1,127 @@
+"""
+Record incoming messages to a compact, anonymized, append-only binary trace, to replay load incidents later with
+`python -m benchmarks.replay`.
+
+Every record is a fixed size header followed by the command text:
+    timestamp (double), guild id, channel id, author id (unsigned 64 bits), is a command (bool), text length (unsigned 16 bits)
+Ids are replaced by a keyed hash, so they stay consistent within a trace without revealing who talked where. Only the
+command name and arguments are kept, never the content of other messages. Every word of the arguments is hashed the
+same way (ids, mentions, names typed by the players...), except short numbers and the item emojis, which can't tell
+anything about anyone, and let `use` and `buy` replay the same way.
+"""
+import hashlib
+import os
+import re
+import struct
+import typing
+
+import discord
+
+from utils.models import ItemsEmojis
+
+MAGIC = b"CRTRACE1"
+RECORD = struct.Struct("<dQQQ?H")
+ID_PATTERN = re.compile(r"\d{15,21}")
+MENTION_PATTERN = re.compile(r"<(@!?|@&|#)(\d{15,21})>")
+ITEM_EMOJIS = frozenset(item.value for item in ItemsEmojis)
+
+
+class TrafficRecord(typing.NamedTuple):
+    timestamp: float
+    guild_id: int
+    channel_id: int
+    author_id: int
+    is_command: bool
+    text: str
+
+
+class Anonymizer:
+    def __init__(self, key: bytes):
+        self.key = key
+        # snowflake or word -> hash
+        self.cache: typing.Dict[typing.Union[int, str], int] = {}
+
+    def hash(self, value: typing.Union[int, str]) -> int:
+        hashed = self.cache.get(value)
+        if hashed is None:
+            data = value.to_bytes(8, "little") if isinstance(value, int) else value.encode()
+            digest = hashlib.blake2b(data, key=self.key, digest_size=8).digest()
+            # Keep it positive and away from 0, it's used as a snowflake when replaying.
+            hashed = self.cache[value] = (int.from_bytes(digest, "little") >> 1) | 1
+            if len(self.cache) > 100000:
+                self.cache.clear()
+        return hashed
+
+    def id(self, snowflake: typing.Optional[int]) -> int:
+        if not snowflake:
+            return 0
+        return self.hash(snowflake)
+
+    def word(self, word: str) -> str:
+        mention = MENTION_PATTERN.fullmatch(word)
+        if mention:
+            return f"<{mention.group(1)}{self.id(int(mention.group(2)))}>"
+        if word.isdigit():
+            return str(self.id(int(word))) if ID_PATTERN.fullmatch(word) else word
+        if word.replace("\ufe0f", "") in ITEM_EMOJIS:
+            return word
+        # Names, nicknames, name#discriminator, and any other text. Replayed, it's an unknown id.
+        return str(self.hash(word))
+
+    def text(self, text: str) -> str:
+        return " ".join(self.word(word) for word in text.split())
+
+
+class TrafficRecorder:
+    def __init__(self, config: dict):
+        self.enabled = config.get("enabled", False)
+        self.path = config.get("path", "recordings/traffic.bin")
+        key = config.get("key", "")
+        # Without a key, ids are only consistent within the recordings of this process.
+        self.anonymizer = Anonymizer(key.encode() if key else os.urandom(16))
+        self.file: typing.Optional[typing.BinaryIO] = None
+        self.recorded = 0
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    def record(self, message: discord.Message, command_name: typing.Optional[str], arguments: str = ""):
+        if not self.enabled:
+            return
+        if self.file is None:
+            self.open()
+
+        anonymizer = self.anonymizer
+        text = f"{command_name} {anonymizer.text(arguments)}".strip().encode()[:0xFFFF] if command_name else b""
+        self.file.write(RECORD.pack(((message.id >> 22) + discord.utils.DISCORD_EPOCH) / 1000,
+                                    anonymizer.id(message.guild.id if message.guild else None),
+                                    anonymizer.id(message.channel.id),
+                                    anonymizer.id(message.author.id),
+                                    command_name is not None, len(text)) + text)
+        self.recorded += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_trace(path: str) -> typing.Iterator[TrafficRecord]:
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a traffic trace")
+
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return  # End of the file, or a record cut by a crash.
+            timestamp, guild_id, channel_id, author_id, is_command, text_length = RECORD.unpack(header)
+            text = f.read(text_length)
+            if len(text) < text_length:
+                return
+            yield TrafficRecord(timestamp, guild_id, channel_id, author_id, is_command, text.decode())
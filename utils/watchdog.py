@@ -0,0 +1,124 @@
+"""
+Event loop watchdog.
+
+A coroutine beats on the event loop every `interval` seconds, which measures the loop lag. A separate thread watches
+the beats: when the loop didn't beat for more than `threshold` seconds, something is blocking it, and the thread
+captures the stack of the loop thread, i.e. the stack of the callback that is running. Once the loop beats again, the
+stall duration is logged with the offending call site, and kept if it's among the slowest ones.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+import traceback
+import typing
+
+if typing.TYPE_CHECKING:
+    from utils.bot_class import MyBot
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SlowCallback(typing.NamedTuple):
+    duration: float
+    seen_at: float
+    site: str
+    stack: typing.List[str]
+
+
+class LoopWatchdog:
+    def __init__(self, bot: 'MyBot'):
+        self.bot = bot
+        config = bot.config.get("watchdog", {})
+        self.interval = config.get("interval", 0.025)
+        self.threshold = config.get("threshold", 0.1)
+        self.top_size = config.get("top", 10)
+
+        self.loop_thread_id: typing.Optional[int] = None
+        self.last_beat = time.monotonic()
+        self.beats = 0
+        # (beat number, site, stack) captured by the watchdog thread during the current stall.
+        self.captured: typing.Optional[typing.Tuple[int, str, typing.List[str]]] = None
+
+        self.stalls = 0
+        # Min-heap of the slowest callbacks seen, the counter breaks ties.
+        self.slowest: typing.List[typing.Tuple[float, int, SlowCallback]] = []
+        self.counter = itertools.count()
+
+        self.task: typing.Optional[asyncio.Future] = None
+        self.thread: typing.Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.task = asyncio.ensure_future(self.beat())
+        self.thread = threading.Thread(target=self.watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def beat(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - start - self.interval, 0.0)
+
+            self.bot.metrics.loop_lag = lag
+            self.bot.metrics.observe("loop", "lag", lag)
+            self.last_beat = time.monotonic()
+            self.beats += 1
+
+            captured, self.captured = self.captured, None
+            # The watcher captures as soon as the beat is late, the sleep included. Only the real stalls are kept.
+            if captured is not None and lag >= self.threshold:
+                self.record_stall(lag, captured[1], captured[2])
+
+    def watch(self):
+        check_every = self.threshold / 4
+        while not self.stopped.wait(check_every):
+            beat = self.beats
+            if time.monotonic() - self.last_beat < self.threshold or (self.captured and self.captured[0] == beat):
+                continue
+
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+
+            stack = traceback.extract_stack(frame)
+            del frame
+            self.captured = (beat, self.find_call_site(stack), traceback.format_list(stack[-8:]))
+
+    @staticmethod
+    def find_call_site(stack: traceback.StackSummary) -> str:
+        """
+        Innermost frame from the bot code, or the innermost frame if the bot code isn't on the stack.
+        """
+        for frame in reversed(stack):
+            if frame.filename.startswith(PROJECT_ROOT) and "site-packages" not in frame.filename:
+                break
+        else:
+            frame = stack[-1]
+
+        return f"{os.path.relpath(frame.filename, PROJECT_ROOT)}:{frame.lineno} in {frame.name}"
+
+    def record_stall(self, duration: float, site: str, stack: typing.List[str]):
+        self.stalls += 1
+        self.bot.logger.warning("Event loop blocked for %.0fms by %s", duration * 1000, site)
+
+        entry = (duration, next(self.counter), SlowCallback(duration, time.time(), site, stack))
+        if len(self.slowest) < self.top_size:
+            heapq.heappush(self.slowest, entry)
+        elif duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def slowest_callbacks(self) -> typing.List[SlowCallback]:
+        return [entry[2] for entry in sorted(self.slowest, reverse=True)]